@@ -4,8 +4,12 @@ import base64
 import hashlib
 import hmac
 import json
+import logging
 import os
 import re
+import signal
+import sys
+import threading
 import time
 import traceback
 from datetime import datetime
@@ -13,19 +17,15 @@ from textwrap import dedent
 from typing import Optional, Dict, Any, List, Union
 
 from fastapi import FastAPI, Request, Response, HTTPException, status
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field   
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field, ValidationError
 from agno.agent import Agent
 from agno.models.google import Gemini
 from agno.models.openai import OpenAIChat
-from agno.memory.v2.db.postgres import PostgresMemoryDb
 from agno.tools.exa import ExaTools
-from agno.tools.tavily import TavilyTools
-from agno.tools.reasoning import ReasoningTools
-from agno.tools.yfinance import YFinanceTools
 
 from agno.memory.v2.memory import Memory
-from agno.storage.postgres import PostgresStorage 
+from agno.storage.postgres import PostgresStorage
 from agno.media import Image, Video
 from dotenv import load_dotenv
 from telegram import Update
@@ -34,9 +34,38 @@ import requests
 from io import BytesIO
 import uvicorn
 
+from logging_setup import configure_logging, log_payload, new_correlation_id
+from loop_watchdog import start_loop_watchdog
+from metrics import metrics
+from context_cache import context_cache
+from coordination import claim_message, get_coordinator
+from agent_registry import DEFAULT_VARIANT, AgentRegistry, AgentVariant, load_variants
+from db import dispose_engine
+from rate_limit import check_rate_limit
+from history_window import HISTORY_TOKEN_BUDGET, history_settings
+from prompt_assembly import PROMPT_ASSEMBLY, StablePrefixAgent
+from routing import SMALL_TALK, route_turn
+from tool_compaction import compact_tool_result
+from tool_profiles import FULL, build_tool_profiles, estimate_prompt_chars
+from tool_runtime import ParallelToolsOpenAIChat, time_tool_call
+from documents import (
+    DOCUMENT_MAX_BYTES, DocumentError, current_user_id, document_prompt, download_to_file, ingest_document,
+    is_supported_document, new_document_path, shutdown_document_pool,
+)
+from lifecycle import SHUTDOWN_DRAIN_SECONDS, in_flight, on_release, release_resources, tracked
+from media import prepare_image, shutdown_media_pool
+from price_store import refresh_prices
+from replay import format_report, replay_sessions
+from resilience import LLM_DEGRADED_REPLY, CircuitOpenError, ResilientOpenAIChat, get_breaker, guard_tool_call
+from telegram_outbox import PRIORITY_FIRST, close_outbox, get_outbox, send_paragraphs
+from telegram_workers import DRAIN_DEADLINE, ShardedUpdateRouter, start_application, stop_application
+from whatsapp_models import WhatsAppMessage, has_messages, parse_webhook
+
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class ChatResponse(BaseModel):
     messages: List[str] = Field(
         ..., 
@@ -44,41 +73,12 @@ class ChatResponse(BaseModel):
     )
 
 
-# Initialize memory and storage
-def setup_memory_and_storage():
-    """Setup memory and storage for the agent"""
-    # Database file for both memory and storage
-    db_url = os.getenv("DATABASE_URL")
-    
-    # Create directory if it doesn't exist
-    #os.makedirs("tmp", exist_ok=True)
-    
-    # Initialize memory database for user memories
-    memory_db = PostgresMemoryDb(
-        table_name="tara_user_memories", 
-        db_url=db_url
-    )
-    
-    # Initialize memory with Gemini model for creating memories
-    memory = Memory(
-        model=OpenAIChat(id="gpt-4.1-nano"),
-        db=memory_db
-    )
-    
-    # Initialize storage for session history
-    storage = PostgresStorage(
-        table_name="tara_agent_sessions", 
-        db_url=db_url
-    )
-    
-    return memory, storage
-
-# Setup memory and storage
-memory, storage = setup_memory_and_storage()
+# Run once at shutdown, after in-flight turns (and their memory/session writes) have drained
+on_release(dispose_engine)
+on_release(shutdown_document_pool)
+on_release(shutdown_media_pool)
 
-finance_agent = Agent(
-    model=OpenAIChat(id="gpt-4.1-nano"),  # This model supports multimodal
-    system_message=dedent("""\
+FINANCE_SYSTEM_MESSAGE = dedent("""\
 # Role and Objective
 You are Tara, an AI financial advisor. Your primary goal is not just to provide information, but to be a warm, savvy, and supportive friend who makes talking about money in India feel easy and stress-free. You are communicating via a chat interface like WhatsApp or Telegram. Your success is measured by how natural the conversation feels and how much the user feels heard and supported.
 
@@ -168,57 +168,219 @@ Okay, looks like Adani Green is trading around ₹1,850 right now.
 Just remember, stock prices bounce around a lot during the day!
 
 Are you thinking of investing, or just keeping an eye on it?"
-    """),
-    
-    # Memory and Storage Configuration
-    memory=memory,
-    storage=storage,
-
-    tools=[ TavilyTools(), 
-            ReasoningTools(add_instructions=True),
-            YFinanceTools(
-                stock_price=True,
-                analyst_recommendations=True,
-                company_info=True,
-                company_news=True,
-            ),
-            
-    ],
-    
-    # Enable user memories to learn about user preferences
-    enable_user_memories=True,
-    show_tool_calls=True,
-    
-    # Enable session summaries for long conversations
-    enable_session_summaries=True,
-    
-    # Add chat history to messages for context
-    add_history_to_messages=True,
-    num_history_runs=3,
-    
-    # Enable the agent to read chat history when needed
-    #read_chat_history=True,
-    
-    add_datetime_to_instructions=True,
-    markdown=True,
-)
+    """)
+
+def build_finance_agent(tools: list, system_message: str, memory: Memory, storage: PostgresStorage) -> Agent:
+    """Build a finance agent exposing `tools`; every other setting is shared."""
+    return StablePrefixAgent(
+        # Runs independent tool calls of one step concurrently
+        model=ParallelToolsOpenAIChat(id="gpt-4.1-nano"),  # This model supports multimodal
+        system_message=system_message,
+
+        # Memory and Storage Configuration
+        memory=memory,
+        storage=storage,
+
+        tools=tools,
+        # Outermost first: timings include breaker fast-fails and timeouts;
+        # compaction only sees results that came back in time
+        tool_hooks=[time_tool_call, compact_tool_result, guard_tool_call],
+
+        # Enable user memories to learn about user preferences
+        enable_user_memories=True,
+        show_tool_calls=True,
+
+        # Enable session summaries for long conversations
+        enable_session_summaries=True,
+
+        # Add chat history to messages for context (last 3 runs, or a token budget)
+        **history_settings(num_history_runs=3),
+
+        # Enable the agent to read chat history when needed
+        #read_chat_history=True,
+
+        add_datetime_to_instructions=True,
+        markdown=True,
+        )
+
+SMALL_TALK_SYSTEM_MESSAGE = dedent("""\
+You are Tara, a warm and friendly Indian financial buddy chatting on WhatsApp/Telegram.
+The user just sent a short greeting, thanks or acknowledgement. Reply in 1-2 short, friendly sentences in the user's language (English, Hindi or Hinglish) with an emoji, and gently invite them to ask about money, savings or investing.
+No markdown, no lists.
+    """)
+
+def build_small_talk_agent(system_message: str, memory: Memory, storage: PostgresStorage) -> Agent:
+    """Lightweight agent for greetings, thanks and acknowledgements.
+
+    Short prompt, no tools and no memory/summary updates. It shares storage
+    with the finance agents (all reload the session on every run), so the
+    conversation stays continuous.
+    """
+    return StablePrefixAgent(
+        model=ResilientOpenAIChat(id="gpt-4.1-nano"),
+        system_message=system_message,
+        memory=memory,
+        storage=storage,
+        add_memory_references=True,
+        **history_settings(num_history_runs=1, token_budget=HISTORY_TOKEN_BUDGET // 4),
+    )
+
+# Toolkits are built once and shared by every variant's agents (and their caches
+# and HTTP sessions with them); model instances share one OpenAI client per settings.
+# Filled by get_agent_registry.
+TOOL_PROFILES: Dict[str, list] = {}
+
+# Static prompt size (system message + tool schemas) per variant and profile, for savings logs
+PROMPT_CHARS: Dict[str, Dict[str, int]] = {}
+
+def build_agent_set(variant: AgentVariant, memory: Memory, storage: PostgresStorage) -> Dict[str, Agent]:
+    """Build a variant's agents: one per tool profile plus the small-talk agent.
+
+    Selecting tools or a variant means selecting a prebuilt agent; their
+    configuration is never changed per request. agno's run/arun do still set
+    per-run attributes (session_id, session_state, agent_session,
+    run_response) on the agent and load sessions into its shared Memory, so
+    concurrent turns on one agent overwrite each other's copies of those.
+    """
+    system_message = variant.system_message or FINANCE_SYSTEM_MESSAGE
+    PROMPT_CHARS[variant.name] = {
+        name: estimate_prompt_chars(system_message, tools) for name, tools in TOOL_PROFILES.items()
+    }
+    agents = {name: build_finance_agent(tools, system_message, memory, storage) for name, tools in TOOL_PROFILES.items()}
+    agents[SMALL_TALK] = build_small_talk_agent(variant.small_talk_message or SMALL_TALK_SYSTEM_MESSAGE, memory, storage)
+    return agents
+
+_agent_registry: Optional[AgentRegistry] = None
+_agent_registry_lock = threading.Lock()
+
+def get_agent_registry() -> AgentRegistry:
+    """Every configured variant (AGENT_VARIANTS_FILE), built once on first use.
+
+    Not built at import: spawned media/document workers re-import this
+    module as __mp_main__, and must not build agents, clients or DB pools.
+    """
+    global _agent_registry
+    with _agent_registry_lock:
+        if _agent_registry is None:
+            TOOL_PROFILES.update(build_tool_profiles())
+            _agent_registry = AgentRegistry(load_variants(), build_agent_set)
+    return _agent_registry
+
+def extract_response_text(response) -> str:
+    """Return the reply text of a RunResponse, without any <final_response> wrapper."""
+    response_content = response.content if hasattr(response, 'content') else str(response)
+    final_response_match = re.search(r'<final_response>(.*?)</final_response>', response_content, re.DOTALL)
+    if final_response_match:
+        response_content = final_response_match.group(1).strip()
+    return response_content
+
+# "thread" runs agent.run in a worker thread; "async" runs turns on the event loop with
+# agent.arun, so in-flight turns don't each hold a thread while waiting on the LLM. "async"
+# is opt-in: agno still does storage, memory and turn-context I/O synchronously inside
+# arun, blocking the loop, and interleaves per-run state on the shared agents at each await.
+AGENT_EXECUTION = os.getenv("AGENT_EXECUTION", "thread")
+
+async def run_agent_turn(message: str, user_id: str, session_id: str, images: Optional[List[Image]] = None) -> str:
+    """Run one conversational turn and return the reply text.
+
+    Shared by all channels. The user's agent variant comes from
+    the agent registry; within it, trivial turns ("hi", "thanks 😊") go to the
+    small-talk agent and everything else to a tool-enabled finance agent.
+    """
+    # Lets user-scoped tools (shared documents) see whose turn this is, also from tool threads
+    current_user_id.set(user_id)
+    agent_set = get_agent_registry().for_user(user_id)
+    variant = agent_set.variant.name
+    # Expose only the tools this kind of question needs
+    route = route_turn(message, has_media=bool(images))
+    agent = agent_set.agents[route]
+    # Fail fast with a friendly reply while the LLM is known to be down
+    if get_breaker("openai").is_open():
+        metrics.inc("agent_degraded_replies_total", route=route)
+        return LLM_DEGRADED_REPLY
+    started = time.perf_counter()
+    try:
+        if AGENT_EXECUTION == "thread":
+            response = await asyncio.to_thread(
+                agent.run,
+                message,
+                user_id=user_id,
+                session_id=session_id,
+                images=images if images else None,
+                stream=False
+            )
+        else:
+            response = await agent.arun(
+                message,
+                user_id=user_id,
+                session_id=session_id,
+                images=images if images else None,
+                stream=False
+            )
+    except CircuitOpenError:
+        metrics.inc("agent_degraded_replies_total", route=route)
+        return LLM_DEGRADED_REPLY
+    metrics.observe("agent_turn_seconds", time.perf_counter() - started, route=route, variant=variant,
+                    execution=AGENT_EXECUTION)
+    log_prompt_size(route, response, variant)
+    return extract_response_text(response)
 
-async def stream_response(message_func, text):
+def log_prompt_size(route: str, response, variant: str) -> None:
+    """Record prompt size and provider cache hits for a turn.
+
+    Static prompt size is compared against what the full toolset would have
+    cost; cached_ratio is the share of input tokens served from the prompt cache.
+    """
+    run_metrics = getattr(response, 'metrics', None) or {}
+    input_tokens = sum(run_metrics.get('input_tokens', []))
+    # Prompt tokens the provider served from its prompt cache
+    cached_tokens = sum(run_metrics.get('cached_tokens', []))
+    metrics.inc("agent_turns_total", route=route, variant=variant)
+    metrics.inc("prompt_input_tokens_total", input_tokens, route=route)
+    metrics.inc("prompt_cached_tokens_total", cached_tokens, route=route, assembly=PROMPT_ASSEMBLY)
+    fields = {
+        "route": route,
+        "variant": variant,
+        "input_tokens": input_tokens,
+        "cached_tokens": cached_tokens,
+        "cached_ratio": round(cached_tokens / input_tokens, 3) if input_tokens else 0.0,
+        "prompt_assembly": PROMPT_ASSEMBLY,
+    }
+    prompt_chars = PROMPT_CHARS[variant]
+    if route in prompt_chars:
+        metrics.inc("prompt_chars_saved_total", prompt_chars[FULL] - prompt_chars[route])
+        fields["static_prompt_chars"] = prompt_chars[route]
+        fields["full_static_prompt_chars"] = prompt_chars[FULL]
+    logger.info("Prompt size", extra={"fields": fields})
+
+async def stream_response(chat_id: int, message_func, text):
     """Stream response in chunks, breaking at paragraph boundaries."""
     # Split into paragraphs and remove empty ones
     paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
     
-    # Send each paragraph as a single message
-    for para in paragraphs:
-        if para:  # Only process non-empty paragraphs
-            await message_func(para)
-            await asyncio.sleep(0.3)  # Small delay between paragraphs
+    # One message per paragraph, paced by the outbox to stay within Telegram's flood limits
+    await send_paragraphs(chat_id, message_func, paragraphs)
 
+async def reply(update: Update, text: str) -> None:
+    """Reply to a Telegram message through the outbox, paced like every other send."""
+    await get_outbox().submit(update.effective_chat.id, lambda: update.message.reply_text(text), PRIORITY_FIRST)
+
+@tracked
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle incoming Telegram messages with multimodal support."""
     if not update.message:
         return
     
+    new_correlation_id(f"tg-{update.update_id}")
+    started = time.perf_counter()
+    
+    # Throttle before downloading media or touching the agent
+    throttle_reply = await check_rate_limit(f"telegram_{update.effective_user.id}", "telegram")
+    if throttle_reply is not None:
+        if throttle_reply:
+            await reply(update, throttle_reply)
+        return
+    
     user_input = ""
     images = []
     videos = []
@@ -233,11 +395,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         photo = update.message.photo[-1]
         photo_file = await context.bot.get_file(photo.file_id)
         
-        # Download photo content
-        response = requests.get(photo_file.file_path)
-        photo_content = response.content
+        # Download photo content, then downscale/recompress it for the model
+        photo_content = bytes(await photo_file.download_as_bytearray())
         
-        images.append(Image(content=photo_content))
+        images.append(await prepare_image(photo_content))
         
         # If there's a caption, use it as user input
         if update.message.caption:
@@ -247,9 +408,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     # Reject audio and video messages (not supported by GPT-4.1 nano)
     if update.message.voice or update.message.audio or update.message.video:
-        await update.message.reply_text(
-            "Sorry, audio and video inputs aren't supported at the moment. Please send text or images."
-        )
+        await reply(update, "Sorry, audio and video inputs aren't supported at the moment. Please send text or images.")
         return
 
     # Handle voice messages
@@ -289,17 +448,38 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         else:
             user_input = "Please analyze this video and provide relevant financial advice."
     
-    # Handle documents (images as documents)
+    # Handle documents (images as documents, PDF statements through the document pipeline)
     if update.message.document:
         document = update.message.document
-        if document.mime_type and document.mime_type.startswith('image/'):
+        if is_supported_document(document.mime_type, document.file_name):
+            if document.file_size and document.file_size > DOCUMENT_MAX_BYTES:
+                await reply(update, f"That file is too big for me 😅 Please send a document under {DOCUMENT_MAX_BYTES // (1024 * 1024)} MB.")
+                return
+            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action='typing')
+            path = new_document_path()
+            try:
+                doc_file = await context.bot.get_file(document.file_id)
+                # Streams to disk rather than into memory
+                await doc_file.download_to_drive(custom_path=path)
+                ingested = await ingest_document(str(update.effective_user.id), path, document.file_name or "document.pdf")
+            except DocumentError as e:
+                await reply(update, str(e))
+                return
+            except Exception as e:
+                # Telegram download (NetworkError, BadRequest) or database failures
+                logger.exception(f"Could not ingest Telegram document: {e}")
+                await reply(update, "Sorry, I couldn't process the document. Please try again.")
+                return
+            finally:
+                os.remove(path)
+            user_input = document_prompt(ingested, update.message.caption)
+        elif document.mime_type and document.mime_type.startswith('image/'):
             doc_file = await context.bot.get_file(document.file_id)
             
             # Download document content
-            response = requests.get(doc_file.file_path)
-            doc_content = response.content
+            doc_content = bytes(await doc_file.download_as_bytearray())
             
-            images.append(Image(content=doc_content))
+            images.append(await prepare_image(doc_content))
             
             if update.message.caption:
                 user_input = update.message.caption
@@ -308,7 +488,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     # If no content was found, return
     if not user_input and not images and not audio and not videos:
-        await update.message.reply_text("Sorry, I couldn't process your message. Please send text, image, or audio.")
+        await reply(update, "Sorry, I couldn't process your message. Please send text, image, or audio.")
         return
     
     user_id = str(update.effective_user.id)
@@ -322,32 +502,23 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     try:
         # Get the response with multimodal inputs
-        response = await asyncio.to_thread(
-            finance_agent.run,
-            user_input,
-            user_id=user_id,
-            session_id=session_id,
-            images=images if images else None,
-            stream=False
-        )
-        
-        # Extract the content from the response
-        response_content = response.content if hasattr(response, 'content') else str(response)
-        
-        # Extract content between <final_response> tags if they exist
-        import re
-        final_response_match = re.search(r'<final_response>(.*?)</final_response>', response_content, re.DOTALL)
-        if final_response_match:
-            response_content = final_response_match.group(1).strip()
+        response_content = await run_agent_turn(user_input, user_id, session_id, images=images)
         
         # Stream the response in chunks
         await stream_response(
+            update.effective_chat.id,
             lambda text: update.message.reply_text(text),
             response_content
         )
+        logger.info("Telegram reply sent", extra={"fields": {
+            "latency_ms": round((time.perf_counter() - started) * 1000),
+            "reply_chars": len(response_content),
+        }})
         
     except Exception as e:
-        await update.message.reply_text(f"Sorry, I encountered an error: {str(e)}")
+        logger.exception(f"Error processing Telegram message: {e}")
+        error_text = f"Sorry, I encountered an error: {str(e)}"
+        await reply(update, error_text)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a welcome message when the command /start is issued."""
@@ -355,7 +526,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     session_id = f"telegram_{user_id}"
     
     # Check if user has previous memories
-    user_memories = memory.get_user_memories(user_id=user_id)
+    user_memories = get_agent_registry().for_user(user_id).memory.get_user_memories(user_id=user_id)
     
     if user_memories:
         # Personalized welcome for returning users
@@ -368,14 +539,21 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             "Hi! Mera naam Tara hai 😊 Aap kaise ho? Main aapke paison ko smartly handle karne mein madad kar sakti hoon—bina tension ke."
         )
     
-    await update.message.reply_text(welcome_msg)
+    await reply(update, welcome_msg)
+
+def clear_user_memories(user_id: str) -> None:
+    """Delete all of a user's memories and drop their cached turn context."""
+    memory = get_agent_registry().for_user(user_id).memory
+    for user_memory in memory.get_user_memories(user_id=user_id):
+        memory.delete_user_memory(memory_id=user_memory.memory_id, user_id=user_id, refresh_from_db=False)
+    context_cache.invalidate_user(user_id)
 
 async def memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show user what the bot remembers about them."""
     user_id = str(update.effective_user.id)
     
     # Get user memories
-    user_memories = memory.get_user_memories(user_id=user_id)
+    user_memories = get_agent_registry().for_user(user_id).memory.get_user_memories(user_id=user_id)
     
     if user_memories:
         memories_text = "Main aapke baare mein yeh yaad rakhti hoon:\n\n"
@@ -387,25 +565,52 @@ async def memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     else:
         memories_text = "Abhi tak main aapke baare mein kuch specific yaad nahi rakha hai. Thoda aur baat karte hain toh main aapko better samajh paungi! 😊"
     
-    await update.message.reply_text(memories_text)
+    await reply(update, memories_text)
 
 async def clear_memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Clear user's memories."""
     user_id = str(update.effective_user.id)
     
     # Clear user memories
-    memory.delete_user_memory(user_id=user_id)
+    clear_user_memories(user_id)
     
-    await update.message.reply_text(
+    await reply(
+        update,
         "Theek hai! Main aapke baare mein sab kuch bhool gayi hoon. "
         "Ab hum fresh start kar sakte hain! 😊"
     )
 
-def run_telegram_bot(token: str) -> None:
-    """Run the Telegram bot."""
-    print("Starting Telegram bot with multimodal support...")  # Updated message
-    
-    application = Application.builder().token(token).build()
+async def on_telegram_startup(application: Application) -> None:
+    """Start background services once the Telegram event loop is running."""
+    # Build the agents now rather than on the first message
+    await asyncio.to_thread(get_agent_registry)
+    application.bot_data["watchdog"] = start_loop_watchdog("telegram")
+
+async def on_telegram_stop(application: Application) -> None:
+    """Let in-flight turns finish before the Application shuts down (by its drain deadline, if set)."""
+    deadline = application.bot_data.get(DRAIN_DEADLINE)
+    await in_flight.drain(SHUTDOWN_DRAIN_SECONDS if deadline is None else max(0.0, deadline - time.monotonic()))
+
+async def on_telegram_shutdown(application: Application) -> None:
+    """Stop background services started in on_telegram_startup."""
+    await close_outbox()
+    watchdog = application.bot_data.pop("watchdog", None)
+    if watchdog:
+        await watchdog.stop()
+
+def build_telegram_application(token: Optional[str] = None) -> Application:
+    """Build the Telegram Application with all handlers registered.
+
+    Module-level so it can be handed to spawned webhook worker processes.
+    """
+    application = (
+        Application.builder()
+        .token(token or os.getenv('TELEGRAM_BOT_TOKEN'))
+        .post_init(on_telegram_startup)
+        .post_stop(on_telegram_stop)
+        .post_shutdown(on_telegram_shutdown)
+        .build()
+    )
     
     # Add handlers
     application.add_handler(CommandHandler("start", start))
@@ -417,6 +622,13 @@ def run_telegram_bot(token: str) -> None:
         filters.TEXT | filters.PHOTO | filters.Document.ALL,
         handle_message
     ))
+    return application
+
+def run_telegram_bot(token: str) -> None:
+    """Run the Telegram bot."""
+    print("Starting Telegram bot with multimodal support...")  # Updated message
+    
+    application = build_telegram_application(token)
     
     print("Bot is running with multimodal support. Press Ctrl+C to stop.")
     print("Supported inputs:")
@@ -429,8 +641,45 @@ def run_telegram_bot(token: str) -> None:
     print("- /start - Start conversation")
     print("- /memory - See what the bot remembers about you")
     print("- /clear_memory - Clear your memory")
+    # Stops on SIGINT/SIGTERM once the current updates are handled (see on_telegram_stop)
     application.run_polling()
-    
+    release_resources()
+
+# Bytes read from stdin past the last returned line
+_stdin_pending = b""
+
+async def read_input(prompt: str) -> str:
+    """Like input(), but waits for stdin on the event loop instead of in a thread.
+
+    A read blocked in a worker thread can't be cancelled, so Ctrl+C or
+    SIGTERM would hang until Enter is pressed. Raises EOFError at end of input.
+    """
+    global _stdin_pending
+    print(prompt, end="", flush=True)
+    loop = asyncio.get_running_loop()
+    fd = sys.stdin.fileno()
+    while b"\n" not in _stdin_pending:
+        ready = loop.create_future()
+        try:
+            loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        except NotImplementedError:  # Windows event loops can't watch stdin
+            return await asyncio.to_thread(input)
+        except PermissionError:  # a regular file: reads never block
+            ready.set_result(None)
+        else:
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+        chunk = os.read(fd, 4096)
+        if not chunk:
+            if _stdin_pending:
+                break
+            raise EOFError
+        _stdin_pending += chunk
+    line, _, _stdin_pending = _stdin_pending.partition(b"\n")
+    return line.decode(errors="replace").rstrip("\r")
+
 async def run_terminal() -> None:
     """Run the agent in terminal mode."""
     print("\n" + "="*50)
@@ -441,6 +690,9 @@ async def run_terminal() -> None:
     user_id = "terminal_user"
     session_id = "terminal_session"
     
+    get_agent_registry()
+    watchdog = start_loop_watchdog("terminal")
+    
     async def print_streamed(text):
         print("\nTara:", end=" ")
         for chunk in text.split('\n'):
@@ -449,55 +701,52 @@ async def run_terminal() -> None:
                 await asyncio.sleep(0.3)
         print()  # Add an extra newline at the end
     
-    while True:
-        try:
-            user_input = input("\nAap: ")
+    try:
+        while True:
+            try:
+                # Read input off the loop so the watchdog doesn't flag idle prompts
+                try:
+                    user_input = await read_input("\nAap: ")
+                except EOFError:
+                    print("\n\nAlvida! Phir milenge. 😊")
+                    break
             
-            if user_input.lower() in ['exit', 'quit', 'bye', 'alvida']:
-                print("\nAlvida! Phir milenge. 😊")
-                break
+                if user_input.lower() in ['exit', 'quit', 'bye', 'alvida']:
+                    print("\nAlvida! Phir milenge. 😊")
+                    break
             
-            # Special commands for terminal
-            if user_input.lower() == '/memory':
-                user_memories = memory.get_user_memories(user_id=user_id)
-                if user_memories:
-                    print("\nMain aapke baare mein yeh yaad rakhti hoon:")
-                    for i, mem in enumerate(user_memories, 1):
-                        print(f"{i}. {mem.memory}")
-                else:
-                    print("\nAbhi tak koi specific memories nahi hain.")
-                continue
+                # Special commands for terminal
+                if user_input.lower() == '/memory':
+                    user_memories = get_agent_registry().for_user(user_id).memory.get_user_memories(user_id=user_id)
+                    if user_memories:
+                        print("\nMain aapke baare mein yeh yaad rakhti hoon:")
+                        for i, mem in enumerate(user_memories, 1):
+                            print(f"{i}. {mem.memory}")
+                    else:
+                        print("\nAbhi tak koi specific memories nahi hain.")
+                    continue
             
-            if user_input.lower() == '/clear_memory':
-                memory.delete_user_memory(user_id=user_id)
-                print("\nMemory clear kar di! Fresh start! 😊")
-                continue
+                if user_input.lower() == '/clear_memory':
+                    clear_user_memories(user_id)
+                    print("\nMemory clear kar di! Fresh start! 😊")
+                    continue
                 
-            if not user_input:
-                continue
+                if not user_input:
+                    continue
                 
-            # Run the blocking call in a separate thread
-            response = await asyncio.to_thread(
-                finance_agent.run,
-                user_input,
-                user_id=user_id,
-                session_id=session_id,
-                stream=False
-            )
+                response_content = await run_agent_turn(user_input, user_id, session_id)
             
-            response_content = response.content if hasattr(response, 'content') else str(response)
+                # Print a typing indicator
+                print("\nTara likh rahi hoon...\n")
             
-            # Print a typing indicator
-            print("\nTara likh rahi hoon...\n")
+                # Stream the response
+                await print_streamed(response_content)
             
-            # Stream the response
-            await print_streamed(response_content)
-            
-        except KeyboardInterrupt:
-            print("\n\nAlvida! Phir milenge. 😊")
-            break
-        except Exception as e:
-            print(f"\nMaaf, kuch to gadbad hai: {str(e)}")
+            except Exception as e:
+                print(f"\nMaaf, kuch to gadbad hai: {str(e)}")
+    finally:
+        if watchdog:
+            await watchdog.stop()
 
 # WhatsApp Configuration
 
@@ -505,26 +754,84 @@ async def run_terminal() -> None:
 WHATSAPP_TOKEN = os.getenv('WHATSAPP_TOKEN')
 WHATSAPP_PHONE_NUMBER_ID = os.getenv('WHATSAPP_PHONE_NUMBER_ID')
 WHATSAPP_VERIFY_TOKEN = os.getenv('WHATSAPP_VERIFY_TOKEN', 'your_verify_token')
+# App secret from the Meta developer console, used to sign webhook deliveries
+WHATSAPP_APP_SECRET = os.getenv('WHATSAPP_APP_SECRET')
 WHATSAPP_API_VERSION = 'v18.0'
 WHATSAPP_API_URL = f'https://graph.facebook.com/{WHATSAPP_API_VERSION}/{WHATSAPP_PHONE_NUMBER_ID}/messages'
 
+# Telegram webhook configuration (webhook mode is enabled when the URL is set)
+TELEGRAM_WEBHOOK_URL = os.getenv('TELEGRAM_WEBHOOK_URL')
+TELEGRAM_WEBHOOK_WORKERS = int(os.getenv('TELEGRAM_WEBHOOK_WORKERS', '0'))
+TELEGRAM_WEBHOOK_PATH = '/telegram/webhook'
+
+def telegram_webhook_secret() -> str:
+    """Secret Telegram echoes in X-Telegram-Bot-Api-Secret-Token; derived from the bot token by default."""
+    secret = os.getenv('TELEGRAM_WEBHOOK_SECRET')
+    if not secret:
+        secret = hashlib.sha256(os.getenv('TELEGRAM_BOT_TOKEN', '').encode()).hexdigest()
+    return secret
+
 # FastAPI app
 app = FastAPI(title="Tara WhatsApp API")
 
-class WhatsAppMessage(BaseModel):
-    messaging_product: str
-    to: str
-    recipient_type: str = "individual"
-    type: str
-    text: Optional[Dict[str, str]] = None
-    image: Optional[Dict[str, str]] = None
-    audio: Optional[Dict[str, str]] = None
-    video: Optional[Dict[str, str]] = None
-    document: Optional[Dict[str, str]] = None
-
-class WhatsAppWebhookPayload(BaseModel):
-    object: str
-    entry: List[Dict[str, Any]]
+@app.on_event("startup")
+async def on_whatsapp_startup():
+    """Start background services once uvicorn's event loop is running."""
+    # Multi-worker mode imports this module in fresh processes that never run main()
+    configure_logging()
+    # Build the agents now rather than on the first message
+    await asyncio.to_thread(get_agent_registry)
+    app.state.watchdog = start_loop_watchdog("whatsapp")
+    app.state.telegram_router = None
+    if TELEGRAM_WEBHOOK_URL and int(os.getenv('WHATSAPP_WORKERS', '1')) > 1:
+        # Every worker would start its own router and shards, breaking per-chat order
+        logger.warning("TELEGRAM_WEBHOOK_URL is ignored with several WhatsApp workers; "
+                       "run the Telegram webhook as its own server")
+    elif TELEGRAM_WEBHOOK_URL:
+        router = ShardedUpdateRouter(build_telegram_application, workers=TELEGRAM_WEBHOOK_WORKERS)
+        await router.start()
+        await router.bot.set_webhook(
+            url=TELEGRAM_WEBHOOK_URL.rstrip('/') + TELEGRAM_WEBHOOK_PATH,
+            secret_token=telegram_webhook_secret(),
+            allowed_updates=Update.ALL_TYPES,
+        )
+        app.state.telegram_router = router
+        logger.info(f"Telegram webhook mode enabled with {TELEGRAM_WEBHOOK_WORKERS} worker processes")
+
+@app.on_event("shutdown")
+async def on_whatsapp_shutdown():
+    """Drain in-flight turns, then stop background services started in on_whatsapp_startup."""
+    # New webhooks get 503 from here on, so the platforms redeliver them to the next instance
+    in_flight.begin_drain()
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_SECONDS
+    router = getattr(app.state, "telegram_router", None)
+    if router:
+        await router.stop(timeout=max(0.0, deadline - time.monotonic()))
+    await in_flight.drain(max(0.0, deadline - time.monotonic()))
+    watchdog = getattr(app.state, "watchdog", None)
+    if watchdog:
+        await watchdog.stop()
+    release_resources()
+
+@app.post(TELEGRAM_WEBHOOK_PATH)
+async def telegram_webhook(request: Request):
+    """Receive Telegram updates and route them to the worker owning the chat."""
+    router = getattr(app.state, "telegram_router", None)
+    if router is None:
+        raise HTTPException(status_code=404, detail="Telegram webhook mode is not enabled")
+    if in_flight.draining:
+        return JSONResponse(content={"status": "error", "message": "Shutting down"}, status_code=503)
+    secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(secret, telegram_webhook_secret()):
+        metrics.inc("telegram_webhook_rejected_total", reason="secret")
+        return JSONResponse(content={"status": "error", "message": "Invalid secret"}, status_code=403)
+    router.dispatch(await request.body())
+    return JSONResponse(content={"status": "success"}, status_code=200)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Expose in-process metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render())
 
 async def send_whatsapp_message(phone_number: str, message: str) -> bool:
     """Send a text message via WhatsApp API."""
@@ -533,34 +840,52 @@ async def send_whatsapp_message(phone_number: str, message: str) -> bool:
         'Content-Type': 'application/json'
     }
     
-    payload = {
-        "messaging_product": "whatsapp",
-        "to": phone_number,
-        "type": "text",
-        "text": {"body": message}
-    }
+    payload = WhatsAppMessage(
+        messaging_product="whatsapp",
+        to=phone_number,
+        type="text",
+        text={"body": message},
+    ).model_dump(exclude_none=True)
     
     try:
         response = requests.post(WHATSAPP_API_URL, headers=headers, json=payload)
         response.raise_for_status()
         return True
     except Exception as e:
-        print(f"Error sending WhatsApp message: {e}")
+        logger.error(f"Error sending WhatsApp message: {e}")
         return False
 
 # WhatsApp Cloud API does NOT support typing indicators. We'll simulate a delay instead.
-async def process_whatsapp_message(phone_number: str, message: str, media_type: str = None, media_id: str = None):
-    """Process incoming WhatsApp messages and generate responses with session/memory management."""
+async def process_whatsapp_message(phone_number: str, message: str, media_type: str = None, media_id: str = None,
+                                   message_id: str = None, filename: str = None):
+    """Process incoming WhatsApp messages: dedup retries, throttle, then reply in per-user order."""
+    # Runs in its own task, so this correlation ID only tags this message's logs
+    message_id = new_correlation_id(message_id)
     user_id = f"whatsapp_{phone_number}"
-    session_id = f"whatsapp_{phone_number}"
 
-    # --- Memory/session management ---
-    # Load or initialize memory for this WhatsApp user
-    memory = None
-    if hasattr(finance_agent, "get_memory"):
-        memory = finance_agent.get_memory(user_id)
-    if memory is None:
-        memory = {}
+    # WhatsApp retries deliveries it thinks failed; each message ID is handled once across workers
+    ticket = await claim_message(message_id, user_id)
+    if ticket is None:
+        logger.info("Skipping duplicate webhook delivery")
+        return
+
+    throttle_reply = await check_rate_limit(user_id, "whatsapp")
+    if throttle_reply is not None:
+        # The claimed message would otherwise stay pending and block the user's later messages
+        await get_coordinator().skip(ticket)
+        if throttle_reply:
+            await send_whatsapp_message(phone_number, throttle_reply)
+        return
+
+    async with get_coordinator().turn(ticket):
+        await reply_to_whatsapp_message(phone_number, message, media_type, media_id, filename)
+
+async def reply_to_whatsapp_message(phone_number: str, message: str, media_type: str = None, media_id: str = None,
+                                    filename: str = None):
+    """Generate and send the reply to one WhatsApp message with session/memory management."""
+    started = time.perf_counter()
+    user_id = f"whatsapp_{phone_number}"
+    session_id = f"whatsapp_{phone_number}"
 
     # Prepare media inputs
     images, videos = [], []
@@ -576,75 +901,69 @@ async def process_whatsapp_message(phone_number: str, message: str, media_type:
             response.raise_for_status()
             media_data = response.json()
             if 'url' not in media_data:
-                print(f"No URL found in media data: {media_data}")
+                logger.warning("No URL found in media data", extra={"fields": {"media_type": media_type}})
                 await send_whatsapp_message(phone_number, "Sorry, I couldn't process the media. Please try again.")
                 return
             download_url = media_data['url']
-            media_response = requests.get(download_url, headers={"Authorization": f"Bearer {WHATSAPP_TOKEN}"})
-            media_response.raise_for_status()
-            content = media_response.content
-            if media_type == 'image':
-                images.append(Image(content=content))
-                if not message:
-                    message = "Please analyze this image and provide relevant financial advice."
-            elif media_type == 'audio':
-                await send_whatsapp_message(phone_number, "Sorry, audio messages aren't supported currently.")
-                return
-            elif media_type == 'video':
-                videos.append(Video(content=content))
-                if not message:
-                    message = "Please analyze this video and provide relevant financial advice."
-            elif media_type == 'document':
-                images.append(Image(content=content))
-                if not message:
-                    message = "Please analyze this document and provide relevant financial advice."
+            if media_type == 'document' and is_supported_document(media_data.get('mime_type'), filename):
+                # Statements go through the document pipeline instead of the prompt
+                path = new_document_path()
+                try:
+                    await asyncio.to_thread(
+                        download_to_file, download_url, path, {"Authorization": f"Bearer {WHATSAPP_TOKEN}"}
+                    )
+                    ingested = await ingest_document(user_id, path, filename or "document.pdf")
+                except DocumentError as e:
+                    await send_whatsapp_message(phone_number, str(e))
+                    return
+                finally:
+                    os.remove(path)
+                message = document_prompt(ingested, message)
+            else:
+                media_response = requests.get(download_url, headers={"Authorization": f"Bearer {WHATSAPP_TOKEN}"})
+                media_response.raise_for_status()
+                content = media_response.content
+                if media_type == 'image':
+                    images.append(await prepare_image(content))
+                    if not message:
+                        message = "Please analyze this image and provide relevant financial advice."
+                elif media_type == 'audio':
+                    await send_whatsapp_message(phone_number, "Sorry, audio messages aren't supported currently.")
+                    return
+                elif media_type == 'video':
+                    videos.append(Video(content=content))
+                    if not message:
+                        message = "Please analyze this video and provide relevant financial advice."
+                elif media_type == 'document':
+                    mime_type = media_data.get('mime_type') or ''
+                    if not mime_type.startswith('image/'):
+                        await send_whatsapp_message(phone_number, "Sorry, I can only read PDF documents and images right now.")
+                        return
+                    images.append(await prepare_image(content))
+                    if not message:
+                        message = "Please analyze this document and provide relevant financial advice."
         except requests.exceptions.RequestException as e:
-            error_msg = f"Error downloading media: {str(e)}"
-            print(error_msg)
+            logger.error(f"Error downloading media: {str(e)}")
             await send_whatsapp_message(phone_number, "Sorry, I encountered an error processing the media. Please try again.")
             return
         except Exception as e:
-            error_msg = f"Error processing media: {str(e)}"
-            print(error_msg)
-            print("Media processing error:", traceback.format_exc())
+            logger.exception(f"Error processing media: {str(e)}")
             await send_whatsapp_message(phone_number, "Sorry, I couldn't process the media. Please try again with a different file.")
             return
     try:
         # Simulate typing delay
         await asyncio.sleep(1)
-        # Call the synchronous agent.run in an async context
-        response = await asyncio.to_thread(
-            finance_agent.run,
-            message,
-            user_id=user_id,
-            session_id=session_id,
-            images=images,
-            memory=memory
-        )
-        # Extract the actual string content
-        if hasattr(response, "content"):
-            response_text = response.content
-        else:
-            response_text = str(response)
-            
-        # Extract content between <final_response> tags if they exist
-        import re
-        final_response_match = re.search(r'<final_response>(.*?)</final_response>', response_text, re.DOTALL)
-        if final_response_match:
-            response_text = final_response_match.group(1).strip()
-            
-        # Save memory/session state if supported
-        if hasattr(finance_agent, "save_memory"):
-            finance_agent.save_memory(user_id, memory)
-            
+        response_text = await run_agent_turn(message, user_id, session_id, images=images)
         await send_whatsapp_message(phone_number, response_text)
+        logger.info("WhatsApp reply sent", extra={"fields": {
+            "latency_ms": round((time.perf_counter() - started) * 1000),
+            "reply_chars": len(response_text),
+        }})
     except Exception as e:
-        print(f"Error processing WhatsApp message: {e}")
+        logger.exception(f"Error processing WhatsApp message: {e}")
         error_msg = f"Sorry, I encountered an error: {e}"
         await send_whatsapp_message(phone_number, error_msg)
 
-        await send_whatsapp_message(phone_number, error_msg)
-
 @app.get("/webhook")
 async def verify_webhook(request: Request):
     """Verify webhook for WhatsApp API."""
@@ -653,158 +972,254 @@ async def verify_webhook(request: Request):
     token = query_params.get("hub.verify_token")
     challenge = query_params.get("hub.challenge")
     
-    print(f"Verification request - Mode: {mode}, Token: {token}, Challenge: {challenge}")
+    logger.info(f"Verification request - Mode: {mode}")
     
     if mode and token:
         if mode == 'subscribe' and token == WHATSAPP_VERIFY_TOKEN:
-            print("Webhook verified successfully")
+            logger.info("Webhook verified successfully")
             return Response(content=challenge, media_type="text/plain")
     
-    print("Webhook verification failed")
+    logger.warning("Webhook verification failed")
     raise HTTPException(status_code=403, detail="Verification failed")
 
+def verify_webhook_signature(raw: bytes, signature_header: Optional[str]) -> bool:
+    """Check X-Hub-Signature-256 against an HMAC-SHA256 of the raw request body."""
+    if not WHATSAPP_APP_SECRET or not signature_header or not signature_header.startswith("sha256="):
+        return False
+    expected = hmac.new(WHATSAPP_APP_SECRET.encode(), raw, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature_header[len("sha256="):])
+
 @app.post("/webhook")
 async def webhook(request: Request):
     """Handle incoming WhatsApp messages via webhook."""
+    if in_flight.draining:
+        # Meta retries failed deliveries, so the message is answered by the next instance
+        return JSONResponse(content={"status": "error", "message": "Shutting down"}, status_code=503)
     try:
-        # Parse the request body
-        try:
-            data = await request.json()
-            print("Incoming webhook data:", json.dumps(data, indent=2))
-        except Exception as e:
-            print(f"Error parsing JSON: {e}")
-            return JSONResponse(content={"status": "error", "message": "Invalid JSON"}, status_code=400)
+        # Read the body once; the same bytes are verified and then parsed
+        raw = await request.body()
+        
+        # Reject unsigned or forged deliveries before any parsing or agent work
+        if not verify_webhook_signature(raw, request.headers.get("X-Hub-Signature-256")):
+            metrics.inc("whatsapp_webhook_rejected_total", reason="signature")
+            logger.warning("Rejected webhook with missing or invalid signature")
+            return JSONResponse(content={"status": "error", "message": "Invalid signature"}, status_code=403)
+        
+        # Delivery/read receipts outnumber real messages; acknowledge them without parsing
+        if not has_messages(raw):
+            metrics.inc("whatsapp_webhook_deliveries_total", kind="status")
+            return JSONResponse(content={"status": "success"}, status_code=200)
         
-        # Check if this is a WhatsApp API event
-        if 'object' not in data or 'entry' not in data:
-            print("Invalid webhook format - missing 'object' or 'entry'")
+        try:
+            payload = parse_webhook(raw)
+        except ValidationError as e:
+            if any(err["type"] == "json_invalid" for err in e.errors()):
+                logger.warning("Error parsing JSON in webhook body")
+                return JSONResponse(content={"status": "error", "message": "Invalid JSON"}, status_code=400)
+            logger.warning("Invalid webhook format", extra={"fields": {"errors": e.error_count()}})
             return JSONResponse(content={"status": "ignored"}, status_code=200)
         
-        # Process each entry
-        for entry in data.get('entry', []):
-            try:
-                for change in entry.get('changes', []):
-                    value = change.get('value', {})
-                    
-                    # Check if this is a message
-                    messages = value.get('messages', [])
-                    if not messages:
-                        continue
-                        
-                    for message in messages:
-                        try:
-                            if not all(key in message for key in ['from', 'id']):
-                                print("Invalid message format - missing required fields")
-                                continue
-                                
-                            phone_number = message['from']
-                            message_id = message['id']
-                            print(f"Processing message {message_id} from {phone_number}")
-                            
-                            # Handle different message types
-                            if 'text' in message:
-                                text = message['text'].get('body', '')
-                                if not text.strip():
-                                    print("Empty text message received")
-                                    continue
-                                print(f"Processing text message: {text[:100]}...")
-                                asyncio.create_task(process_whatsapp_message(phone_number, text))
-                                
-                            elif 'image' in message:
-                                image = message.get('image', {})
-                                if 'id' not in image:
-                                    print("Image message missing ID")
-                                    continue
-                                image_id = image['id']
-                                caption = image.get('caption', '')
-                                print(f"Processing image message with ID: {image_id}")
-                                asyncio.create_task(process_whatsapp_message(phone_number, caption, 'image', image_id))
-                                
-                            elif 'audio' in message:
-                                audio = message.get('audio', {})
-                                if 'id' not in audio:
-                                    print("Audio message missing ID")
-                                    continue
-                                audio_id = audio['id']
-                                print(f"Processing audio message with ID: {audio_id}")
-                                asyncio.create_task(process_whatsapp_message(phone_number, "", 'audio', audio_id))
-                                
-                            elif 'video' in message:
-                                video = message.get('video', {})
-                                if 'id' not in video:
-                                    print("Video message missing ID")
-                                    continue
-                                video_id = video['id']
-                                print(f"Processing video message with ID: {video_id}")
-                                asyncio.create_task(process_whatsapp_message(phone_number, "", 'video', video_id))
-                                
-                            elif 'document' in message:
-                                document = message.get('document', {})
-                                if 'id' not in document:
-                                    print("Document message missing ID")
-                                    continue
-                                doc_id = document['id']
-                                print(f"Processing document with ID: {doc_id}")
-                                asyncio.create_task(process_whatsapp_message(phone_number, "", 'document', doc_id))
-                                
-                        except Exception as e:
-                            print(f"Error processing individual message: {e}")
-                            continue
-                            
-            except Exception as e:
-                print(f"Error processing entry: {e}")
+        metrics.inc("whatsapp_webhook_deliveries_total", kind="messages")
+        log_payload(logger, "Incoming webhook data", payload.model_dump(by_alias=True, exclude_none=True))
+        
+        for message in payload.iter_messages():
+            phone_number = message.from_
+            message_id = message.id
+            logger.info("Received WhatsApp message", extra={"fields": {
+                "message_id": message_id,
+                "type": message.type,
+            }})
+            
+            if message.text is not None:
+                text = message.text.body
+                if not text.strip():
+                    logger.info("Empty text message received")
+                    continue
+                in_flight.spawn(process_whatsapp_message(phone_number, text, message_id=message_id))
                 continue
+            
+            media_type, media = message.media()
+            if media is None:
+                logger.info("Unsupported message type", extra={"fields": {"type": message.type}})
+                continue
+            if not media.id:
+                logger.warning(f"{media_type.capitalize()} message missing ID")
+                continue
+            # Image and document captions are forwarded as the prompt
+            caption = media.caption if media_type in ('image', 'document') else ""
+            in_flight.spawn(process_whatsapp_message(phone_number, caption, media_type, media.id, message_id,
+                                                     media.filename))
         
         return JSONResponse(content={"status": "success"}, status_code=200)
     
     except Exception as e:
         error_msg = f"Unexpected error in webhook: {e}"
-        print(error_msg)
-        print("Full traceback:", traceback.format_exc())
+        logger.exception(error_msg)
         raise HTTPException(status_code=500, detail=error_msg)
 
-def run_whatsapp_webhook(host: str = "0.0.0.0", port: int = 8000):
+def run_whatsapp_webhook(host: str = "0.0.0.0", port: int = 8000, workers: int = 1):
     """Run the WhatsApp webhook server."""
-    print(f"Starting WhatsApp webhook server on http://{host}:{port}")
+    print(f"Starting WhatsApp webhook server on http://{host}:{port} with {workers} worker(s)")
     print(f"Webhook URL: https://your-domain.com/webhook")
-    print(f"Verification Token: {WHATSAPP_VERIFY_TOKEN}")
     print("Press Ctrl+C to stop")
     
-    uvicorn.run(app, host=host, port=port)
+    if workers <= 1:
+        uvicorn.run(app, host=host, port=port)
+        return
+    
+    # Workers are spawned and import this module afresh, so each one builds its
+    # own agent, DB pools and caches. Env vars are inherited, which switches
+    # dedup/ordering and rate limiting to their Postgres-backed modes.
+    os.environ['WHATSAPP_WORKERS'] = str(workers)
+    os.environ.setdefault('RATE_LIMIT_BACKEND', 'postgres')
+    # The supervisor never serves requests; release any connections it opened
+    dispose_engine()
+    uvicorn.run("agent:app", host=host, port=port, workers=workers)
+
+async def run_channels(channels: List[str], token: Optional[str], host: str, port: int) -> None:
+    """Run several channels on one event loop.
+
+    All channels share this process's agent registry, DB pools and caches.
+    Runs until Ctrl+C/SIGTERM, or until the terminal session ends.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+    
+    application = None
+    if 'telegram' in channels:
+        application = build_telegram_application(token)
+        await start_application(application)
+        await application.updater.start_polling()
+        print("Telegram bot is polling")
+    
+    server = server_task = terminal_task = None
+    if 'whatsapp' in channels:
+        server = uvicorn.Server(uvicorn.Config(app, host=host, port=port))
+        server_task = asyncio.create_task(server.serve())
+        print(f"WhatsApp webhook server on http://{host}:{port}")
+    if 'terminal' in channels:
+        terminal_task = asyncio.create_task(run_terminal())
+    stop_task = asyncio.create_task(stop.wait())
+    
+    # Any channel finishing (terminal exit, server shutdown on a signal) stops all of them
+    waiters = [task for task in (server_task, terminal_task, stop_task) if task]
+    await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    in_flight.begin_drain()
+    stop_task.cancel()
+    if terminal_task:
+        terminal_task.cancel()
+    # Telegram first: its post_stop drains in-flight turns while the webhook server still answers 503
+    if application is not None:
+        await application.updater.stop()
+        await stop_application(application)
+    if server_task:
+        server.should_exit = True
+    await asyncio.gather(*waiters, return_exceptions=True)
+    release_resources()
 
 def main():
     """Main function to handle command line arguments."""
+    global TELEGRAM_WEBHOOK_URL, TELEGRAM_WEBHOOK_WORKERS
     parser = argparse.ArgumentParser(description='Tara - Your Financial Assistant with Memory')
-    group = parser.add_mutually_exclusive_group(required=True)
-    group.add_argument('--terminal', action='store_true', help='Run in terminal mode')
-    group.add_argument('--telegram', action='store_true', help='Run Telegram bot using token from .env')
-    group.add_argument('--whatsapp', action='store_true', help='Run WhatsApp webhook server')
+    # Channels can be combined (e.g. --telegram --whatsapp) to run in one process
+    parser.add_argument('--terminal', action='store_true', help='Run in terminal mode')
+    parser.add_argument('--whatsapp', action='store_true', help='Run WhatsApp webhook server')
+    telegram_group = parser.add_mutually_exclusive_group()
+    telegram_group.add_argument('--telegram', action='store_true', help='Run Telegram bot using token from .env')
+    telegram_group.add_argument('--telegram-webhook', type=str, metavar='PUBLIC_URL',
+                                help='Serve Telegram via webhook at PUBLIC_URL (on the same server as WhatsApp)')
+    parser.add_argument('--refresh-prices', nargs='*', metavar='SYMBOL',
+                        help='Download/append daily price history to the local store and exit (default: PRICE_STORE_SYMBOLS)')
+    parser.add_argument('--replay', action='store_true',
+                        help='Replay stored sessions against the current agent config and print a benchmark report')
+    
+    replay_group = parser.add_argument_group('Replay Options')
+    replay_group.add_argument('--replay-model', choices=('fake', 'real'), default='fake',
+                              help='fake answers with the recorded reply offline; real calls the configured LLM and tools')
+    replay_group.add_argument('--replay-concurrency', type=int, default=4, help='Sessions replayed at once')
+    replay_group.add_argument('--replay-limit', type=int, metavar='N', help='Replay at most N sessions')
+    replay_group.add_argument('--replay-since', type=datetime.fromisoformat, metavar='DATE',
+                              help='Only sessions created on or after DATE (YYYY-MM-DD)')
+    replay_group.add_argument('--replay-output', type=str, metavar='PATH', help='Also write the report as JSON to PATH')
+    replay_group.add_argument('--replay-variant', type=str, default=DEFAULT_VARIANT,
+                              choices=[variant.name for variant in load_variants()],
+                              help='Agent variant to replay against (its session table is the source)')
     
     # Add WhatsApp webhook server options
     whatsapp_group = parser.add_argument_group('WhatsApp Webhook Options')
     whatsapp_group.add_argument('--host', type=str, default='0.0.0.0', help='Host to run the webhook server on')
     whatsapp_group.add_argument('--port', type=int, default=8000, help='Port to run the webhook server on')
+    whatsapp_group.add_argument('--workers', type=int, default=int(os.getenv('WHATSAPP_WORKERS', '1')),
+                                help='Number of WhatsApp server worker processes')
+    whatsapp_group.add_argument('--telegram-workers', type=int, default=TELEGRAM_WEBHOOK_WORKERS,
+                                help='Worker processes for Telegram webhook updates, sharded by chat ID (0 = in-process)')
     
     args = parser.parse_args()
+    if args.refresh_prices is not None:
+        configure_logging()
+        added = refresh_prices(args.refresh_prices or None)
+        print(f"Price store updated: {sum(added.values())} new bars for {len(added)} symbols")
+        return
+    if args.replay:
+        configure_logging()
+        report = asyncio.run(replay_sessions(
+            dict(get_agent_registry().get(args.replay_variant).agents),
+            model=args.replay_model,
+            concurrency=max(1, args.replay_concurrency),
+            limit=args.replay_limit,
+            since=args.replay_since,
+        ))
+        print(format_report(report))
+        if args.replay_output:
+            with open(args.replay_output, 'w') as f:
+                json.dump(report, f, indent=2)
+        return
+    channels = [name for name in ('terminal', 'telegram', 'whatsapp') if getattr(args, name)]
+    if not channels and not args.telegram_webhook:
+        parser.error("one of --terminal, --telegram, --telegram-webhook, --whatsapp or --replay is required")
+    if args.telegram_webhook and (args.terminal or args.whatsapp):
+        parser.error("--telegram-webhook already serves WhatsApp on the same server; run it on its own")
+    configure_logging()
     
-    if args.terminal:
-        asyncio.run(run_terminal())
-    elif args.telegram:
-        token = os.getenv('TELEGRAM_BOT_TOKEN')
-        if not token:
-            print("Error: TELEGRAM_BOT_TOKEN not found in .env file")
-            return
-        run_telegram_bot(token)
-    elif args.whatsapp:
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if (args.telegram or args.telegram_webhook) and not token:
+        print("Error: TELEGRAM_BOT_TOKEN not found in .env file")
+        return
+    if args.whatsapp:
         # Verify required environment variables
-        required_vars = ['WHATSAPP_TOKEN', 'WHATSAPP_PHONE_NUMBER_ID']
+        required_vars = ['WHATSAPP_TOKEN', 'WHATSAPP_PHONE_NUMBER_ID', 'WHATSAPP_APP_SECRET']
         missing_vars = [var for var in required_vars if not os.getenv(var)]
         if missing_vars:
             print(f"Error: Missing required environment variables: {', '.join(missing_vars)}")
             print("Please add them to your .env file and try again.")
             return
-            
-        run_whatsapp_webhook(host=args.host, port=args.port)
+    
+    if len(channels) > 1:
+        if args.workers > 1:
+            print("Error: --workers is not supported when combining channels in one process")
+            return
+        print(f"Starting combined mode: {', '.join(channels)}")
+        asyncio.run(run_channels(channels, token, args.host, args.port))
+    elif args.terminal:
+        try:
+            asyncio.run(run_terminal())
+        except KeyboardInterrupt:
+            # asyncio.run cancels the terminal task on Ctrl+C, then re-raises here
+            print("\n\nAlvida! Phir milenge. 😊")
+    elif args.telegram:
+        run_telegram_bot(token)
+    elif args.telegram_webhook:
+        TELEGRAM_WEBHOOK_URL = args.telegram_webhook
+        TELEGRAM_WEBHOOK_WORKERS = args.telegram_workers
+        print(f"Starting Telegram webhook server on http://{args.host}:{args.port}{TELEGRAM_WEBHOOK_PATH}")
+        uvicorn.run(app, host=args.host, port=args.port)
+    elif args.whatsapp:
+        run_whatsapp_webhook(host=args.host, port=args.port, workers=args.workers)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+import zlib
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Callable, Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+from agno.agent import Agent
+from agno.memory.v2.db.postgres import PostgresMemoryDb
+from agno.memory.v2.memory import Memory
+from agno.storage.postgres import PostgresStorage
+
+from db import DB_SCHEMA, get_engine
+from resilience import ResilientOpenAIChat
+
+logger = logging.getLogger(__name__)
+
+# JSON list of extra agent variants (personas, prompt experiments); see load_variants
+AGENT_VARIANTS_FILE = os.getenv("AGENT_VARIANTS_FILE")
+# Variant for users who are neither pinned nor in a weighted experiment
+DEFAULT_VARIANT = os.getenv("AGENT_DEFAULT_VARIANT", "tara")
+
+
+@dataclass(frozen=True)
+class AgentVariant:
+    """One immutable agent configuration.
+
+    `weight` is the share of users (by stable hash of their ID) assigned to
+    the variant; weights of all variants are relative to each other and any
+    remainder below 1.0 goes to the default. `users` pins user IDs (as used
+    for sessions, e.g. "whatsapp_9198...") to the variant regardless of weight.
+    """
+
+    name: str
+    system_message: Optional[str] = None  # None: the built-in Tara prompt
+    small_talk_message: Optional[str] = None  # None: the built-in small-talk prompt
+    storage_table: str = "tara_agent_sessions"
+    memory_table: str = "tara_user_memories"
+    weight: float = 0.0
+    users: FrozenSet[str] = field(default_factory=frozenset)
+
+
+@dataclass(frozen=True)
+class AgentSet:
+    """The prebuilt agents of one variant, keyed by route (tool profile or small talk)."""
+
+    variant: AgentVariant
+    agents: Mapping[str, Agent]
+    memory: Memory
+    storage: PostgresStorage
+
+
+def load_variants(path: Optional[str] = AGENT_VARIANTS_FILE) -> List[AgentVariant]:
+    """The default variant plus any listed in the JSON file at `path`.
+
+    Each entry takes AgentVariant's fields; "system_message_file" and
+    "small_talk_message_file" (relative to the JSON file) may be given instead
+    of the inline prompts.
+    """
+    variants = {DEFAULT_VARIANT: AgentVariant(name=DEFAULT_VARIANT)}
+    if not path:
+        return list(variants.values())
+    with open(path) as f:
+        entries = json.load(f)
+    for entry in entries:
+        entry = dict(entry)
+        for key in ("system_message", "small_talk_message"):
+            prompt_file = entry.pop(f"{key}_file", None)
+            if prompt_file:
+                with open(os.path.join(os.path.dirname(path), prompt_file)) as f:
+                    entry[key] = f.read()
+        entry["users"] = frozenset(str(user) for user in entry.get("users", ()))
+        variants[entry["name"]] = AgentVariant(**entry)
+    return list(variants.values())
+
+
+class AgentRegistry:
+    """Prebuilt agent sets for every variant, selected per user.
+
+    All agents are built once at startup. Variants on the same tables share
+    one Memory and one PostgresStorage, every table uses this process's
+    single engine (db.get_engine), and `build` is expected to reuse the
+    toolkits and model settings, so a variant adds no connections and
+    nothing is constructed per request.
+    """
+
+    def __init__(self, variants: List[AgentVariant],
+                 build: Callable[[AgentVariant, Memory, PostgresStorage], Dict[str, Agent]]):
+        memories: Dict[str, Memory] = {}
+        storages: Dict[str, PostgresStorage] = {}
+        self._sets: Dict[str, AgentSet] = {}
+        for variant in variants:
+            memory = memories.get(variant.memory_table)
+            if memory is None:
+                memory = memories[variant.memory_table] = Memory(
+                    # Shares the OpenAI clients of the agents' models (sync and async). Its own
+                    # breaker, so memory/summary failures never fail or degrade finished replies
+                    model=ResilientOpenAIChat(id="gpt-4.1-nano", breaker="openai_memory"),
+                    db=PostgresMemoryDb(table_name=variant.memory_table, schema=DB_SCHEMA, db_engine=get_engine()),
+                )
+            storage = storages.get(variant.storage_table)
+            if storage is None:
+                storage = storages[variant.storage_table] = PostgresStorage(
+                    table_name=variant.storage_table, schema=DB_SCHEMA, db_engine=get_engine()
+                )
+            agents = MappingProxyType(build(variant, memory, storage))
+            self._sets[variant.name] = AgentSet(variant, agents, memory, storage)
+        if DEFAULT_VARIANT not in self._sets:
+            raise ValueError(f"Default agent variant {DEFAULT_VARIANT!r} is not configured")
+        self._pinned = {user: v.name for v in variants for user in v.users}
+        # Cumulative weight boundaries for hash-based assignment
+        self._buckets: List[Tuple[float, str]] = []
+        total = 0.0
+        for variant in variants:
+            if variant.weight > 0:
+                total += variant.weight
+                self._buckets.append((total, variant.name))
+        self._scale = max(total, 1.0)
+        logger.info("Agent variants ready", extra={"fields": {
+            "variants": list(self._sets), "default": DEFAULT_VARIANT,
+        }})
+
+    @property
+    def default(self) -> AgentSet:
+        return self._sets[DEFAULT_VARIANT]
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._sets)
+
+    def get(self, name: str) -> AgentSet:
+        return self._sets[name]
+
+    def for_user(self, user_id: Optional[str]) -> AgentSet:
+        """The user's variant: pinned, else their stable experiment bucket, else the default."""
+        if user_id is None:
+            return self.default
+        pinned = self._pinned.get(user_id)
+        if pinned is not None:
+            return self._sets[pinned]
+        if self._buckets:
+            # crc32 is stable across processes and restarts, unlike hash() on str
+            point = (zlib.crc32(user_id.encode()) % 10_000) / 10_000 * self._scale
+            for boundary, name in self._buckets:
+                if point < boundary:
+                    return self._sets[name]
+        return self.default
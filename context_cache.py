@@ -0,0 +1,198 @@
+import contextvars
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from agno.memory.v2.memory import SessionSummary, UserMemory
+from agno.models.message import Message
+from agno.run.response import RunResponse
+from agno.storage.session.agent import AgentSession
+from cachetools import TTLCache
+from sqlalchemy import func, select
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Set CONTEXT_CACHE=0 to load session, memories and summary from Postgres on every turn
+CONTEXT_CACHE = os.getenv("CONTEXT_CACHE", "1") != "0"
+# Sessions kept (least recently used go first) and how long a snapshot is trusted at most
+CONTEXT_CACHE_SIZE = int(os.getenv("CONTEXT_CACHE_SIZE", "10000"))
+CONTEXT_CACHE_TTL_SECONDS = float(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "1800"))
+# Check the session's version in Postgres before using a snapshot. Needed whenever
+# another process may write the same session (e.g. several WhatsApp workers);
+# 0 trusts the snapshot outright and makes a hit a pure in-process lookup.
+CONTEXT_CACHE_VERIFY = os.getenv("CONTEXT_CACHE_VERIFY", "1") != "0"
+
+# (storage table, memory table, session_id)
+SnapshotKey = Tuple[str, str, str]
+# (updated_at, number of runs) of the stored session row
+SessionVersion = Tuple[Optional[int], int]
+
+
+def render_memories(memories: List[UserMemory]) -> str:
+    """User memories as prompt text (empty when there are none)."""
+    if not memories:
+        return ""
+    lines = "\n".join(f"- {memory.memory}" for memory in memories)
+    return f"What you know about the user:\n{lines}"
+
+
+def render_summary(summary: Optional[SessionSummary]) -> str:
+    """Session summary as prompt text (empty when there is none)."""
+    if summary is None or not summary.summary:
+        return ""
+    return f"Summary of the conversation so far:\n{summary.summary}"
+
+
+@dataclass
+class ContextSnapshot:
+    """What a turn of one session needs from Postgres, as of the session's last write.
+
+    agno copies the variant's Memory into each agent on its first run, and
+    that copy is then shared by every user of the agent. The session's runs
+    are kept here too (as written), so whichever agent serves the next turn
+    can restore this session's entries without touching anyone else's.
+    Memories and summary are kept rendered to prompt text; history is kept
+    per (num_history_runs, token budget) as selected by history_window.
+    """
+
+    user_id: Optional[str]
+    session: AgentSession
+    version: SessionVersion
+    runs: List[RunResponse]
+    summary: Optional[SessionSummary]
+    memories_text: str
+    summary_text: str
+    history: Dict[Tuple[int, int], List[Message]] = field(default_factory=dict)
+
+
+# Snapshot in use by the current turn, set when the session is read
+current_snapshot: contextvars.ContextVar[Optional[ContextSnapshot]] = contextvars.ContextVar(
+    "current_snapshot", default=None
+)
+
+
+def snapshot_key(agent) -> Optional[SnapshotKey]:
+    """Partial key for an agent's tables, or None if it has no Postgres storage and memory."""
+    storage, memory = agent.storage, agent.memory
+    db = getattr(memory, "db", None)
+    if not CONTEXT_CACHE or storage is None or db is None:
+        return None
+    return storage.table_name, db.table_name
+
+
+def _session_version(session: AgentSession) -> SessionVersion:
+    return session.updated_at, len((session.memory or {}).get("runs") or [])
+
+
+def _stored_version(storage, session_id: str) -> Optional[SessionVersion]:
+    """Version of the stored session row: one indexed lookup, no session payload transferred."""
+    table = storage.table
+    stmt = select(table.c.updated_at, func.jsonb_array_length(table.c.memory["runs"])).where(
+        table.c.session_id == session_id
+    )
+    with storage.db_engine.connect() as connection:
+        row = connection.execute(stmt).first()
+    return None if row is None else (row[0], row[1] or 0)
+
+
+class ContextCache:
+    """Per-session context snapshots in a bounded LRU with a TTL.
+
+    Postgres stays the source of truth: snapshots are only ever built from
+    the session row a turn just wrote, verified against the stored version
+    before use (CONTEXT_CACHE_VERIFY) and dropped on mismatch, on
+    /clear_memory and after CONTEXT_CACHE_TTL_SECONDS.
+    """
+
+    def __init__(self, maxsize: int = CONTEXT_CACHE_SIZE, ttl: float = CONTEXT_CACHE_TTL_SECONDS):
+        self._snapshots: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def lookup(self, agent, session_id: str) -> Optional[ContextSnapshot]:
+        """The session's snapshot if it is still current, else None."""
+        tables = snapshot_key(agent)
+        if tables is None:
+            return None
+        key = (*tables, session_id)
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            metrics.inc("context_cache_lookups_total", result="miss")
+            return None
+        if CONTEXT_CACHE_VERIFY:
+            try:
+                stored = _stored_version(agent.storage, session_id)
+            except Exception as e:
+                logger.warning(f"Context snapshot check failed, loading session instead: {e}")
+                stored = None
+            if stored != snapshot.version:
+                self._drop(key)
+                metrics.inc("context_cache_lookups_total", result="stale")
+                return None
+        metrics.inc("context_cache_lookups_total", result="hit")
+        return snapshot
+
+    def store(self, agent, session_id: str, session: Optional[AgentSession],
+              user_id: Optional[str]) -> Optional[ContextSnapshot]:
+        """Build the snapshot of the session row the agent just wrote, reusing what didn't change."""
+        tables = snapshot_key(agent)
+        if tables is None:
+            return None
+        key = (*tables, session_id)
+        if session is None:
+            # The write failed: what is in memory may not match Postgres
+            self._drop(key)
+            return None
+        with self._lock:
+            previous = self._snapshots.get(key)
+        summary_data = ((session.memory or {}).get("summaries") or {}).get(user_id or "default", {}).get(session_id)
+        summary = SessionSummary.from_dict(summary_data) if summary_data else None
+        if previous is not None and not agent.enable_user_memories and not agent.enable_agentic_memory:
+            # This turn couldn't have changed the user's memories
+            memories_text = previous.memories_text
+        else:
+            memories_text = render_memories(self._user_memories(agent, user_id))
+        snapshot = ContextSnapshot(
+            user_id=user_id,
+            session=session,
+            version=_session_version(session),
+            runs=list((agent.memory.runs or {}).get(session_id, [])),
+            summary=summary,
+            memories_text=memories_text,
+            summary_text=render_summary(summary),
+        )
+        with self._lock:
+            self._snapshots[key] = snapshot
+            metrics.set("context_cache_sessions", len(self._snapshots))
+        return snapshot
+
+    @staticmethod
+    def _user_memories(agent, user_id: Optional[str]) -> List[UserMemory]:
+        # The memory manager has just refreshed this user's memories, unless a
+        # concurrent turn of another user has replaced them since; then read them
+        memories = (agent.memory.memories or {}).get(user_id or "default")
+        if memories is not None:
+            return list(memories.values())
+        return [
+            UserMemory.from_dict(row.memory)
+            for row in agent.memory.db.read_memories(user_id=user_id or "default")
+            if row.memory
+        ]
+
+    def invalidate_user(self, user_id: str) -> None:
+        """Drop every snapshot of a user (e.g. after their memories were cleared)."""
+        with self._lock:
+            for key in [key for key, snapshot in self._snapshots.items() if snapshot.user_id == user_id]:
+                self._snapshots.pop(key, None)
+            metrics.set("context_cache_sessions", len(self._snapshots))
+
+    def _drop(self, key: SnapshotKey) -> None:
+        with self._lock:
+            self._snapshots.pop(key, None)
+
+
+context_cache = ContextCache()
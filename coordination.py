@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, List, NamedTuple, Optional
+
+from cachetools import TTLCache
+from sqlalchemy import text
+
+from db import DB_SCHEMA, ensure_table, get_engine
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Coordination configuration
+COORDINATION_BACKEND = os.getenv("COORDINATION_BACKEND", "auto")  # "auto", "memory" or "postgres"
+COORDINATION_TABLE = os.getenv("COORDINATION_TABLE", "tara_whatsapp_inbox")
+# How long a message ID is remembered for dedup of webhook retries
+DEDUP_TTL_SECONDS = int(os.getenv("DEDUP_TTL_SECONDS", "86400"))
+# A turn still "processing" after this long is assumed to belong to a dead worker
+STALE_TURN_SECONDS = int(os.getenv("STALE_TURN_SECONDS", "600"))
+
+
+class Ticket(NamedTuple):
+    """A claimed inbound message, passed from claim() to turn()."""
+    user_id: str
+    message_id: str
+    seq: Optional[int]
+
+
+class LocalCoordinator:
+    """Dedup and per-user ordering for a single process."""
+
+    def __init__(self):
+        self._seen = TTLCache(maxsize=200_000, ttl=DEDUP_TTL_SECONDS)
+        self._locks: Dict[str, List] = {}  # user_id -> [lock, pending count]
+
+    async def claim(self, message_id: str, user_id: str) -> Optional[Ticket]:
+        """Return a ticket for a first delivery, or None for a duplicate."""
+        if message_id in self._seen:
+            return None
+        self._seen[message_id] = True
+        return Ticket(user_id, message_id, None)
+
+    @asynccontextmanager
+    async def turn(self, ticket: Ticket):
+        """Hold the user's turn; asyncio.Lock is FIFO, so arrival order is kept."""
+        entry = self._locks.setdefault(ticket.user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(ticket.user_id, None)
+
+    async def skip(self, ticket: Ticket) -> None:
+        """Drop a claimed message without taking a turn (it stays deduplicated)."""
+
+
+class PostgresCoordinator:
+    """Dedup and per-user ordering shared by every worker process via Postgres.
+
+    Each message is inserted into an inbox table (a conflict means it is a
+    webhook retry). A worker may start a message only when no older message
+    of the same user is pending and none is processing; that check runs under
+    a transaction-scoped advisory lock on the user, so no connection is held
+    while the agent runs.
+    """
+
+    def __init__(self):
+        self.table = f"{DB_SCHEMA}.{COORDINATION_TABLE}"
+        ensure_table(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "message_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, seq BIGSERIAL, "
+            "status TEXT NOT NULL DEFAULT 'pending', "
+            "received_at TIMESTAMPTZ NOT NULL DEFAULT now(), started_at TIMESTAMPTZ)"
+        )
+        ensure_table(
+            f"CREATE INDEX IF NOT EXISTS {COORDINATION_TABLE}_user_seq_idx "
+            f"ON {self.table} (user_id, seq) WHERE status <> 'done'"
+        )
+        self._claims = 0
+        self._purge()
+
+    def _purge(self) -> None:
+        with get_engine().begin() as conn:
+            conn.execute(
+                text(f"DELETE FROM {self.table} WHERE received_at < now() - make_interval(secs => :ttl)"),
+                {"ttl": DEDUP_TTL_SECONDS},
+            )
+
+    def _claim(self, message_id: str, user_id: str) -> Optional[int]:
+        with get_engine().begin() as conn:
+            row = conn.execute(
+                text(f"INSERT INTO {self.table} (message_id, user_id) VALUES (:mid, :uid) "
+                     "ON CONFLICT (message_id) DO NOTHING RETURNING seq"),
+                {"mid": message_id, "uid": user_id},
+            ).first()
+        self._claims += 1
+        if self._claims % 1000 == 0:
+            self._purge()
+        return row[0] if row else None
+
+    def _try_start(self, ticket: Ticket) -> bool:
+        with get_engine().begin() as conn:
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtextextended(:uid, 0))"), {"uid": ticket.user_id})
+            row = conn.execute(
+                text(f"""
+                    UPDATE {self.table} SET status = 'processing', started_at = now()
+                    WHERE message_id = :mid AND status = 'pending'
+                    AND NOT EXISTS (
+                        SELECT 1 FROM {self.table} o
+                        WHERE o.user_id = :uid AND o.message_id <> :mid
+                        AND ((o.status = 'pending' AND o.seq < :seq) OR o.status = 'processing')
+                        AND COALESCE(o.started_at, o.received_at) > now() - make_interval(secs => :stale)
+                    )
+                    RETURNING 1
+                """),
+                {"mid": ticket.message_id, "uid": ticket.user_id, "seq": ticket.seq, "stale": STALE_TURN_SECONDS},
+            ).first()
+        return row is not None
+
+    def _finish(self, ticket: Ticket) -> None:
+        with get_engine().begin() as conn:
+            conn.execute(text(f"UPDATE {self.table} SET status = 'done' WHERE message_id = :mid"),
+                         {"mid": ticket.message_id})
+
+    async def claim(self, message_id: str, user_id: str) -> Optional[Ticket]:
+        """Return a ticket for a first delivery, or None for a duplicate."""
+        seq = await asyncio.to_thread(self._claim, message_id, user_id)
+        return Ticket(user_id, message_id, seq) if seq is not None else None
+
+    @asynccontextmanager
+    async def turn(self, ticket: Ticket):
+        """Wait until it is this message's turn for its user, then hold it."""
+        delay = 0.05
+        while not await asyncio.to_thread(self._try_start, ticket):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self._finish, ticket)
+
+    async def skip(self, ticket: Ticket) -> None:
+        """Mark a claimed message done without taking a turn, so it doesn't hold up the user's next one."""
+        await asyncio.to_thread(self._finish, ticket)
+
+
+_coordinator = None
+
+
+def get_coordinator():
+    """Return the process-wide coordinator.
+
+    "auto" uses Postgres whenever more than one worker process is configured
+    (WHATSAPP_WORKERS), since in-process state cannot see other workers.
+    """
+    global _coordinator
+    if _coordinator is None:
+        backend = COORDINATION_BACKEND
+        if backend == "auto":
+            backend = "postgres" if int(os.getenv("WHATSAPP_WORKERS", "1")) > 1 else "memory"
+        _coordinator = PostgresCoordinator() if backend == "postgres" else LocalCoordinator()
+        logger.info(f"Using {backend} coordination for WhatsApp dedup and ordering")
+    return _coordinator
+
+
+async def claim_message(message_id: str, user_id: str) -> Optional[Ticket]:
+    """Claim a message for processing; None means it was already delivered."""
+    ticket = await get_coordinator().claim(message_id, user_id)
+    if ticket is None:
+        metrics.inc("whatsapp_duplicate_deliveries_total")
+    return ticket
@@ -0,0 +1,43 @@
+import os
+import threading
+from typing import Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+
+# Schema shared with agno's PostgresStorage / PostgresMemoryDb tables
+DB_SCHEMA = "ai"
+
+_engine: Optional[Engine] = None
+_engine_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+def get_engine() -> Engine:
+    """Return this process's SQLAlchemy engine for DATABASE_URL.
+
+    Created lazily and re-created after a fork, so every worker process owns
+    its own connection pool instead of sharing sockets with its parent.
+    """
+    global _engine, _engine_pid
+    pid = os.getpid()
+    if _engine is not None and _engine_pid == pid:
+        return _engine
+    with _lock:
+        if _engine is None or _engine_pid != pid:
+            _engine = create_engine(os.getenv("DATABASE_URL"), pool_pre_ping=True)
+            _engine_pid = pid
+    return _engine
+
+
+def ensure_table(ddl: str) -> None:
+    """Create the shared schema and run a CREATE TABLE IF NOT EXISTS statement."""
+    with get_engine().begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {DB_SCHEMA}"))
+        conn.execute(text(ddl))
+
+
+def dispose_engine() -> None:
+    """Close this process's pooled connections (e.g. at shutdown)."""
+    if _engine is not None and _engine_pid == os.getpid():
+        _engine.dispose()
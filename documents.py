@@ -0,0 +1,447 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Deque, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import requests
+from agno.tools import Toolkit
+from sqlalchemy import text
+
+from db import DB_SCHEMA, ensure_table, get_engine
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Document ingestion limits and configuration
+DOCUMENT_MAX_BYTES = int(os.getenv("DOCUMENT_MAX_MB", "20")) * 1024 * 1024
+DOCUMENT_MAX_PAGES = int(os.getenv("DOCUMENT_MAX_PAGES", "200"))
+DOCUMENT_WORKERS = int(os.getenv("DOCUMENT_WORKERS", "2"))
+# Pages extracted per worker task; bounds how much text is held in memory at once
+DOCUMENT_PAGES_PER_TASK = int(os.getenv("DOCUMENT_PAGES_PER_TASK", "10"))
+DOCUMENT_CHUNK_CHARS = int(os.getenv("DOCUMENT_CHUNK_CHARS", "1500"))
+DOCUMENT_CHUNK_OVERLAP = int(os.getenv("DOCUMENT_CHUNK_OVERLAP", "200"))
+# Most characters of document text returned to the model by one search
+DOCUMENT_SEARCH_MAX_CHARS = int(os.getenv("DOCUMENT_SEARCH_MAX_CHARS", "6000"))
+# A document still "processing" after this long is assumed to belong to a dead worker
+DOCUMENT_STALE_SECONDS = int(os.getenv("DOCUMENT_STALE_SECONDS", "600"))
+DOCUMENTS_TABLE = f"{DB_SCHEMA}.tara_user_documents"
+CHUNKS_TABLE = f"{DB_SCHEMA}.tara_user_document_chunks"
+
+SUPPORTED_DOCUMENT_TYPES = {"application/pdf"}
+
+# User the current agent turn belongs to; set by run_agent_turn for the document tools
+current_user_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_user_id", default=None)
+
+
+class DocumentError(Exception):
+    """A document that cannot be ingested; the message is safe to show the user."""
+
+
+class IngestedDocument(NamedTuple):
+    document_id: int
+    filename: str
+    pages: int
+    chunks: int
+    cached: bool
+
+
+def is_supported_document(mime_type: Optional[str], filename: Optional[str] = None) -> bool:
+    """True for documents the ingestion pipeline can read (PDFs)."""
+    if mime_type in SUPPORTED_DOCUMENT_TYPES:
+        return True
+    return bool(filename) and filename.lower().endswith(".pdf")
+
+
+# Worker-process side -------------------------------------------------------
+
+def _open_pdf(path: str):
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    if reader.is_encrypted and not reader.decrypt(""):
+        raise DocumentError(
+            "This PDF is password-protected. Please send an unlocked copy "
+            "(most statement apps have a 'download without password' option)."
+        )
+    return reader
+
+
+def count_pages(path: str) -> int:
+    """Number of pages in a PDF (runs in a worker process)."""
+    return len(_open_pdf(path).pages)
+
+
+def extract_pages(path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Extract text of pages [start, end) as (1-based page number, text) pairs.
+
+    Runs in a worker process. pypdf reads objects from the file lazily, so
+    only these pages are parsed and held in memory.
+    """
+    reader = _open_pdf(path)
+    pages = []
+    for number in range(start, end):
+        try:
+            pages.append((number + 1, reader.pages[number].extract_text() or ""))
+        except Exception as e:
+            # One broken page should not sink the whole statement
+            pages.append((number + 1, ""))
+            logging.getLogger(__name__).warning(f"Could not extract page {number + 1}: {e}")
+    return pages
+
+
+# Chunking ------------------------------------------------------------------
+
+def chunk_page(page_text: str, size: int = DOCUMENT_CHUNK_CHARS, overlap: int = DOCUMENT_CHUNK_OVERLAP) -> Iterator[str]:
+    """Split one page into overlapping chunks, preferring line breaks as boundaries."""
+    page_text = "\n".join(line.strip() for line in page_text.splitlines() if line.strip())
+    start = 0
+    while start < len(page_text):
+        end = min(len(page_text), start + size)
+        if end < len(page_text):
+            newline = page_text.rfind("\n", start + size // 2, end)
+            if newline != -1:
+                end = newline
+        yield page_text[start:end]
+        if end >= len(page_text):
+            break
+        start = max(end - overlap, start + 1)
+
+
+# Storage -------------------------------------------------------------------
+
+_tables_ready = False
+
+
+def _ensure_tables() -> None:
+    global _tables_ready
+    if _tables_ready:
+        return
+    ensure_table(
+        f"CREATE TABLE IF NOT EXISTS {DOCUMENTS_TABLE} ("
+        "id BIGSERIAL PRIMARY KEY, user_id TEXT NOT NULL, sha256 TEXT NOT NULL, filename TEXT, "
+        "pages INTEGER, chunks INTEGER, status TEXT NOT NULL DEFAULT 'processing', "
+        "created_at TIMESTAMPTZ NOT NULL DEFAULT now(), UNIQUE (user_id, sha256))"
+    )
+    ensure_table(
+        f"CREATE TABLE IF NOT EXISTS {CHUNKS_TABLE} ("
+        f"document_id BIGINT NOT NULL REFERENCES {DOCUMENTS_TABLE}(id) ON DELETE CASCADE, "
+        "user_id TEXT NOT NULL, page INTEGER NOT NULL, chunk_no INTEGER NOT NULL, content TEXT NOT NULL, "
+        "tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED, "
+        "PRIMARY KEY (document_id, chunk_no))"
+    )
+    ensure_table(f"CREATE INDEX IF NOT EXISTS tara_user_document_chunks_tsv_idx ON {CHUNKS_TABLE} USING GIN (tsv)")
+    ensure_table(f"CREATE INDEX IF NOT EXISTS tara_user_document_chunks_user_idx ON {CHUNKS_TABLE} (user_id)")
+    _tables_ready = True
+
+
+def _escape_like(value: str) -> str:
+    """Escape LIKE wildcards so the value matches literally (with ESCAPE '\\')."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _claim_document(user_id: str, sha256: str, filename: str) -> Tuple[int, Optional[IngestedDocument]]:
+    """Insert the document row; returns the existing document when this user already sent it.
+
+    A row left "processing" for DOCUMENT_STALE_SECONDS (its worker crashed or
+    was killed mid-ingestion) is taken over and its partial chunks discarded.
+    """
+    _ensure_tables()
+    # A conflicting row can be dropped (failed ingestion) before it is read; then claim again
+    for _ in range(3):
+        with get_engine().begin() as conn:
+            row = conn.execute(
+                text(f"INSERT INTO {DOCUMENTS_TABLE} (user_id, sha256, filename) VALUES (:uid, :sha, :name) "
+                     "ON CONFLICT (user_id, sha256) DO NOTHING RETURNING id"),
+                {"uid": user_id, "sha": sha256, "name": filename},
+            ).first()
+            if row is not None:
+                return row[0], None
+            row = conn.execute(
+                text(f"UPDATE {DOCUMENTS_TABLE} SET created_at = now(), filename = :name "
+                     "WHERE user_id = :uid AND sha256 = :sha AND status = 'processing' "
+                     "AND created_at < now() - make_interval(secs => :stale) RETURNING id"),
+                {"uid": user_id, "sha": sha256, "name": filename, "stale": DOCUMENT_STALE_SECONDS},
+            ).first()
+            if row is not None:
+                conn.execute(text(f"DELETE FROM {CHUNKS_TABLE} WHERE document_id = :id"), {"id": row[0]})
+                metrics.inc("documents_stale_reclaimed_total")
+                return row[0], None
+            existing = conn.execute(
+                text(f"SELECT id, filename, pages, chunks, status FROM {DOCUMENTS_TABLE} "
+                     "WHERE user_id = :uid AND sha256 = :sha"),
+                {"uid": user_id, "sha": sha256},
+            ).first()
+        if existing is None:
+            continue
+        if existing.status != "ready":
+            break
+        return existing.id, IngestedDocument(existing.id, existing.filename, existing.pages, existing.chunks, True)
+    raise DocumentError("I'm still reading this document, give me a moment 🙂")
+
+
+def _copy_from_cache(document_id: int, user_id: str, sha256: str) -> Optional[Tuple[int, int]]:
+    """Reuse chunks of the same file already extracted for another user."""
+    with get_engine().begin() as conn:
+        source = conn.execute(
+            text(f"SELECT id, pages, chunks FROM {DOCUMENTS_TABLE} "
+                 "WHERE sha256 = :sha AND status = 'ready' AND id <> :id LIMIT 1"),
+            {"sha": sha256, "id": document_id},
+        ).first()
+        if source is None:
+            return None
+        conn.execute(
+            text(f"INSERT INTO {CHUNKS_TABLE} (document_id, user_id, page, chunk_no, content) "
+                 f"SELECT :id, :uid, page, chunk_no, content FROM {CHUNKS_TABLE} WHERE document_id = :src"),
+            {"id": document_id, "uid": user_id, "src": source.id},
+        )
+    return source.pages, source.chunks
+
+
+def _store_chunks(rows: List[dict]) -> None:
+    if rows:
+        with get_engine().begin() as conn:
+            conn.execute(
+                text(f"INSERT INTO {CHUNKS_TABLE} (document_id, user_id, page, chunk_no, content) "
+                     "VALUES (:document_id, :user_id, :page, :chunk_no, :content)"),
+                rows,
+            )
+
+
+def _finish_document(document_id: int, pages: int, chunks: int) -> None:
+    with get_engine().begin() as conn:
+        conn.execute(
+            text(f"UPDATE {DOCUMENTS_TABLE} SET status = 'ready', pages = :pages, chunks = :chunks WHERE id = :id"),
+            {"id": document_id, "pages": pages, "chunks": chunks},
+        )
+
+
+def _drop_document(document_id: int) -> None:
+    with get_engine().begin() as conn:
+        conn.execute(text(f"DELETE FROM {DOCUMENTS_TABLE} WHERE id = :id"), {"id": document_id})
+
+
+# Downloads -----------------------------------------------------------------
+
+def new_document_path(suffix: str = ".pdf") -> str:
+    """Create an empty temp file for a download; the caller removes it."""
+    fd, path = tempfile.mkstemp(prefix="tara-doc-", suffix=suffix)
+    os.close(fd)
+    return path
+
+
+def download_to_file(url: str, path: str, headers: Optional[dict] = None) -> None:
+    """Stream a download to disk, aborting once it exceeds DOCUMENT_MAX_BYTES (blocking)."""
+    size = 0
+    with requests.get(url, headers=headers, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        declared = int(response.headers.get("Content-Length") or 0)
+        if declared > DOCUMENT_MAX_BYTES:
+            raise DocumentError(_too_large_message())
+        with open(path, "wb") as out:
+            for block in response.iter_content(chunk_size=64 * 1024):
+                size += len(block)
+                if size > DOCUMENT_MAX_BYTES:
+                    raise DocumentError(_too_large_message())
+                out.write(block)
+
+
+def _too_large_message() -> str:
+    return f"That file is too big for me 😅 Please send a document under {DOCUMENT_MAX_BYTES // (1024 * 1024)} MB."
+
+
+def _hash_file(path: str) -> Tuple[str, int]:
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+# Ingestion -----------------------------------------------------------------
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawn (not fork) so workers never inherit the parent's threads, sockets or DB pools
+        _pool = ProcessPoolExecutor(max_workers=DOCUMENT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_document_pool() -> None:
+    """Stop the document worker processes."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def ingest_document(user_id: str, path: str, filename: str) -> IngestedDocument:
+    """Extract, chunk and index a downloaded PDF for `user_id`.
+
+    The file is identified by its SHA-256: a document this user already sent
+    is not processed again, and one already extracted for someone else is
+    copied instead of re-extracted. Pages are extracted in batches on the
+    worker pool and stored as they arrive, so memory use does not grow with
+    the size of the statement. Raises DocumentError with a user-facing message.
+    """
+    started = time.perf_counter()
+    sha256, size = await asyncio.to_thread(_hash_file, path)
+    if size > DOCUMENT_MAX_BYTES:
+        raise DocumentError(_too_large_message())
+    document_id, existing = await asyncio.to_thread(_claim_document, user_id, sha256, filename)
+    if existing is not None:
+        metrics.inc("document_cache_hits_total", scope="user")
+        return existing
+
+    try:
+        cached = await asyncio.to_thread(_copy_from_cache, document_id, user_id, sha256)
+        if cached is not None:
+            pages, chunks = cached
+            await asyncio.to_thread(_finish_document, document_id, pages, chunks)
+            metrics.inc("document_cache_hits_total", scope="global")
+            return IngestedDocument(document_id, filename, pages, chunks, True)
+
+        loop = asyncio.get_running_loop()
+        pool = _get_pool()
+        try:
+            pages = await loop.run_in_executor(pool, count_pages, path)
+        except DocumentError:
+            raise
+        except Exception as e:
+            logger.warning(f"Could not open document: {e}")
+            raise DocumentError("I couldn't read that PDF. Is it a valid, unlocked PDF file?")
+        if pages > DOCUMENT_MAX_PAGES:
+            raise DocumentError(f"That document has {pages} pages; I can read up to {DOCUMENT_MAX_PAGES} pages at a time.")
+
+        starts = list(range(0, pages, DOCUMENT_PAGES_PER_TASK))
+        window: Deque[asyncio.Future] = deque()
+        chunks = 0
+        chars = 0
+        # Keep a few batches in flight and store them in page order, so only those sit in memory
+        while starts or window:
+            while starts and len(window) < DOCUMENT_WORKERS * 2:
+                start = starts.pop(0)
+                end = min(start + DOCUMENT_PAGES_PER_TASK, pages)
+                window.append(loop.run_in_executor(pool, extract_pages, path, start, end))
+            rows = []
+            for page_number, page_text in await window.popleft():
+                chars += len(page_text)
+                for content in chunk_page(page_text):
+                    rows.append({"document_id": document_id, "user_id": user_id, "page": page_number,
+                                 "chunk_no": chunks, "content": content})
+                    chunks += 1
+            await asyncio.to_thread(_store_chunks, rows)
+        if chunks == 0:
+            raise DocumentError(
+                "I couldn't find any text in that PDF - it may be a scanned image. "
+                "Try sending a screenshot of the pages instead."
+            )
+        await asyncio.to_thread(_finish_document, document_id, pages, chunks)
+    except BaseException:
+        await asyncio.to_thread(_drop_document, document_id)
+        metrics.inc("documents_failed_total")
+        raise
+
+    metrics.inc("documents_ingested_total")
+    metrics.inc("document_pages_total", pages)
+    metrics.observe("document_ingest_seconds", time.perf_counter() - started)
+    logger.info("Document ingested", extra={"fields": {
+        "document_id": document_id, "pages": pages, "chunks": chunks, "chars": chars,
+        "bytes": size, "sha256": sha256[:12],
+    }})
+    return IngestedDocument(document_id, filename, pages, chunks, False)
+
+
+def document_prompt(document: IngestedDocument, caption: Optional[str]) -> str:
+    """Turn text telling the agent a document was shared (the document itself stays out of the prompt)."""
+    note = f"[I shared a document: {document.filename}, {document.pages} pages. Search it with search_my_documents.]"
+    return f"{caption}\n\n{note}" if caption else f"{note}\nGive me a short overview of what this document shows."
+
+
+# Agent tools ---------------------------------------------------------------
+
+class DocumentTools(Toolkit):
+    """Search the statements and documents the current user has shared."""
+
+    def __init__(self, **kwargs):
+        super().__init__(name="document_tools", tools=[self.list_my_documents, self.search_my_documents], **kwargs)
+
+    def list_my_documents(self) -> str:
+        """List the documents (e.g. bank or mutual fund statements) the user has shared.
+
+        Returns:
+            str: JSON list of documents with id, filename, pages and upload time.
+        """
+        user_id = current_user_id.get()
+        if user_id is None:
+            return "No user in context."
+        _ensure_tables()
+        with get_engine().connect() as conn:
+            rows = conn.execute(
+                text(f"SELECT id, filename, pages, created_at FROM {DOCUMENTS_TABLE} "
+                     "WHERE user_id = :uid AND status = 'ready' ORDER BY created_at DESC LIMIT 20"),
+                {"uid": user_id},
+            ).all()
+        if not rows:
+            return "The user has not shared any documents."
+        return json.dumps([
+            {"id": r.id, "filename": r.filename, "pages": r.pages, "uploaded": r.created_at.isoformat()}
+            for r in rows
+        ])
+
+    def search_my_documents(self, query: str, limit: int = 5) -> str:
+        """Search the text of the user's shared documents (statements, transaction lists, holdings).
+
+        Args:
+            query (str): Keywords to look for, e.g. fund name, "SIP", "closing balance", a month.
+            limit (int): Maximum number of passages to return.
+
+        Returns:
+            str: JSON list of matching passages with document id, filename and page number.
+        """
+        user_id = current_user_id.get()
+        if user_id is None:
+            return "No user in context."
+        _ensure_tables()
+        limit = max(1, min(int(limit), 10))
+        with get_engine().connect() as conn:
+            rows = conn.execute(
+                text(f"""
+                    SELECT c.document_id, d.filename, c.page, c.content,
+                           ts_rank(c.tsv, websearch_to_tsquery('simple', :q)) AS rank
+                    FROM {CHUNKS_TABLE} c JOIN {DOCUMENTS_TABLE} d ON d.id = c.document_id
+                    WHERE c.user_id = :uid AND d.status = 'ready'
+                    AND (c.tsv @@ websearch_to_tsquery('simple', :q) OR c.content ILIKE '%' || :pattern || '%' ESCAPE '\\')
+                    ORDER BY rank DESC, d.created_at DESC, c.chunk_no
+                    LIMIT :limit
+                """),
+                {"uid": user_id, "q": query, "pattern": _escape_like(query), "limit": limit},
+            ).all()
+        if not rows:
+            return f"No passages matching '{query}' in the user's documents."
+        return json.dumps(list(_within_budget(
+            {"document_id": r.document_id, "filename": r.filename, "page": r.page, "text": r.content} for r in rows
+        )), ensure_ascii=False)
+
+
+def _within_budget(passages: Iterable[dict]) -> Iterator[dict]:
+    budget = DOCUMENT_SEARCH_MAX_CHARS
+    for passage in passages:
+        if budget <= 0:
+            break
+        passage["text"] = passage["text"][:budget]
+        budget -= len(passage["text"])
+        yield passage
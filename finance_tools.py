@@ -0,0 +1,207 @@
+import json
+from datetime import date
+from typing import Dict, List, Optional
+
+import numpy as np
+from agno.tools import Toolkit
+
+
+def _round(values, digits: int = 2) -> list:
+    return np.round(np.asarray(values, dtype=float), digits).tolist()
+
+
+def sip_future_values(monthly_amount: float, annual_returns: np.ndarray, years: float,
+                      annual_step_up: float = 0.0) -> np.ndarray:
+    """Corpus of a monthly SIP (invested at the start of each month) for each annual return."""
+    months = int(round(years * 12))
+    month_index = np.arange(months)
+    # Contribution of every month, stepped up once a year
+    contributions = monthly_amount * (1 + annual_step_up) ** (month_index // 12)
+    monthly_rates = (1 + np.asarray(annual_returns, dtype=float)) ** (1 / 12) - 1
+    # growth[s, m]: growth of month m's instalment under scenario s until the end
+    growth = (1 + monthly_rates[:, None]) ** (months - month_index)[None, :]
+    return growth @ contributions
+
+
+def xirr_rate(days: np.ndarray, amounts: np.ndarray) -> Optional[float]:
+    """Annualised internal rate of return of dated cashflows (Newton's method, grid-seeded)."""
+    years = (days - days.min()) / 365.0
+
+    def npv(rates: np.ndarray) -> np.ndarray:
+        return (amounts[None, :] / (1 + rates[:, None]) ** years[None, :]).sum(axis=1)
+
+    # Seed Newton from the grid point closest to a root, evaluated in one vectorized pass
+    grid = np.concatenate([np.linspace(-0.99, 1.0, 400), np.linspace(1.0, 10.0, 100)])
+    rate = float(grid[np.argmin(np.abs(npv(grid)))])
+    for _ in range(100):
+        discount = (1 + rate) ** years
+        value = float((amounts / discount).sum())
+        derivative = float((-years * amounts / (discount * (1 + rate))).sum())
+        if derivative == 0:
+            break
+        step = value / derivative
+        rate = max(rate - step, -0.9999)
+        if abs(step) < 1e-10:
+            return rate
+    return rate if abs(float(npv(np.array([rate]))[0])) < 1e-6 * np.abs(amounts).sum() else None
+
+
+class PortfolioTools(Toolkit):
+    """Deterministic personal-finance calculations (SIP, XIRR, CAGR, goals, allocation drift).
+
+    Each function evaluates every scenario it is given in one vectorized NumPy
+    pass, so the model can compare several return assumptions with one call
+    instead of doing arithmetic itself.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(
+            name="portfolio_tools",
+            tools=[self.sip_projection, self.xirr, self.cagr, self.goal_plan, self.allocation_drift],
+            **kwargs,
+        )
+
+    def sip_projection(self, monthly_amount: float, years: float, annual_return_pcts: List[float],
+                       annual_step_up_pct: float = 0.0) -> str:
+        """Use this function to project the future value of a monthly SIP under one or more return assumptions.
+
+        Args:
+            monthly_amount (float): Monthly SIP amount in rupees.
+            years (float): Investment horizon in years.
+            annual_return_pcts (List[float]): Expected annual returns in percent, e.g. [8, 10, 12].
+            annual_step_up_pct (float): Yearly increase of the SIP amount in percent (0 for a flat SIP).
+
+        Returns:
+            str: JSON with total invested and, per return assumption, the final corpus and gain, or an error message.
+        """
+        months = int(round(years * 12))
+        if months < 1:
+            return "Error: years must be at least one month (1/12)."
+        returns = np.asarray(annual_return_pcts, dtype=float) / 100
+        step_up = annual_step_up_pct / 100
+        invested = float((monthly_amount * (1 + step_up) ** (np.arange(months) // 12)).sum())
+        corpus = sip_future_values(monthly_amount, returns, years, step_up)
+        return json.dumps({
+            "total_invested": round(invested, 2),
+            "scenarios": [
+                {"annual_return_pct": r, "corpus": c, "gain": g}
+                for r, c, g in zip(_round(returns * 100), _round(corpus), _round(corpus - invested))
+            ],
+        })
+
+    def xirr(self, dates: List[str], amounts: List[float]) -> str:
+        """Use this function to calculate XIRR (annualised return) of irregular, dated cashflows.
+
+        Args:
+            dates (List[str]): Cashflow dates as YYYY-MM-DD, same order as amounts.
+            amounts (List[float]): Cashflows in rupees: investments negative, withdrawals/current value positive.
+
+        Returns:
+            str: JSON with the XIRR in percent, or an error message.
+        """
+        if len(dates) != len(amounts) or len(dates) < 2:
+            return "Error: dates and amounts must be lists of the same length (at least two cashflows)."
+        try:
+            days = np.array([date.fromisoformat(d).toordinal() for d in dates], dtype=float)
+        except ValueError as e:
+            return f"Error: dates must be YYYY-MM-DD ({e})"
+        flows = np.asarray(amounts, dtype=float)
+        if not (flows < 0).any() or not (flows > 0).any():
+            return "Error: cashflows need at least one negative (investment) and one positive (value) amount."
+        rate = xirr_rate(days, flows)
+        if rate is None:
+            return "Error: XIRR did not converge for these cashflows."
+        return json.dumps({
+            "xirr_pct": round(rate * 100, 2),
+            "total_invested": round(float(-flows[flows < 0].sum()), 2),
+            "total_value": round(float(flows[flows > 0].sum()), 2),
+        })
+
+    def cagr(self, start_values: List[float], end_values: List[float], years: List[float]) -> str:
+        """Use this function to calculate CAGR for one or more investments or indices.
+
+        Args:
+            start_values (List[float]): Starting values.
+            end_values (List[float]): Ending values, same order.
+            years (List[float]): Holding period in years for each (a single value applies to all).
+
+        Returns:
+            str: JSON list with CAGR in percent and absolute return in percent for each item, or an error message.
+        """
+        error = "Error: need matching lists of positive start values, end values and years."
+        start = np.asarray(start_values, dtype=float)
+        end = np.asarray(end_values, dtype=float)
+        period = np.asarray(years, dtype=float).ravel()
+        if start.ndim != 1 or start.shape != end.shape or period.size not in (1, start.size):
+            return error
+        period = np.broadcast_to(period, start.shape)
+        if (start <= 0).any() or (period <= 0).any():
+            return error
+        cagr = (end / start) ** (1 / period) - 1
+        absolute = end / start - 1
+        return json.dumps([
+            {"cagr_pct": c, "absolute_return_pct": a}
+            for c, a in zip(_round(cagr * 100), _round(absolute * 100))
+        ])
+
+    def goal_plan(self, goal_amount_today: float, years: float, expected_return_pcts: List[float],
+                  inflation_pct: float = 6.0, current_savings: float = 0.0) -> str:
+        """Use this function to plan a financial goal: inflation-adjusted target and the monthly SIP needed.
+
+        Args:
+            goal_amount_today (float): Cost of the goal in today's rupees.
+            years (float): Years until the goal.
+            expected_return_pcts (List[float]): Expected annual returns in percent, e.g. [8, 10, 12].
+            inflation_pct (float): Expected annual inflation in percent.
+            current_savings (float): Amount already saved towards this goal (grows at the same return).
+
+        Returns:
+            str: JSON with the future goal amount and, per return assumption, the required monthly SIP, or an error message.
+        """
+        if int(round(years * 12)) < 1:
+            return "Error: years must be at least one month (1/12)."
+        returns = np.asarray(expected_return_pcts, dtype=float) / 100
+        target = goal_amount_today * (1 + inflation_pct / 100) ** years
+        savings_value = current_savings * (1 + returns) ** years
+        # Corpus from a Rs 1/month SIP; the required SIP scales linearly with the shortfall
+        per_rupee = sip_future_values(1.0, returns, years)
+        shortfall = np.maximum(target - savings_value, 0)
+        monthly_sip = np.divide(shortfall, per_rupee, out=np.zeros_like(shortfall), where=per_rupee > 0)
+        return json.dumps({
+            "goal_amount_future": round(float(target), 2),
+            "scenarios": [
+                {"annual_return_pct": r, "current_savings_grow_to": s, "monthly_sip_needed": m}
+                for r, s, m in zip(_round(returns * 100), _round(savings_value), _round(monthly_sip))
+            ],
+        })
+
+    def allocation_drift(self, holdings: Dict[str, float], target_pcts: Dict[str, float],
+                         threshold_pct: float = 5.0) -> str:
+        """Use this function to compare a portfolio's current asset allocation with its target and suggest rebalancing.
+
+        Args:
+            holdings (Dict[str, float]): Current value in rupees per asset class, e.g. {"equity": 600000, "debt": 300000}.
+            target_pcts (Dict[str, float]): Target allocation in percent per asset class (should sum to 100).
+            threshold_pct (float): Drift (in percentage points) beyond which an asset class needs rebalancing.
+
+        Returns:
+            str: JSON with current vs target percent, drift, and the amount to buy (+) or sell (-) per asset class.
+        """
+        names = sorted(set(holdings) | set(target_pcts))
+        values = np.array([float(holdings.get(n, 0)) for n in names])
+        targets = np.array([float(target_pcts.get(n, 0)) for n in names])
+        total = values.sum()
+        if total <= 0 or targets.sum() <= 0:
+            return "Error: holdings and target percentages must be positive."
+        targets = targets / targets.sum() * 100
+        current = values / total * 100
+        drift = current - targets
+        trade = targets / 100 * total - values
+        return json.dumps({
+            "total_value": round(float(total), 2),
+            "needs_rebalancing": bool((np.abs(drift) > threshold_pct).any()),
+            "assets": [
+                {"asset": n, "current_pct": c, "target_pct": t, "drift_pct": d, "buy_sell_amount": a}
+                for n, c, t, d, a in zip(names, _round(current), _round(targets), _round(drift), _round(trade))
+            ],
+        })
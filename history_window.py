@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import threading
+from copy import deepcopy
+from typing import List, Optional, Tuple
+
+from agno.models.message import Message
+from cachetools import LRUCache
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# "tokens" packs the newest history into a token budget; "runs" replays the last num_history_runs runs
+HISTORY_MODE = os.getenv("HISTORY_MODE", "tokens")
+# Token budget for replayed history per turn (finance agents; small talk uses a quarter)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+# How many past runs are considered when packing the budget
+HISTORY_MAX_RUNS = int(os.getenv("HISTORY_MAX_RUNS", "10"))
+# Tokenizer of the chat model (gpt-4.1 family)
+HISTORY_ENCODING = os.getenv("HISTORY_ENCODING", "o200k_base")
+# Flat cost counted per image in a history message
+HISTORY_IMAGE_TOKENS = int(os.getenv("HISTORY_IMAGE_TOKENS", "765"))
+
+# Per-message framing tokens added by the chat format
+_MESSAGE_OVERHEAD = 4
+# Used when the tokenizer is unavailable (e.g. its BPE file cannot be downloaded)
+_CHARS_PER_TOKEN = 4
+
+_encoding = None
+_encoding_failed = False
+_encoding_lock = threading.Lock()
+# History is reloaded from storage every turn, so the same texts are counted again and again
+_counts: LRUCache = LRUCache(maxsize=8192)
+_counts_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        with _encoding_lock:
+            if _encoding is None and not _encoding_failed:
+                try:
+                    import tiktoken
+
+                    _encoding = tiktoken.get_encoding(HISTORY_ENCODING)
+                except Exception as e:
+                    _encoding_failed = True
+                    logger.warning(f"Tokenizer unavailable, estimating history tokens from characters: {e}")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Token count of `text` for the chat model (a character estimate without tiktoken)."""
+    if not text:
+        return 0
+    # Keyed by hash so the cache doesn't hold on to the texts themselves
+    key = (len(text), hash(text))
+    with _counts_lock:
+        cached = _counts.get(key)
+    if cached is not None:
+        return cached
+    encoding = _get_encoding()
+    if encoding is not None:
+        count = len(encoding.encode(text, disallowed_special=()))
+    else:
+        count = -(-len(text) // _CHARS_PER_TOKEN)
+    with _counts_lock:
+        _counts[key] = count
+    return count
+
+
+def message_tokens(message: Message) -> int:
+    """Approximate prompt tokens of one message, including tool calls and images."""
+    content = message.content
+    text = content if isinstance(content, str) else json.dumps(content, default=str) if content else ""
+    tokens = _MESSAGE_OVERHEAD + count_tokens(text)
+    if message.tool_calls:
+        tokens += count_tokens(json.dumps(message.tool_calls, default=str))
+    if message.images:
+        tokens += HISTORY_IMAGE_TOKENS * len(message.images)
+    return tokens
+
+
+def _units(messages: List[Message]) -> List[Tuple[List[int], bool]]:
+    """Split history into droppable units: (indices, is_tool_payload).
+
+    An assistant message with tool calls and the tool results that follow it
+    form one unit, since the API rejects a call without its results.
+    """
+    units, i = [], 0
+    while i < len(messages):
+        if messages[i].tool_calls:
+            j = i + 1
+            while j < len(messages) and messages[j].role == "tool":
+                j += 1
+            units.append((list(range(i, j)), True))
+            i = j
+        else:
+            units.append(([i], messages[i].role == "tool"))
+            i += 1
+    return units
+
+
+def select_history(messages: List[Message], budget: int) -> List[Message]:
+    """Pick the newest history messages that fit in `budget` tokens.
+
+    Tool calls and their results are dropped first, oldest first; if that is
+    not enough, the oldest remaining messages go. Returns copies tagged
+    from_history, like agno's own history.
+    """
+    tokens = [message_tokens(m) for m in messages]
+    total = sum(tokens)
+    keep = [True] * len(messages)
+    dropped = {"tool": 0, "message": 0}
+    units = _units(messages)
+    for tool_pass in (True, False):
+        for indices, is_tool in units:
+            if total <= budget:
+                break
+            if (tool_pass and not is_tool) or not keep[indices[0]]:
+                continue
+            for i in indices:
+                keep[i] = False
+                total -= tokens[i]
+            dropped["tool" if is_tool else "message"] += len(indices)
+    selected = [i for i in range(len(messages)) if keep[i]]
+    # Start on a user message so the model never sees an answer without its question
+    while selected and messages[selected[0]].role != "user":
+        total -= tokens[selected.pop(0)]
+        dropped["message"] += 1
+    for kind, count in dropped.items():
+        if count:
+            metrics.inc("history_messages_dropped_total", count, kind=kind)
+    metrics.inc("history_tokens_total", total)
+    history = []
+    for i in selected:
+        copy = deepcopy(messages[i])
+        copy.from_history = True
+        history.append(copy)
+    return history
+
+
+def history_settings(num_history_runs: int, token_budget: Optional[int] = None) -> dict:
+    """Agent keyword arguments for chat history under HISTORY_MODE.
+
+    In "tokens" mode agno's own run-count history is switched off and
+    StablePrefixAgent packs up to HISTORY_MAX_RUNS runs into the budget.
+    """
+    if HISTORY_MODE == "tokens":
+        return {
+            "add_history_to_messages": False,
+            "history_token_budget": token_budget or HISTORY_TOKEN_BUDGET,
+            "num_history_runs": HISTORY_MAX_RUNS,
+        }
+    return {"add_history_to_messages": True, "num_history_runs": num_history_runs}
@@ -0,0 +1,116 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Coroutine, List, Optional, Set
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# How long shutdown waits for in-flight turns before giving up on them.
+# Keep it below the platform's SIGTERM-to-SIGKILL grace period.
+SHUTDOWN_DRAIN_SECONDS = float(os.getenv("SHUTDOWN_DRAIN_SECONDS", "25"))
+
+
+class InFlightTracker:
+    """Track the turns this process is working on, so shutdown can wait for them.
+
+    Turns are asyncio tasks: WhatsApp jobs are started with spawn(), Telegram
+    handlers register themselves with track(). Once draining, channels should
+    refuse new work (webhooks answer 503 so the platform redelivers elsewhere)
+    while drain() waits for the tracked turns, including their memory,
+    summary and session writes, up to a deadline.
+    """
+
+    def __init__(self):
+        self._tasks: Set[asyncio.Task] = set()
+        self.draining = False
+
+    def _update_gauge(self) -> None:
+        metrics.set("in_flight_turns", len(self._tasks))
+
+    def _discard(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        self._update_gauge()
+
+    def spawn(self, coro: Coroutine, name: Optional[str] = None) -> asyncio.Task:
+        """Start a background turn and keep a reference to it until it finishes."""
+        task = asyncio.create_task(coro, name=name)
+        self._tasks.add(task)
+        self._update_gauge()
+        task.add_done_callback(self._discard)
+        return task
+
+    @asynccontextmanager
+    async def track(self):
+        """Count the current task as in flight for the duration of the block."""
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        self._update_gauge()
+        try:
+            yield
+        finally:
+            self._discard(task)
+
+    def begin_drain(self) -> None:
+        """Stop accepting new turns; safe to call more than once."""
+        if not self.draining:
+            self.draining = True
+            logger.info("Draining: no longer accepting new turns", extra={"fields": {"in_flight": len(self._tasks)}})
+
+    async def drain(self, timeout: float = SHUTDOWN_DRAIN_SECONDS) -> int:
+        """Wait for in-flight turns to finish; returns how many were still running at the deadline."""
+        self.begin_drain()
+        current = asyncio.current_task()
+        pending = {task for task in self._tasks if task is not current and not task.done()}
+        if not pending:
+            return 0
+        started = time.perf_counter()
+        _, unfinished = await asyncio.wait(pending, timeout=timeout)
+        metrics.observe("shutdown_drain_seconds", time.perf_counter() - started)
+        fields = {"drained": len(pending) - len(unfinished), "unfinished": len(unfinished)}
+        if unfinished:
+            metrics.inc("shutdown_unfinished_turns_total", len(unfinished))
+            logger.warning("Drain deadline reached with turns still running", extra={"fields": fields})
+        else:
+            logger.info("In-flight turns drained", extra={"fields": fields})
+        return len(unfinished)
+
+
+in_flight = InFlightTracker()
+
+
+def tracked(handler: Callable) -> Callable:
+    """Decorator counting every call of an async handler as an in-flight turn."""
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        async with in_flight.track():
+            return await handler(*args, **kwargs)
+    return wrapper
+
+
+_cleanups: List[Callable[[], None]] = []
+_released = False
+
+
+def on_release(cleanup: Callable[[], None]) -> None:
+    """Register a process-level cleanup to run once, after draining (last registered runs first)."""
+    _cleanups.append(cleanup)
+
+
+def release_resources() -> None:
+    """Log the final metrics and run the registered cleanups; only the first call does anything."""
+    global _released
+    if _released:
+        return
+    _released = True
+    # Scrapes stop with the process; the log keeps the last values
+    logger.info("Final metrics", extra={"fields": {"metrics": metrics.snapshot()}})
+    for cleanup in reversed(_cleanups):
+        try:
+            cleanup()
+        except Exception as e:
+            logger.warning(f"Cleanup {getattr(cleanup, '__name__', cleanup)} failed: {e}")
@@ -0,0 +1,189 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from typing import Any, Optional
+
+# Logging configuration
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+# Fraction of webhook payloads whose (redacted) body is logged; 0 disables payload logging
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0"))
+
+# Correlation ID that follows one inbound message through to its reply.
+# asyncio tasks and asyncio.to_thread copy the current context, so setting it
+# once per message is enough for every log line produced on its behalf.
+correlation_id: contextvars.ContextVar[str] = contextvars.ContextVar("correlation_id", default="-")
+
+# Fields whose values are user content and must never reach the logs verbatim
+REDACTED_FIELDS = {"text", "body", "caption", "message", "user_message", "content"}
+# 10-15 digits, optionally separated by single spaces/hyphens (dates and times stay intact)
+PHONE_NUMBER_RE = re.compile(r"(?<![\dA-Za-z.])\+?\d(?:[\s-]?\d){9,14}(?![\w:]|\.\d)")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def new_correlation_id(seed: Optional[str] = None) -> str:
+    """Set and return the correlation ID for the current message."""
+    value = seed or uuid.uuid4().hex[:12]
+    correlation_id.set(value)
+    return value
+
+
+def mask_phone_numbers(text: str) -> str:
+    """Replace phone numbers with a masked form that keeps the last 4 digits."""
+    def _mask(match):
+        digits = re.sub(r"\D", "", match.group(0))
+        return f"***{digits[-4:]}"
+    return PHONE_NUMBER_RE.sub(_mask, text)
+
+
+def redact(value: Any, key: Optional[str] = None) -> Any:
+    """Recursively redact message text and phone numbers from a log payload."""
+    if isinstance(value, dict):
+        return {k: redact(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v, key) for v in value]
+    if isinstance(value, str):
+        if key in REDACTED_FIELDS:
+            return f"<redacted len={len(value)}>"
+        return mask_phone_numbers(value)
+    return value
+
+
+def should_sample_payload() -> bool:
+    """Decide whether this payload body gets logged."""
+    return LOG_PAYLOAD_SAMPLE_RATE > 0 and random.random() < LOG_PAYLOAD_SAMPLE_RATE
+
+
+def log_payload(logger: logging.Logger, label: str, payload: Any) -> None:
+    """Log a redacted copy of a payload body, subject to sampling.
+
+    Unsampled payloads cost a single random() call; sampled ones are redacted
+    and serialized by the formatter on the listener thread.
+    """
+    if should_sample_payload():
+        logger.info(label, extra={"fields": {"payload": payload}})
+
+
+class CorrelationFilter(logging.Filter):
+    """Stamp each record with the correlation ID of the producing context."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps the traceback apart from the message.
+
+    The stock prepare() formats the record, which appends the traceback to
+    msg and drops exc_info. Here msg is only merged with its args and the
+    traceback travels as exc_text, so formatters can still render it as its
+    own field.
+    """
+
+    _exc_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+        # Tracebacks hold frames (and their locals) alive; the text is all formatters need
+        record.exc_info = None
+        return record
+
+
+class StructuredFormatter(logging.Formatter):
+    """Render records as one JSON object per line with phone numbers masked."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "correlation_id": getattr(record, "correlation_id", "-"),
+            "msg": mask_phone_numbers(record.getMessage()),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(redact(fields))
+        if record.exc_info:
+            entry["exc"] = mask_phone_numbers(self.formatException(record.exc_info))
+        elif record.exc_text:
+            entry["exc"] = mask_phone_numbers(record.exc_text)
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable variant of StructuredFormatter for local development."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, "correlation_id"):
+            record.correlation_id = "-"
+        record.msg = mask_phone_numbers(record.getMessage())
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            record.exc_text = mask_phone_numbers(record.exc_text)
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + json.dumps(redact(fields), ensure_ascii=False, default=str)
+        return line
+
+
+def configure_logging() -> None:
+    """Route all logging through a queue so callers never block on I/O.
+
+    Records are enqueued by a QueueHandler on the root logger and written by a
+    background QueueListener thread. Safe to call more than once.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(StructuredFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(CorrelationFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    # Third-party clients are chatty at INFO (one line per HTTP request)
+    for noisy in ("httpx", "httpcore", "urllib3"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
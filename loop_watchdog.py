@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+from typing import Optional
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Watchdog configuration (milliseconds in the environment, seconds internally)
+LOOP_WATCHDOG_ENABLED = os.getenv("LOOP_WATCHDOG_ENABLED", "1") != "0"
+LOOP_WATCHDOG_INTERVAL = int(os.getenv("LOOP_WATCHDOG_INTERVAL_MS", "100")) / 1000
+LOOP_LAG_THRESHOLD = int(os.getenv("LOOP_LAG_THRESHOLD_MS", "500")) / 1000
+
+
+class LoopWatchdog:
+    """Measure event-loop lag and report callbacks that hold the loop too long.
+
+    A ticker coroutine sleeps for a fixed interval and records how late it
+    wakes up (the loop lag). A separate monitor thread watches the ticker's
+    heartbeat; when the loop has not ticked for longer than the threshold it
+    samples the loop thread's current stack, so the blocking call shows up in
+    the logs while it is still running.
+    """
+
+    def __init__(self, name: str = "main", interval: float = LOOP_WATCHDOG_INTERVAL,
+                 threshold: float = LOOP_LAG_THRESHOLD):
+        self.name = name
+        self.interval = interval
+        self.threshold = threshold
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._monitor_thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._users = 0
+
+    def start(self) -> None:
+        """Start watching the running event loop."""
+        self._users += 1
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._tick())
+        self._monitor_thread = threading.Thread(
+            target=self._monitor, name=f"loop-watchdog-{self.name}", daemon=True
+        )
+        self._monitor_thread.start()
+        logger.info("Loop watchdog started for %s (threshold %.0f ms)", self.name, self.threshold * 1000)
+
+    async def stop(self) -> None:
+        """Stop the ticker and the monitor thread once every user has stopped."""
+        self._users -= 1
+        if self._users > 0:
+            return
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _tick(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            metrics.observe("event_loop_lag_seconds", lag, loop=self.name)
+            metrics.set("event_loop_lag_last_seconds", lag, loop=self.name)
+
+    def _monitor(self) -> None:
+        reported = False
+        while not self._stopped.wait(self.interval):
+            stalled = time.monotonic() - self._heartbeat - self.interval
+            if stalled <= self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            # Report each stall once, with the stack of whatever is holding the loop
+            reported = True
+            metrics.inc("event_loop_blocked_total", loop=self.name)
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<no frame>"
+            logger.warning(
+                "Event loop %s blocked for %.0f ms; loop thread stack:\n%s",
+                self.name, stalled * 1000, stack,
+            )
+
+
+_watchdogs: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, LoopWatchdog]" = weakref.WeakKeyDictionary()
+
+
+def start_loop_watchdog(name: str = "main") -> Optional[LoopWatchdog]:
+    """Start a watchdog on the running loop unless disabled via LOOP_WATCHDOG_ENABLED=0.
+
+    Channels sharing one loop share one watchdog (named after the first
+    channel); each caller must call stop() on the returned instance.
+    """
+    if not LOOP_WATCHDOG_ENABLED:
+        return None
+    loop = asyncio.get_running_loop()
+    watchdog = _watchdogs.get(loop)
+    if watchdog is None:
+        watchdog = _watchdogs[loop] = LoopWatchdog(name=name)
+    watchdog.start()
+    return watchdog
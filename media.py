@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from agno.media import Image
+from cachetools import LRUCache
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Images are fitted inside these bounds; the model downsamples anything larger itself,
+# so extra pixels only cost upload time and vision tokens
+IMAGE_MAX_LONG_SIDE = int(os.getenv("IMAGE_MAX_LONG_SIDE", "2048"))
+IMAGE_MAX_SHORT_SIDE = int(os.getenv("IMAGE_MAX_SHORT_SIDE", "768"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# Refuse to decode anything bigger than this (decompression bombs)
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(50_000_000)))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+# Processed images kept by content hash, so forwarded duplicates are processed once
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", "256"))
+
+
+def _target_size(width: int, height: int) -> tuple:
+    scale = min(
+        1.0,
+        IMAGE_MAX_LONG_SIDE / max(width, height),
+        IMAGE_MAX_SHORT_SIDE / min(width, height),
+    )
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def preprocess_image(raw: bytes) -> bytes:
+    """Decode, downscale, drop metadata and re-encode an image as JPEG.
+
+    Runs in a worker process. EXIF orientation is applied before the
+    metadata is dropped, and transparency is flattened onto white.
+    """
+    from PIL import Image as PILImage, ImageOps
+
+    PILImage.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    with PILImage.open(io.BytesIO(raw)) as img:
+        # Let the JPEG decoder skip detail we are about to throw away (stored orientation)
+        img.draft("RGB", _target_size(*img.size))
+        img = ImageOps.exif_transpose(img)
+        size = _target_size(*img.size)
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            background = PILImage.new("RGB", img.size, (255, 255, 255))
+            background.paste(img.convert("RGBA"), mask=img.convert("RGBA").getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        if img.size != size:
+            img = img.resize(size, PILImage.LANCZOS)
+        out = io.BytesIO()
+        # A fresh save without exif/icc_profile/info carries no metadata
+        img.save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+        return out.getvalue()
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_cache: LRUCache = LRUCache(maxsize=IMAGE_CACHE_SIZE)
+_in_flight: Dict[str, asyncio.Future] = {}
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawn (not fork) so workers never inherit the parent's threads, sockets or DB pools
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_media_pool() -> None:
+    """Stop the image worker processes."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def prepare_image(raw: bytes) -> Image:
+    """Return an agno Image for the model from raw uploaded bytes.
+
+    Identical uploads (by SHA-256) share one result, including uploads that
+    arrive while the first copy is still being processed. Anything Pillow
+    cannot decode is passed through unchanged.
+    """
+    digest = hashlib.sha256(raw).hexdigest()
+    processed = _cache.get(digest)
+    if processed is not None:
+        metrics.inc("image_cache_hits_total")
+        return Image(content=processed)
+    future = _in_flight.get(digest)
+    if future is not None:
+        metrics.inc("image_cache_hits_total")
+        return Image(content=await asyncio.shield(future))
+
+    loop = asyncio.get_running_loop()
+    future = _in_flight[digest] = loop.create_future()
+    started = time.perf_counter()
+    try:
+        processed = await loop.run_in_executor(_get_pool(), preprocess_image, raw)
+        _cache[digest] = processed
+    except Exception as e:
+        logger.warning(f"Image preprocessing failed, sending original: {e}")
+        metrics.inc("image_preprocess_failures_total")
+        processed = raw
+    finally:
+        _in_flight.pop(digest, None)
+        if not future.done():
+            # Also wakes waiters when this task was cancelled mid-way
+            future.set_result(processed if processed is not None else raw)
+    metrics.observe("image_preprocess_seconds", time.perf_counter() - started)
+    metrics.inc("image_bytes_in_total", len(raw))
+    metrics.inc("image_bytes_out_total", len(processed))
+    logger.info("Image preprocessed", extra={"fields": {
+        "bytes_in": len(raw), "bytes_out": len(processed), "sha256": digest[:12],
+    }})
+    return Image(content=processed)
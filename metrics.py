@@ -0,0 +1,99 @@
+import threading
+from typing import Dict, List, Tuple
+
+# Default latency buckets (seconds) used by every histogram
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metrics:
+    """Thread-safe in-process counters, gauges and histograms.
+
+    Rendered in the Prometheus text format by the /metrics endpoint so the
+    same numbers can be scraped in production and read in logs at shutdown.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        self._gauges: Dict[str, Dict[tuple, float]] = {}
+        self._histograms: Dict[str, Dict[tuple, List[float]]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        """Increment a counter."""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """Set a gauge to an absolute value."""
+        key = _label_key(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = float(value)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Record one observation in a histogram."""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            # Layout: one slot per bucket, then count, then sum
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0.0] * (len(DEFAULT_BUCKETS) + 2)
+            for i, bound in enumerate(DEFAULT_BUCKETS):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += 1
+            state[-1] += value
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Return a flat copy of counters and gauges, plus histogram counts and sums."""
+        out: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for name, series in list(self._counters.items()) + list(self._gauges.items()):
+                for key, value in series.items():
+                    out.setdefault(name, {})[_format_labels(key)] = value
+            for name, series in self._histograms.items():
+                for key, state in series.items():
+                    out.setdefault(f"{name}_count", {})[_format_labels(key)] = state[-2]
+                    out.setdefault(f"{name}_sum", {})[_format_labels(key)] = state[-1]
+        return out
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, series in self._counters.items():
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in self._gauges.items():
+                lines.append(f"# TYPE {name} gauge")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in self._histograms.items():
+                lines.append(f"# TYPE {name} histogram")
+                for key, state in series.items():
+                    for i, bound in enumerate(DEFAULT_BUCKETS):
+                        labels = _format_labels(key, 'le="%s"' % bound)
+                        lines.append(f"{name}_bucket{labels} {state[i]}")
+                    labels = _format_labels(key, 'le="+Inf"')
+                    lines.append(f"{name}_bucket{labels} {state[-2]}")
+                    lines.append(f"{name}_count{_format_labels(key)} {state[-2]}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {state[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry shared by all channels
+metrics = Metrics()
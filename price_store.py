@@ -0,0 +1,267 @@
+import json
+import logging
+import os
+import re
+import threading
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from agno.tools import Toolkit
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Local OHLCV history, one directory per symbol with one file per column
+PRICE_STORE_DIR = os.getenv("PRICE_STORE_DIR", "data/prices")
+# Symbols kept in the store by `--refresh-prices` when none are given
+DEFAULT_PRICE_SYMBOLS = os.getenv(
+    "PRICE_STORE_SYMBOLS",
+    "^NSEI,^BSESN,^NSEBANK,RELIANCE.NS,TCS.NS,HDFCBANK.NS,ICICIBANK.NS,INFY.NS,ITC.NS,SBIN.NS,"
+    "BHARTIARTL.NS,LT.NS,HINDUNILVR.NS,KOTAKBANK.NS,AXISBANK.NS,BAJFINANCE.NS,MARUTI.NS,GOLDBEES.NS",
+).split(",")
+# How far back the first fill of a symbol goes
+PRICE_HISTORY_START = os.getenv("PRICE_HISTORY_START", "2000-01-01")
+
+# Column name -> on-disk dtype (little-endian); dates are days since 1970-01-01
+COLUMNS = {
+    "date": np.dtype("<i4"),
+    "open": np.dtype("<f8"),
+    "high": np.dtype("<f8"),
+    "low": np.dtype("<f8"),
+    "close": np.dtype("<f8"),
+    "adj_close": np.dtype("<f8"),
+    "volume": np.dtype("<f8"),
+}
+_YF_COLUMNS = {"open": "Open", "high": "High", "low": "Low", "close": "Close", "adj_close": "Adj Close", "volume": "Volume"}
+_EPOCH = date(1970, 1, 1)
+
+
+def to_day(value: date) -> int:
+    return (value - _EPOCH).days
+
+
+def from_day(day: int) -> date:
+    return _EPOCH + timedelta(days=int(day))
+
+
+def _safe_name(symbol: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]", "_", symbol.upper())
+
+
+class PriceStore:
+    """Append-only, memory-mapped columnar store of daily OHLCV bars.
+
+    Each symbol is a directory holding one raw little-endian file per column
+    plus meta.json with the committed row count. Readers memory-map only the
+    columns they need and slice by date with a binary search, so a query
+    touches a few pages instead of loading or downloading the history.
+    Appends write the columns first and the row count last, so a reader
+    never sees a half-written row and a crashed append is simply truncated
+    away by the next one.
+    """
+
+    def __init__(self, root: str = PRICE_STORE_DIR):
+        self.root = root
+        self._write_lock = threading.Lock()
+
+    def _path(self, symbol: str, name: str) -> str:
+        return os.path.join(self.root, _safe_name(symbol), name)
+
+    def rows(self, symbol: str) -> int:
+        """Committed row count for a symbol (0 when it is not in the store)."""
+        try:
+            with open(self._path(symbol, "meta.json")) as f:
+                return int(json.load(f)["rows"])
+        except FileNotFoundError:
+            return 0
+
+    def symbols(self) -> List[str]:
+        """Symbols currently in the store."""
+        if not os.path.isdir(self.root):
+            return []
+        result = []
+        for name in sorted(os.listdir(self.root)):
+            try:
+                with open(os.path.join(self.root, name, "meta.json")) as f:
+                    result.append(json.load(f)["symbol"])
+            except (FileNotFoundError, KeyError, ValueError):
+                continue
+        return result
+
+    def column(self, symbol: str, name: str) -> np.ndarray:
+        """Read-only memory map of one column (empty when the symbol is unknown)."""
+        rows = self.rows(symbol)
+        if rows == 0:
+            return np.empty(0, dtype=COLUMNS[name])
+        return np.memmap(self._path(symbol, f"{name}.bin"), dtype=COLUMNS[name], mode="r", shape=(rows,))
+
+    def last_date(self, symbol: str) -> Optional[date]:
+        dates = self.column(symbol, "date")
+        return from_day(dates[-1]) if len(dates) else None
+
+    def read(self, symbol: str, start: Optional[date] = None, end: Optional[date] = None,
+             columns: Iterable[str] = ("date", "close")) -> Dict[str, np.ndarray]:
+        """Return the requested columns for bars with start <= date <= end."""
+        dates = self.column(symbol, "date")
+        lo = int(np.searchsorted(dates, to_day(start), side="left")) if start else 0
+        hi = int(np.searchsorted(dates, to_day(end), side="right")) if end else len(dates)
+        metrics.inc("price_store_reads_total")
+        return {name: np.array(self.column(symbol, name)[lo:hi]) for name in columns}
+
+    def append(self, symbol: str, bars: Dict[str, np.ndarray]) -> int:
+        """Append bars newer than the last stored date; returns the number of rows added."""
+        if len(bars["date"]) == 0:
+            return 0
+        with self._write_lock:
+            directory = os.path.join(self.root, _safe_name(symbol))
+            os.makedirs(directory, exist_ok=True)
+            rows = self.rows(symbol)
+            order = np.argsort(bars["date"], kind="stable")
+            dates = np.asarray(bars["date"], dtype=COLUMNS["date"])[order]
+            # Only dates after the last stored bar, and no duplicates within the batch
+            keep = np.concatenate([[True], np.diff(dates) > 0])
+            if rows:
+                keep &= dates > self.column(symbol, "date")[-1]
+            if not keep.any():
+                return 0
+            for name, dtype in COLUMNS.items():
+                values = np.asarray(bars[name], dtype=dtype)[order][keep]
+                with open(os.path.join(directory, f"{name}.bin"), "ab") as f:
+                    # Cut off anything a crashed append wrote past the committed rows
+                    f.truncate(rows * dtype.itemsize)
+                    f.write(values.tobytes())
+            added = int(keep.sum())
+            meta_path = os.path.join(directory, "meta.json")
+            with open(meta_path + ".tmp", "w") as f:
+                json.dump({"symbol": symbol.upper(), "rows": rows + added}, f)
+            os.replace(meta_path + ".tmp", meta_path)
+            return added
+
+
+price_store = PriceStore()
+
+
+def refresh_prices(symbols: Optional[List[str]] = None, store: PriceStore = price_store) -> Dict[str, int]:
+    """Download missing daily bars for `symbols` in one bulk request and append them.
+
+    New symbols are filled from PRICE_HISTORY_START; existing ones only from
+    the day after their last stored bar, so a daily run appends a day.
+    """
+    import pandas as pd
+    import yfinance as yf
+
+    symbols = [s.strip().upper() for s in (symbols or DEFAULT_PRICE_SYMBOLS) if s.strip()]
+    first_start = date.fromisoformat(PRICE_HISTORY_START)
+    starts = {s: (store.last_date(s) + timedelta(days=1)) if store.rows(s) else first_start for s in symbols}
+    pending = [s for s in symbols if starts[s] <= date.today()]
+    if not pending:
+        return {s: 0 for s in symbols}
+    frame = yf.download(
+        pending, start=min(starts[s] for s in pending).isoformat(), group_by="ticker",
+        auto_adjust=False, actions=False, progress=False, threads=True,
+    )
+    added: Dict[str, int] = {s: 0 for s in symbols}
+    for symbol in pending:
+        try:
+            data = frame[symbol] if isinstance(frame.columns, pd.MultiIndex) else frame
+        except KeyError:
+            logger.warning(f"No price data returned for {symbol}")
+            continue
+        data = data.dropna(subset=["Close"])
+        data = data[data.index.date >= starts[symbol]]
+        if data.empty:
+            continue
+        bars = {"date": np.array([to_day(d) for d in data.index.date], dtype=np.int32)}
+        for name, source in _YF_COLUMNS.items():
+            bars[name] = data[source].to_numpy(dtype=np.float64) if source in data else np.full(len(data), np.nan)
+        added[symbol] = store.append(symbol, bars)
+    metrics.inc("price_store_rows_appended_total", sum(added.values()))
+    logger.info("Price store refreshed", extra={"fields": {"rows_added": added}})
+    return added
+
+
+def _window(store: PriceStore, symbol: str, years: Optional[float], start_date: Optional[str],
+            end_date: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+    end = date.fromisoformat(end_date) if end_date else None
+    if start_date:
+        start = date.fromisoformat(start_date)
+    elif years:
+        start = (end or store.last_date(symbol) or date.today()) - timedelta(days=round(years * 365.25))
+    else:
+        start = None
+    data = store.read(symbol, start, end, columns=("date", "adj_close", "close"))
+    # Adjusted close accounts for splits/dividends where Yahoo provides it
+    prices = np.where(np.isnan(data["adj_close"]), data["close"], data["adj_close"])
+    return data["date"], prices
+
+
+def summarize(dates: np.ndarray, prices: np.ndarray) -> Dict[str, object]:
+    """Return, CAGR, volatility and drawdown statistics of a daily price series."""
+    years = (dates[-1] - dates[0]) / 365.25
+    daily = np.diff(np.log(prices))
+    peaks = np.maximum.accumulate(prices)
+    drawdowns = prices / peaks - 1
+    trough = int(np.argmin(drawdowns))
+    return {
+        "from": from_day(dates[0]).isoformat(),
+        "to": from_day(dates[-1]).isoformat(),
+        "start_price": round(float(prices[0]), 2),
+        "end_price": round(float(prices[-1]), 2),
+        "total_return_pct": round(float(prices[-1] / prices[0] - 1) * 100, 2),
+        "cagr_pct": round(float((prices[-1] / prices[0]) ** (1 / years) - 1) * 100, 2) if years >= 1 else None,
+        "annualised_volatility_pct": round(float(daily.std() * np.sqrt(252)) * 100, 2) if len(daily) > 1 else None,
+        "max_drawdown_pct": round(float(drawdowns[trough]) * 100, 2),
+        "max_drawdown_date": from_day(dates[trough]).isoformat(),
+        "period_high": round(float(prices.max()), 2),
+        "period_low": round(float(prices.min()), 2),
+    }
+
+
+class PriceHistoryTools(Toolkit):
+    """Historical performance from the local price store; no network calls."""
+
+    def __init__(self, store: PriceStore = price_store, **kwargs):
+        self.store = store
+        super().__init__(
+            name="price_history_tools", tools=[self.get_price_performance, self.compare_price_performance], **kwargs
+        )
+
+    def get_price_performance(self, symbol: str, years: Optional[float] = None, start_date: Optional[str] = None,
+                              end_date: Optional[str] = None) -> str:
+        """Use this function to get historical performance of a stock or index (returns, CAGR, volatility, drawdown).
+
+        Args:
+            symbol (str): Yahoo symbol, e.g. "^NSEI" (Nifty 50), "^BSESN" (Sensex), "HDFCBANK.NS".
+            years (float): Look-back period in years, e.g. 5. Ignored when start_date is given.
+            start_date (str): Optional start date YYYY-MM-DD.
+            end_date (str): Optional end date YYYY-MM-DD (defaults to the latest stored day).
+
+        Returns:
+            str: JSON performance summary, or a message if the symbol is not in the local store.
+        """
+        dates, prices = _window(self.store, symbol, years, start_date, end_date)
+        if len(prices) < 2:
+            return (f"No local price history for {symbol} in that period. "
+                    f"Stored symbols: {', '.join(self.store.symbols()) or 'none'}.")
+        return json.dumps({"symbol": symbol.upper(), **summarize(dates, prices)})
+
+    def compare_price_performance(self, symbols: List[str], years: float = 5.0) -> str:
+        """Use this function to compare historical performance of several stocks or indices over the same period.
+
+        Args:
+            symbols (List[str]): Yahoo symbols, e.g. ["HDFCBANK.NS", "ICICIBANK.NS", "^NSEI"].
+            years (float): Look-back period in years.
+
+        Returns:
+            str: JSON list of performance summaries (symbols missing from the store are reported as such).
+        """
+        results = []
+        for symbol in symbols:
+            dates, prices = _window(self.store, symbol, years, None, None)
+            if len(prices) < 2:
+                results.append({"symbol": symbol.upper(), "error": "not in local price store"})
+            else:
+                results.append({"symbol": symbol.upper(), **summarize(dates, prices)})
+        return json.dumps(results)
@@ -0,0 +1,140 @@
+import copy
+import os
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import List, Optional
+from zoneinfo import ZoneInfo
+
+from agno.agent import Agent
+from agno.models.message import Message
+from agno.run.messages import RunMessages
+from agno.storage.session.agent import AgentSession
+
+from context_cache import context_cache, current_snapshot, render_memories, render_summary
+from history_window import select_history
+
+# "stable" keeps the system prompt byte-identical and sends per-turn context last;
+# "legacy" sends exactly what agno builds (system prompt, history, user message)
+PROMPT_ASSEMBLY = os.getenv("PROMPT_ASSEMBLY", "stable")
+# Timezone used for the current date/time given to the model
+AGENT_TIMEZONE = os.getenv("AGENT_TIMEZONE", "Asia/Kolkata")
+
+
+def render_turn_context(agent: Agent, session_id: str, user_id: Optional[str]) -> str:
+    """Render the volatile per-turn context: date/time, user memories and session summary.
+
+    Honours the agent's add_datetime_to_instructions, add_memory_references and
+    add_session_summary_references flags. Memories and summary come pre-rendered
+    from the turn's context snapshot when there is one.
+    """
+    parts: List[str] = []
+    if agent.add_datetime_to_instructions:
+        now = datetime.now(ZoneInfo(AGENT_TIMEZONE))
+        parts.append(f"Current date and time: {now.strftime('%A, %d %B %Y, %I:%M %p %Z')}")
+    if agent.memory is not None and user_id is not None:
+        snapshot = current_snapshot.get()
+        if agent.add_memory_references:
+            parts.append(
+                snapshot.memories_text if snapshot is not None
+                else render_memories(agent.memory.get_user_memories(user_id=user_id))
+            )
+        if agent.add_session_summary_references:
+            parts.append(
+                snapshot.summary_text if snapshot is not None
+                else render_summary(agent.memory.get_session_summary(session_id=session_id, user_id=user_id))
+            )
+    return "\n\n".join(part for part in parts if part)
+
+
+@dataclass(init=False)
+class StablePrefixAgent(Agent):
+    """Agent whose prompt prefix stays byte-identical across requests.
+
+    Providers cache the longest previously seen prompt prefix, so anything that
+    changes per request has to come after the static part (system prompt and
+    tool schemas) and the history. In "stable" mode the per-turn context is
+    sent as a system message after the user's message; system messages are
+    skipped when history is replayed, so it never piles up in later turns.
+
+    With history_token_budget set, history is the newest messages of the last
+    num_history_runs runs that fit in that many tokens (see history_window),
+    instead of agno's fixed run count.
+
+    Sessions this process wrote last are served from a context snapshot (see
+    context_cache) instead of being loaded and re-assembled from Postgres.
+    """
+
+    history_token_budget: Optional[int] = None
+
+    def __init__(self, *args, history_token_budget: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.history_token_budget = history_token_budget
+
+    def read_from_storage(self, session_id: str) -> Optional[AgentSession]:
+        snapshot = context_cache.lookup(self, session_id)
+        current_snapshot.set(snapshot)
+        if snapshot is None:
+            return super().read_from_storage(session_id=session_id)
+        # Restore what loading the row would have set, without parsing its runs and summaries
+        # again. Session state, metrics and extra_data are copied: the run changes them in place.
+        session = snapshot.session
+        self.load_agent_session(replace(
+            session, memory=None, session_data=copy.deepcopy(session.session_data),
+            extra_data=copy.deepcopy(session.extra_data),
+        ))
+        self.agent_session = session
+        if self.memory.runs is None:
+            self.memory.runs = {}
+        self.memory.runs[session_id] = list(snapshot.runs)
+        # Memory is shared by every user of this agent: only touch this session's entries
+        user_id = snapshot.user_id or "default"
+        if self.memory.summaries is None:
+            self.memory.summaries = {}
+        if snapshot.summary is not None:
+            self.memory.summaries.setdefault(user_id, {})[session_id] = snapshot.summary
+        else:
+            self.memory.summaries.get(user_id, {}).pop(session_id, None)
+        return self.agent_session
+
+    def write_to_storage(self, session_id: str, user_id: Optional[str] = None) -> Optional[AgentSession]:
+        session = super().write_to_storage(session_id=session_id, user_id=user_id)
+        if self.storage is not None:
+            snapshot = context_cache.store(self, session_id, session, user_id)
+            if snapshot is not None and self.history_token_budget is not None:
+                # The next turn most likely needs the same history window
+                self._history(session_id, snapshot)
+        return session
+
+    def _history(self, session_id: str, snapshot=None) -> List[Message]:
+        key = (self.num_history_runs, self.history_token_budget)
+        if snapshot is not None and key in snapshot.history:
+            history = snapshot.history[key]
+        else:
+            history = select_history(
+                self.memory.get_messages_from_last_n_runs(
+                    session_id=session_id, last_n=self.num_history_runs, skip_role=self.system_message_role
+                ),
+                self.history_token_budget,
+            )
+            if snapshot is not None:
+                snapshot.history[key] = history
+        # Shallow copies, so a turn never changes the messages another turn reuses
+        return [message.model_copy() for message in history]
+
+    def get_run_messages(self, *, session_id: str, user_id: Optional[str] = None, **kwargs) -> RunMessages:
+        run_messages = super().get_run_messages(session_id=session_id, user_id=user_id, **kwargs)
+        if self.history_token_budget is not None and self.memory is not None:
+            history = self._history(session_id, current_snapshot.get())
+            # Same place agno puts history: right before the user's message
+            position = next(
+                (i for i, m in enumerate(run_messages.messages) if m is run_messages.user_message),
+                len(run_messages.messages),
+            )
+            run_messages.messages[position:position] = history
+        if PROMPT_ASSEMBLY == "stable":
+            context = render_turn_context(self, session_id, user_id)
+            if context:
+                run_messages.messages.append(
+                    Message(role=self.system_message_role, content=f"<turn_context>\n{context}\n</turn_context>")
+                )
+        return run_messages
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from cachetools import TTLCache
+from sqlalchemy import text
+
+from db import DB_SCHEMA, ensure_table, get_engine
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Rate limit configuration
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # "memory" or "postgres"
+RATE_LIMIT_USER_PER_MINUTE = float(os.getenv("RATE_LIMIT_USER_PER_MINUTE", "10"))
+RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "5"))
+RATE_LIMIT_GLOBAL_PER_SECOND = float(os.getenv("RATE_LIMIT_GLOBAL_PER_SECOND", "5"))
+RATE_LIMIT_GLOBAL_BURST = float(os.getenv("RATE_LIMIT_GLOBAL_BURST", "20"))
+RATE_LIMIT_TABLE = os.getenv("RATE_LIMIT_TABLE", "tara_rate_limits")
+
+GLOBAL_KEY = "__global__"
+
+THROTTLE_MESSAGES = {
+    "user": (
+        "Arre, thoda saans le lo! 😅 Aap bahut jaldi-jaldi messages bhej rahe ho. "
+        "Ek minute ruk ke phir se poochho, main yahin hoon."
+    ),
+    "global": (
+        "Abhi bahut saare log mujhse baat kar rahe hain 🙈 "
+        "Ek-do minute mein phir se try karo please, main pakka reply karungi!"
+    ),
+}
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `capacity` stored."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, cost: float = 1.0) -> bool:
+        """Take `cost` tokens if available."""
+        self._refill()
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def refund(self, cost: float = 1.0) -> None:
+        """Give back tokens taken by a request that was rejected elsewhere."""
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+    def time_until_available(self, cost: float = 1.0) -> float:
+        """Seconds until `cost` tokens will be available (0 if they are now)."""
+        self._refill()
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class LocalRateLimiter:
+    """Per-user and global token buckets held in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # A bucket idle for longer than its refill time is full again, so it can be dropped.
+        # The TTL counts from the last check (see check()), not from creation.
+        refill_seconds = RATE_LIMIT_USER_BURST / (RATE_LIMIT_USER_PER_MINUTE / 60)
+        self._users = TTLCache(maxsize=100_000, ttl=max(60.0, refill_seconds), timer=time.monotonic)
+        self._global = TokenBucket(RATE_LIMIT_GLOBAL_PER_SECOND, RATE_LIMIT_GLOBAL_BURST)
+
+    def check(self, user_id: str) -> Optional[str]:
+        """Consume one token for `user_id`; return the throttle reason or None."""
+        with self._lock:
+            bucket = self._users.get(user_id)
+            if bucket is None:
+                bucket = TokenBucket(RATE_LIMIT_USER_PER_MINUTE / 60, RATE_LIMIT_USER_BURST)
+            # Re-inserting restarts the TTL, so only idle (and therefore full) buckets expire;
+            # otherwise a steady sender would get a fresh full bucket every TTL
+            self._users[user_id] = bucket
+            if not bucket.try_acquire():
+                return "user"
+            if not self._global.try_acquire():
+                bucket.refund()
+                return "global"
+            return None
+
+
+class PostgresRateLimiter:
+    """Token buckets stored in Postgres so all replicas share one budget.
+
+    Each check is a single atomic upsert per bucket that refills from the
+    database clock, so replicas with skewed clocks still agree.
+    """
+
+    def __init__(self):
+        self.table = f"{DB_SCHEMA}.{RATE_LIMIT_TABLE}"
+        ensure_table(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "key TEXT PRIMARY KEY, tokens DOUBLE PRECISION NOT NULL, updated_at DOUBLE PRECISION NOT NULL)"
+        )
+        self._take = text(f"""
+            INSERT INTO {self.table} AS b (key, tokens, updated_at)
+            VALUES (:key, :capacity - 1, EXTRACT(EPOCH FROM clock_timestamp()))
+            ON CONFLICT (key) DO UPDATE SET
+                tokens = LEAST(:capacity, b.tokens + (EXTRACT(EPOCH FROM clock_timestamp()) - b.updated_at) * :rate) - 1,
+                updated_at = EXTRACT(EPOCH FROM clock_timestamp())
+            WHERE LEAST(:capacity, b.tokens + (EXTRACT(EPOCH FROM clock_timestamp()) - b.updated_at) * :rate) >= 1
+            RETURNING b.tokens
+        """)
+
+    def check(self, user_id: str) -> Optional[str]:
+        """Consume one token for `user_id`; return the throttle reason or None."""
+        with get_engine().connect() as conn:
+            with conn.begin() as tx:
+                user_ok = conn.execute(self._take, {
+                    "key": f"user:{user_id}",
+                    "rate": RATE_LIMIT_USER_PER_MINUTE / 60,
+                    "capacity": RATE_LIMIT_USER_BURST,
+                }).first()
+                if user_ok is None:
+                    return "user"
+                global_ok = conn.execute(self._take, {
+                    "key": GLOBAL_KEY,
+                    "rate": RATE_LIMIT_GLOBAL_PER_SECOND,
+                    "capacity": RATE_LIMIT_GLOBAL_BURST,
+                }).first()
+                if global_ok is None:
+                    # Roll back so the user's token is not spent on a rejected message
+                    tx.rollback()
+                    return "global"
+        return None
+
+
+_limiter = None
+_notified: TTLCache = TTLCache(maxsize=100_000, ttl=60)
+
+
+def get_rate_limiter():
+    """Return the process-wide limiter for RATE_LIMIT_BACKEND."""
+    global _limiter
+    if _limiter is None:
+        _limiter = PostgresRateLimiter() if RATE_LIMIT_BACKEND == "postgres" else LocalRateLimiter()
+    return _limiter
+
+
+async def check_rate_limit(user_id: str, channel: str) -> Optional[str]:
+    """Return a throttle reply for `user_id`, or None if the message may proceed.
+
+    Only the first throttled message per user per minute gets a reply, so a
+    flood of messages does not turn into a flood of throttle notices (the
+    caller should drop the message when the reply is an empty string).
+    """
+    limiter = get_rate_limiter()
+    try:
+        if isinstance(limiter, PostgresRateLimiter):
+            reason = await asyncio.to_thread(limiter.check, user_id)
+        else:
+            reason = limiter.check(user_id)
+    except Exception as e:
+        # Fail open: a rate-limiter outage should not take the bot down
+        logger.error(f"Rate limiter unavailable: {e}")
+        return None
+    if reason is None:
+        return None
+
+    metrics.inc("rate_limited_total", channel=channel, reason=reason)
+    if user_id in _notified:
+        return ""
+    _notified[user_id] = True
+    return THROTTLE_MESSAGES[reason]
@@ -0,0 +1,310 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+from agno.agent import Agent
+from agno.memory.v2.memory import Memory
+from openai.types.chat import ChatCompletion
+from sqlalchemy import and_, or_, select
+
+from metrics import metrics
+from routing import SMALL_TALK, route_turn
+from tool_runtime import ParallelToolsOpenAIChat
+
+logger = logging.getLogger(__name__)
+
+# Sessions read from storage per query; only one batch is held in memory at a time
+REPLAY_BATCH_SIZE = int(os.getenv("REPLAY_BATCH_SIZE", "50"))
+# Simulated completion latency of the fake model
+REPLAY_FAKE_LATENCY = int(os.getenv("REPLAY_FAKE_LATENCY_MS", "0")) / 1000
+
+# Recorded reply of the turn being replayed, returned by the fake model
+_recorded_reply: contextvars.ContextVar[str] = contextvars.ContextVar("recorded_reply", default="")
+
+
+@dataclass
+class ReplayTurn:
+    """One recorded user turn and what production did with it."""
+
+    session_id: str
+    user_id: Optional[str]
+    message: str
+    reply: str
+    seconds: float
+    input_tokens: int
+    tool_calls: int
+
+
+@dataclass
+class ReplayFakeChat(ParallelToolsOpenAIChat):
+    """Offline stand-in for the LLM: answers with the recorded reply and never calls tools.
+
+    Everything around the model (routing, prompt assembly, history, hooks)
+    still runs, so fake replays measure our own overhead and prompt size
+    without API cost. Token usage is estimated from message characters.
+    """
+
+    def invoke(self, messages, response_format=None, tools=None, tool_choice=None) -> ChatCompletion:
+        if REPLAY_FAKE_LATENCY:
+            time.sleep(REPLAY_FAKE_LATENCY)
+        reply = _recorded_reply.get() or "(no recorded reply)"
+        prompt_chars = sum(len(str(m.content or "")) for m in messages) + len(json.dumps(tools or []))
+        prompt_tokens, completion_tokens = prompt_chars // 4, max(1, len(reply) // 4)
+        return ChatCompletion.model_validate({
+            "id": "replay-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": self.id,
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": reply}}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    async def ainvoke(self, *args, **kwargs) -> ChatCompletion:
+        return await asyncio.to_thread(self.invoke, *args, **kwargs)
+
+
+def replay_agent(agent: Agent, fake: bool) -> Agent:
+    """Copy of a production agent that keeps its prompt, tools and hooks but writes nothing back.
+
+    Storage is dropped and memory is in-process, so history still builds up
+    within a replayed session; user memories and summaries are not updated
+    (they would add LLM calls the recorded turn may not have made).
+    """
+    update: Dict[str, Any] = {
+        "storage": None,
+        "memory": Memory(),
+        "enable_user_memories": False,
+        "enable_session_summaries": False,
+    }
+    if fake:
+        update["model"] = ReplayFakeChat(id=agent.model.id)
+    return agent.deep_copy(update=update)
+
+
+def _recorded_turns(session_id: str, user_id: Optional[str], runs: Optional[List[Dict]]) -> List[ReplayTurn]:
+    turns = []
+    for run in runs or []:
+        # The first non-history user message is what the user sent in this run
+        message = next(
+            (m.get("content") for m in run.get("messages") or []
+             if m.get("role") == "user" and not m.get("from_history")),
+            None,
+        )
+        if not isinstance(message, str) or not message.strip():
+            continue
+        run_metrics = run.get("metrics") or {}
+        turns.append(ReplayTurn(
+            session_id=session_id,
+            user_id=user_id,
+            message=message,
+            reply=run.get("content") if isinstance(run.get("content"), str) else "",
+            seconds=float(sum(run_metrics.get("time") or [])),
+            input_tokens=int(sum(run_metrics.get("input_tokens") or [])),
+            tool_calls=len(run.get("tools") or []),
+        ))
+    return turns
+
+
+def iter_recorded_sessions(storage, batch_size: int = REPLAY_BATCH_SIZE, limit: Optional[int] = None,
+                           since: Optional[datetime] = None) -> Iterator[List[ReplayTurn]]:
+    """Yield the recorded turns of each stored session, oldest first.
+
+    Sessions are paged with a keyset on (created_at, session_id) and only the
+    runs are selected, so any number of sessions streams in bounded memory.
+    """
+    table = storage.table
+    created_at = table.c.created_at
+    last = None
+    yielded = 0
+    while limit is None or yielded < limit:
+        query = select(table.c.session_id, table.c.user_id, created_at, table.c.memory["runs"].label("runs"))
+        conditions = []
+        if since is not None:
+            # created_at is stored as epoch seconds
+            conditions.append(created_at >= int(since.timestamp()))
+        if last is not None:
+            conditions.append(or_(created_at > last[0], and_(created_at == last[0], table.c.session_id > last[1])))
+        if conditions:
+            query = query.where(and_(*conditions))
+        batch = batch_size if limit is None else min(batch_size, limit - yielded)
+        query = query.order_by(created_at, table.c.session_id).limit(batch)
+        with storage.db_engine.connect() as connection:
+            rows = connection.execute(query).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yielded += 1
+            yield _recorded_turns(row.session_id, row.user_id, row.runs)
+        last = (rows[-1].created_at, rows[-1].session_id)
+        if len(rows) < batch:
+            return
+
+
+def _tool_names(response) -> List[str]:
+    return [getattr(t, "tool_name", None) or "unknown" for t in getattr(response, "tools", None) or []]
+
+
+async def _replay_session(agents: Dict[str, Agent], turns: List[ReplayTurn], results: List[Dict]) -> None:
+    for turn in turns:
+        route = route_turn(turn.message)
+        agent = agents[route]
+        _recorded_reply.set(turn.reply)
+        started = time.perf_counter()
+        try:
+            response = await asyncio.to_thread(
+                agent.run, turn.message, user_id=turn.user_id, session_id=turn.session_id, stream=False
+            )
+        except Exception as e:
+            logger.warning(f"Replay of a turn failed: {e}", extra={"fields": {"session_id": turn.session_id}})
+            results.append({"route": route, "error": type(e).__name__})
+            continue
+        seconds = time.perf_counter() - started
+        run_metrics = getattr(response, "metrics", None) or {}
+        content = response.content if isinstance(response.content, str) else str(response.content or "")
+        metrics.observe("replay_turn_seconds", seconds, route=route)
+        results.append({
+            "route": route,
+            "seconds": seconds,
+            "input_tokens": int(sum(run_metrics.get("input_tokens", []))),
+            "output_tokens": int(sum(run_metrics.get("output_tokens", []))),
+            "cached_tokens": int(sum(run_metrics.get("cached_tokens", []))),
+            "tools": _tool_names(response),
+            "reply_chars": len(content),
+            "recorded": {
+                "seconds": turn.seconds,
+                "input_tokens": turn.input_tokens,
+                "tool_calls": turn.tool_calls,
+                "reply_chars": len(turn.reply),
+            },
+        })
+    # Keep the in-process memory from growing with every replayed session
+    for agent in agents.values():
+        agent.memory.runs.pop(turns[0].session_id, None)
+
+
+def _distribution(values: List[float], digits: int = 3) -> Dict[str, float]:
+    if not values:
+        return {}
+    data = np.asarray(values, dtype=float)
+    p50, p90, p95, p99 = np.percentile(data, [50, 90, 95, 99])
+    return {
+        "mean": round(float(data.mean()), digits), "p50": round(float(p50), digits),
+        "p90": round(float(p90), digits), "p95": round(float(p95), digits),
+        "p99": round(float(p99), digits), "max": round(float(data.max()), digits),
+    }
+
+
+def summarize_results(results: List[Dict], sessions: int, wall_seconds: float, model: str,
+                      concurrency: int) -> Dict[str, Any]:
+    """Aggregate replayed turns into latency, token, tool-call and reply-length distributions."""
+    ok = [r for r in results if "error" not in r]
+    tool_counts = Counter(name for r in ok for name in r["tools"])
+    return {
+        "model": model,
+        "concurrency": concurrency,
+        "sessions": sessions,
+        "turns": len(results),
+        "errors": dict(Counter(r["error"] for r in results if "error" in r)),
+        "wall_seconds": round(wall_seconds, 3),
+        "turns_per_second": round(len(results) / wall_seconds, 2) if wall_seconds else 0.0,
+        "routes": dict(Counter(r["route"] for r in results)),
+        "replay": {
+            "latency_seconds": _distribution([r["seconds"] for r in ok]),
+            "input_tokens": _distribution([r["input_tokens"] for r in ok], 1),
+            "output_tokens": _distribution([r["output_tokens"] for r in ok], 1),
+            "cached_tokens_total": sum(r["cached_tokens"] for r in ok),
+            "tool_calls_per_turn": _distribution([len(r["tools"]) for r in ok], 2),
+            "reply_chars": _distribution([r["reply_chars"] for r in ok], 1),
+        },
+        "recorded": {
+            "latency_seconds": _distribution([r["recorded"]["seconds"] for r in ok]),
+            "input_tokens": _distribution([r["recorded"]["input_tokens"] for r in ok], 1),
+            "tool_calls_per_turn": _distribution([r["recorded"]["tool_calls"] for r in ok], 2),
+            "reply_chars": _distribution([r["recorded"]["reply_chars"] for r in ok], 1),
+        },
+        "tool_calls": dict(tool_counts.most_common()),
+    }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Human-readable side-by-side of the replayed and the recorded turns."""
+    lines = [
+        f"Replayed {report['turns']} turns from {report['sessions']} sessions "
+        f"(model={report['model']}, concurrency={report['concurrency']}) in {report['wall_seconds']}s "
+        f"({report['turns_per_second']} turns/s)",
+        f"Routes: {report['routes']}",
+    ]
+    if report["errors"]:
+        lines.append(f"Errors: {report['errors']}")
+    lines.append(f"{'':22}{'replay':>46}   recorded")
+    for key in ("latency_seconds", "input_tokens", "output_tokens", "tool_calls_per_turn", "reply_chars"):
+        replayed, recorded = report["replay"].get(key, {}), report["recorded"].get(key, {})
+        cells = [" ".join(f"{k}={v}" for k, v in stats.items() if k in ("p50", "p95", "max")) or "-"
+                 for stats in (replayed, recorded)]
+        lines.append(f"{key:22}{cells[0]:>46}   {cells[1]}")
+    lines.append(f"Cached input tokens: {report['replay']['cached_tokens_total']}")
+    lines.append(f"Tool calls: {report['tool_calls'] or 'none'}")
+    return "\n".join(lines)
+
+
+async def replay_sessions(agents: Dict[str, Agent], model: str = "fake", concurrency: int = 4,
+                          limit: Optional[int] = None, since: Optional[datetime] = None,
+                          batch_size: int = REPLAY_BATCH_SIZE) -> Dict[str, Any]:
+    """Replay stored sessions through copies of `agents` and return the benchmark report.
+
+    `agents` maps routes (tool profiles and SMALL_TALK) to production agents.
+    Up to `concurrency` sessions run at once, each with its own agent copies;
+    turns within a session run in order so history matches the original.
+    """
+    fake = model == "fake"
+    storage = agents[SMALL_TALK].storage
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    results: List[Dict] = []
+    sessions = 0
+
+    async def worker() -> None:
+        copies = {route: replay_agent(agent, fake) for route, agent in agents.items()}
+        while True:
+            turns = await queue.get()
+            try:
+                if turns is None:
+                    return
+                await _replay_session(copies, turns, results)
+            finally:
+                queue.task_done()
+
+    started = time.perf_counter()
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    sessions_iter = iter_recorded_sessions(storage, batch_size=batch_size, limit=limit, since=since)
+    try:
+        while True:
+            # Reading blocks on the database, so page through storage off the event loop
+            turns = await asyncio.to_thread(next, sessions_iter, None)
+            if turns is None:
+                break
+            if turns:
+                sessions += 1
+                await queue.put(turns)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+    report = summarize_results(results, sessions, time.perf_counter() - started, model, concurrency)
+    logger.info("Replay finished", extra={"fields": {
+        "sessions": sessions, "turns": report["turns"], "model": model, "errors": report["errors"],
+    }})
+    return report
@@ -0,0 +1,340 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+from agno.exceptions import ModelProviderError
+from agno.models.openai import OpenAIChat
+from openai import AsyncOpenAI, OpenAI
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Circuit breaker configuration (shared by every dependency)
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# Per-dependency timeouts; hedging is off unless a delay is configured
+DEPENDENCY_TIMEOUTS = {
+    "yfinance": float(os.getenv("YFINANCE_TIMEOUT_SECONDS", "10")),
+    "tavily": float(os.getenv("TAVILY_TIMEOUT_SECONDS", "15")),
+}
+TOOL_HEDGE_AFTER = int(os.getenv("TOOL_HEDGE_AFTER_MS", "0")) / 1000
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_HEDGE_AFTER = int(os.getenv("LLM_HEDGE_AFTER_MS", "0")) / 1000
+
+# Which external service each tool depends on; tools not listed run unguarded
+TOOL_DEPENDENCIES = {
+    "get_current_stock_price": "yfinance",
+    "get_company_info": "yfinance",
+    "get_analyst_recommendations": "yfinance",
+    "get_company_news": "yfinance",
+    "get_stock_fundamentals": "yfinance",
+    "get_income_statements": "yfinance",
+    "get_key_financial_ratios": "yfinance",
+    "get_historical_stock_prices": "yfinance",
+    "get_technical_indicators": "yfinance",
+    "web_search_using_tavily": "tavily",
+}
+
+# Returned to the model in place of a tool result while its dependency is unavailable
+TOOL_DEGRADED_RESULT = (
+    "The {dependency} service is unavailable right now, so no live data could be fetched. "
+    "Answer from general knowledge, say clearly that live data is unavailable, and suggest trying again shortly."
+)
+
+
+class DegradedToolResult(str):
+    """TOOL_DEGRADED_RESULT as returned by guard_tool_call, so other hooks can tell it from data."""
+
+
+# Sent to the user while the LLM breaker is open
+LLM_DEGRADED_REPLY = (
+    "Sorry yaar, I'm having trouble thinking right now 😅 "
+    "Please try again in a minute!"
+)
+
+# Gauge values for circuit_breaker_state
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+_STATE_NAMES = {CLOSED: "closed", HALF_OPEN: "half_open", OPEN: "open"}
+
+_hedge_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("RESILIENCE_POOL_SIZE", "32")), thread_name_prefix="guarded-call"
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because its dependency's breaker is open."""
+
+    def __init__(self, dependency: str):
+        super().__init__(f"circuit open for {dependency}")
+        self.dependency = dependency
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    After `failure_threshold` failures in a row the breaker opens and calls
+    fail fast. Once `reset_timeout` has passed, a single probe call is let
+    through (half-open); its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        metrics.set("circuit_breaker_state", CLOSED, dependency=name)
+
+    def _set_state(self, state: int) -> None:
+        if state != self._state:
+            logger.warning(f"Circuit breaker {self.name}: {_STATE_NAMES[self._state]} -> {_STATE_NAMES[state]}")
+        self._state = state
+        metrics.set("circuit_breaker_state", state, dependency=self.name)
+
+    def is_open(self) -> bool:
+        """True while calls would be rejected (open and not yet due for a probe)."""
+        with self._lock:
+            return self._state == OPEN and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def allow(self) -> bool:
+        """Return whether a call may proceed; counts a rejection otherwise."""
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self._state == CLOSED or (self._state == HALF_OPEN and not self._probing):
+                self._probing = self._state == HALF_OPEN
+                return True
+        metrics.inc("circuit_breaker_rejected_total", dependency=self.name)
+        return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    metrics.inc("circuit_breaker_trips_total", dependency=self.name)
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(dependency: str) -> CircuitBreaker:
+    """Return the process-wide breaker for a dependency."""
+    with _breakers_lock:
+        if dependency not in _breakers:
+            _breakers[dependency] = CircuitBreaker(dependency)
+        return _breakers[dependency]
+
+
+def call_with_deadline(fn: Callable[[], Any], timeout: Optional[float], hedge_after: float = 0.0,
+                       dependency: str = "") -> Any:
+    """Run `fn` on the guarded-call pool and wait at most `timeout` seconds.
+
+    With `hedge_after` set, a duplicate call is started if the first has not
+    finished by then and whichever succeeds first wins (only for idempotent,
+    read-only calls). On timeout the caller is released; the stuck call keeps
+    its pool thread until it returns.
+    """
+    started = time.monotonic()
+    futures: Dict[Future, str] = {
+        _hedge_pool.submit(contextvars.copy_context().run, fn): "primary",
+    }
+    if hedge_after and (timeout is None or hedge_after < timeout):
+        done, _ = wait(futures, timeout=hedge_after)
+        if not done:
+            metrics.inc("hedged_requests_total", dependency=dependency)
+            futures[_hedge_pool.submit(contextvars.copy_context().run, fn)] = "hedge"
+    error: Optional[BaseException] = None
+    while futures:
+        remaining = None if timeout is None else timeout - (time.monotonic() - started)
+        if remaining is not None and remaining <= 0:
+            break
+        done, _ = wait(futures, timeout=remaining, return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            attempt = futures.pop(future)
+            if future.exception() is None:
+                if attempt == "hedge":
+                    metrics.inc("hedged_requests_won_total", dependency=dependency)
+                return future.result()
+            error = future.exception()
+    if futures or error is None:
+        raise FutureTimeoutError(f"{dependency or 'call'} timed out after {timeout}s")
+    raise error
+
+
+def guard_tool_call(function_name: str, function_call: Callable, arguments: Dict[str, Any]) -> Any:
+    """Tool hook applying the dependency's breaker, timeout and hedging.
+
+    Timeouts and exceptions count as failures. While the breaker is open, or
+    when the call fails, the model gets TOOL_DEGRADED_RESULT instead of an
+    error, so the turn still produces an answer.
+    """
+    dependency = TOOL_DEPENDENCIES.get(function_name)
+    if dependency is None:
+        return function_call(**arguments)
+    breaker = get_breaker(dependency)
+    if not breaker.allow():
+        metrics.inc("tool_degraded_total", dependency=dependency, reason="circuit_open")
+        return DegradedToolResult(TOOL_DEGRADED_RESULT.format(dependency=dependency))
+    try:
+        result = call_with_deadline(
+            lambda: function_call(**arguments), DEPENDENCY_TIMEOUTS.get(dependency),
+            TOOL_HEDGE_AFTER, dependency,
+        )
+    except FutureTimeoutError:
+        breaker.record_failure()
+        metrics.inc("tool_degraded_total", dependency=dependency, reason="timeout")
+        logger.warning(f"Tool {function_name} timed out", extra={"fields": {"dependency": dependency}})
+        return DegradedToolResult(TOOL_DEGRADED_RESULT.format(dependency=dependency))
+    except Exception as e:
+        breaker.record_failure()
+        metrics.inc("tool_degraded_total", dependency=dependency, reason="error")
+        logger.warning(f"Tool {function_name} failed: {e}", extra={"fields": {"dependency": dependency}})
+        return DegradedToolResult(TOOL_DEGRADED_RESULT.format(dependency=dependency))
+    breaker.record_success()
+    return result
+
+
+def _is_provider_outage(error: Exception) -> bool:
+    """Connection errors, timeouts, 429 and 5xx count against the LLM breaker; bad requests do not."""
+    if isinstance(error, FutureTimeoutError):
+        return True
+    return isinstance(error, ModelProviderError) and (error.status_code >= 500 or error.status_code == 429)
+
+
+# OpenAI clients shared by all model instances with the same settings, so every
+# agent (and agent variant) reuses one connection pool instead of opening its own
+_openai_clients: Dict[Any, Any] = {}
+_openai_clients_lock = threading.Lock()
+
+
+def _client_key(params: Dict[str, Any]) -> tuple:
+    return tuple(sorted((name, repr(value)) for name, value in params.items()))
+
+
+@dataclass
+class ResilientOpenAIChat(OpenAIChat):
+    """OpenAIChat with client timeouts, a circuit breaker and optional hedging.
+
+    Non-streaming completions go through the breaker named by `breaker`
+    ("openai" for replies); when it is open they raise CircuitOpenError
+    immediately instead of waiting on the API.
+    """
+
+    timeout: Optional[float] = LLM_TIMEOUT_SECONDS
+    max_retries: Optional[int] = LLM_MAX_RETRIES
+    breaker: str = "openai"
+
+    def get_client(self) -> OpenAI:
+        # agno builds a new client (and connection pool) on every call otherwise
+        if self.http_client is not None:
+            return super().get_client()
+        params = self._get_client_params()
+        key = ("sync", _client_key(params))
+        with _openai_clients_lock:
+            client = _openai_clients.get(key)
+            if client is None:
+                client = _openai_clients[key] = OpenAI(**params)
+        return client
+
+    def get_async_client(self) -> AsyncOpenAI:
+        if self.http_client is not None:
+            return super().get_async_client()
+        params = self._get_client_params()
+        key = ("async", _client_key(params))
+        loop = asyncio.get_running_loop()
+        with _openai_clients_lock:
+            # Async connections belong to one event loop
+            client_loop, client = _openai_clients.get(key, (None, None))
+            if client_loop is not loop:
+                client = AsyncOpenAI(**params, http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100)
+                ))
+                _openai_clients[key] = (loop, client)
+        return client
+
+    def invoke(self, *args, **kwargs):
+        breaker = get_breaker(self.breaker)
+        if not breaker.allow():
+            raise CircuitOpenError(self.breaker)
+        try:
+            if LLM_HEDGE_AFTER:
+                response = call_with_deadline(
+                    lambda: super(ResilientOpenAIChat, self).invoke(*args, **kwargs), None, LLM_HEDGE_AFTER, self.breaker
+                )
+            else:
+                response = super().invoke(*args, **kwargs)
+        except Exception as e:
+            if _is_provider_outage(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+        breaker.record_success()
+        return response
+
+    async def ainvoke(self, *args, **kwargs):
+        breaker = get_breaker(self.breaker)
+        if not breaker.allow():
+            raise CircuitOpenError(self.breaker)
+        try:
+            if LLM_HEDGE_AFTER:
+                response = await self._hedged_ainvoke(*args, **kwargs)
+            else:
+                response = await super().ainvoke(*args, **kwargs)
+        except Exception as e:
+            if _is_provider_outage(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+        breaker.record_success()
+        return response
+
+    async def _hedged_ainvoke(self, *args, **kwargs):
+        primary = asyncio.ensure_future(super().ainvoke(*args, **kwargs))
+        done, _ = await asyncio.wait({primary}, timeout=LLM_HEDGE_AFTER)
+        if done:
+            return primary.result()
+        metrics.inc("hedged_requests_total", dependency=self.breaker)
+        hedge = asyncio.ensure_future(super().ainvoke(*args, **kwargs))
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if task is hedge:
+                        metrics.inc("hedged_requests_won_total", dependency=self.breaker)
+                    return task.result()
+                error = task.exception()
+        raise error
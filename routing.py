@@ -0,0 +1,111 @@
+import os
+import re
+
+from tool_profiles import CALC, COMPANY, FULL, NEWS, QUOTE
+
+# Set MODEL_ROUTING=0 to send every turn through the full finance agent
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING", "1") != "0"
+
+SMALL_TALK = "small_talk"
+FINANCE = "finance"
+
+# Words that make up typical greetings, thanks and acknowledgements (English, Hindi, Hinglish).
+# Bare confirmations ("yes", "haan", "ok", "theek hai") are left out: they usually answer
+# Tara's own follow-up ("Shall I check Nifty for you?"), which needs the finance agent's tools.
+SMALL_TALK_WORDS = {
+    "hi", "hii", "hiii", "hello", "helo", "hey", "heyy", "yo", "namaste", "namaskar", "hola",
+    "good", "morning", "afternoon", "evening", "night", "gm", "gn",
+    "thanks", "thank", "you", "u", "thx", "ty", "tysm", "so", "much", "very", "a", "lot",
+    "shukriya", "dhanyavad", "dhanyawad", "cheers",
+    "cool", "great", "nice", "awesome", "super",
+    "bye", "alvida", "tata", "see", "ya", "later", "lol", "haha", "hehe",
+    "how", "are", "r", "kaise", "ho", "kaisi", "aap", "tum", "main", "mai", "badhiya", "mast", "fine",
+    "i", "am", "im", "and", "too", "bhi", "ji", "dost", "tara", "there",
+}
+
+# Anything mentioning money, markets or planning goes to the full agent. Whole words only
+# ("cheers" is not "rs"), except stems that also cover their inflections (investing, savings)
+FINANCE_KEYWORDS = re.compile(
+    r"₹|\$|\b(?:"
+    r"(?:stock|share|market|fund|invest|portfolio|loan|salar|sav|paisa|paise|paison|rupee|lakh|crore|"
+    r"budget|insur|crypto|bitcoin|dividend|return|retire|goal|profit|expense|kharch|bacha)\w*|"
+    r"(?:price|nifty|sensex|sip|nav|emi|tax|taxes|rs|fd|rd|ppf|epf|nps|gold|ipo|interest|rate|bank|"
+    r"credit|debt|cagr|xirr|buy|sell|trade|trading|trader|loss|losses)s?\b)",
+    re.IGNORECASE,
+)
+
+_WORD = re.compile(r"[a-z]+")
+
+
+def classify_turn(text: str, has_media: bool = False) -> str:
+    """Classify a user turn as small talk or a finance query.
+
+    A cheap local heuristic: a short message made only of greeting/thanks/
+    acknowledgement words (or only emoji and punctuation) is small talk.
+    Media, digits or any finance keyword always go to the full agent, so
+    borderline messages err on the side of the tool-enabled path.
+    """
+    if not MODEL_ROUTING_ENABLED or has_media:
+        return FINANCE
+    text = (text or "").strip()
+    if not text or len(text) > 80 or any(ch.isdigit() for ch in text) or FINANCE_KEYWORDS.search(text):
+        return FINANCE
+    words = _WORD.findall(text.lower())
+    if len(words) > 8:
+        return FINANCE
+    if not words:
+        # Emoji/punctuation-only ("👍", "😊🙏") is small talk; other scripts (e.g. Devanagari) are not judged
+        return FINANCE if any(ch.isalpha() for ch in text) else SMALL_TALK
+    if all(word in SMALL_TALK_WORDS for word in words):
+        return SMALL_TALK
+    return FINANCE
+
+
+# Intent patterns for picking a tool profile (see tool_profiles.py); checked in order
+_INTENT_PATTERNS = (
+    (COMPANY, re.compile(
+        r"\b(analyst|recommendation|rating|target price|fundamental|company info|about the company|"
+        r"market cap|p/?e ratio|compare|comparison|vs\.?|versus|better)\b", re.IGNORECASE)),
+    (NEWS, re.compile(
+        r"\b(news|headlines?|khabar|announcement|results?|earnings|latest on|update on|"
+        r"why (did|is) .* (fall|falling|rise|rising|up|down))\b", re.IGNORECASE)),
+    (QUOTE, re.compile(
+        r"\b(price|quote|trading at|kitne ka|kitna hai|rate kya|current value|share price|stock price|ltp)\b",
+        re.IGNORECASE)),
+)
+
+# Pure calculations (returns, SIP/goal maths, rebalancing) only need the portfolio maths tools
+_CALC = re.compile(
+    r"\b(xirr|cagr|corpus|calculat\w*|compute|rebalanc\w*|drift|step.?up|kitna banega|how much will)\b",
+    re.IGNORECASE)
+# ...unless the numbers have to come from market data or the user's documents: data keywords
+# (any case), tickers (all caps) or company/index names (capitalised mid-sentence)
+_NEEDS_DATA = re.compile(
+    r"\b((?i:stock|share|price|nifty|sensex|index|news|statement|pdf|document|holdings|my portfolio)|"
+    r"(?!XIRR|CAGR|SIP|EMI|NAV|SWP)[A-Z]{3,}(\.NS|\.BO)?|(?<=[a-z,] )[A-Z][a-z]{2,})\b")
+
+# Words that signal advice, planning or questions about shared statements, which need the full toolset
+_ADVICE = re.compile(
+    r"\b(should|suggest|advice|advise|plan|kya karu|kya karun|recommend me|portfolio|goal|retire|"
+    r"sip|invest|allocation|statement|pdf|document|holdings)\b", re.IGNORECASE)
+
+
+def classify_intent(text: str) -> str:
+    """Pick the tool profile for a finance turn; FULL when unsure."""
+    if not MODEL_ROUTING_ENABLED or not text:
+        return FULL
+    if _CALC.search(text) and not _NEEDS_DATA.search(text):
+        return CALC
+    if _ADVICE.search(text):
+        return FULL
+    for intent, pattern in _INTENT_PATTERNS:
+        if pattern.search(text):
+            return intent
+    return FULL
+
+
+def route_turn(text: str, has_media: bool = False) -> str:
+    """Route a turn to SMALL_TALK or to the tool profile that should answer it."""
+    if classify_turn(text, has_media) == SMALL_TALK:
+        return SMALL_TALK
+    return FULL if has_media else classify_intent(text)
@@ -7,14 +7,12 @@ from telegram.ext import (
     Application, CommandHandler, MessageHandler, 
     filters, ContextTypes, ConversationHandler
 )
-from test import finance_agent  # Import from test.py where finance_agent is defined
+from test import finance_agent, on_startup, on_shutdown  # Import from test.py where finance_agent is defined
 from dotenv import load_dotenv
+from logging_setup import configure_logging, new_correlation_id
 
 # Set up logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Load environment variables from .env file
@@ -47,6 +45,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Handle incoming messages and respond using the finance_agent."""
     user_message = update.message.text
     chat_id = update.effective_chat.id
+    new_correlation_id(f"tg-{update.update_id}")
     
     # Send typing action to show the bot is working
     await context.bot.send_chat_action(chat_id=chat_id, action="typing")
@@ -96,7 +95,13 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 def main() -> None:
     """Start the bot."""
     # Create the Application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     
     # Add conversation handler
     conv_handler = ConversationHandler(
@@ -0,0 +1,254 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from cachetools import TTLCache
+from telegram.error import RetryAfter
+
+from metrics import metrics
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages/second per bot, about 1/second per chat
+# (short bursts are fine) and 20/minute per group. The global budget is split
+# between the processes sending for the same bot (see ShardedUpdateRouter).
+TELEGRAM_GLOBAL_PER_SECOND = float(os.getenv("TELEGRAM_GLOBAL_PER_SECOND", "28"))
+TELEGRAM_GLOBAL_BURST = float(os.getenv("TELEGRAM_GLOBAL_BURST", "30"))
+TELEGRAM_CHAT_PER_SECOND = float(os.getenv("TELEGRAM_CHAT_PER_SECOND", "1"))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_GROUP_PER_MINUTE = float(os.getenv("TELEGRAM_GROUP_PER_MINUTE", "20"))
+# Processes sharing the bot's global budget
+TELEGRAM_OUTBOX_PROCESSES = max(1, int(os.getenv("TELEGRAM_OUTBOX_PROCESSES", "1")))
+# RetryAfter responses tolerated for one message before it fails
+TELEGRAM_SEND_MAX_RETRIES = int(os.getenv("TELEGRAM_SEND_MAX_RETRIES", "5"))
+
+# Lower sends first: the opening paragraph of every reply goes ahead of the
+# remaining paragraphs of replies already being sent
+PRIORITY_FIRST = 0
+PRIORITY_REST = 1
+
+
+def _seconds(retry_after) -> float:
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+
+class _Send:
+    __slots__ = ("send", "priority", "seq", "future", "enqueued", "attempts")
+
+    def __init__(self, send: Callable[[], Awaitable[Any]], priority: int, seq: int, future: asyncio.Future):
+        self.send = send
+        self.priority = priority
+        self.seq = seq
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+
+
+class _Chat:
+    __slots__ = ("bucket", "pending", "busy", "paused_until")
+
+    def __init__(self, chat_id: int):
+        # Negative IDs are groups and channels, which have the tighter per-minute limit
+        if chat_id < 0:
+            self.bucket = TokenBucket(TELEGRAM_GROUP_PER_MINUTE / 60, 1)
+        else:
+            self.bucket = TokenBucket(TELEGRAM_CHAT_PER_SECOND, TELEGRAM_CHAT_BURST)
+        self.pending: Deque[_Send] = deque()
+        self.busy = False
+        self.paused_until = 0.0
+
+
+class TelegramOutbox:
+    """Central scheduler for outgoing Telegram messages.
+
+    Every send waits for a token from its chat's bucket and from the bot-wide
+    bucket, so bursts of replies are paced at Telegram's limits instead of
+    failing. Messages of one chat go out one at a time and in order; across
+    chats the lowest priority, then the oldest message, goes first. A
+    RetryAfter pauses every chat for the requested delay (the bot-wide flood
+    limit fails every chat's next send too), and the message is retried
+    after it.
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_PER_SECOND / TELEGRAM_OUTBOX_PROCESSES,
+                 global_burst: float = TELEGRAM_GLOBAL_BURST / TELEGRAM_OUTBOX_PROCESSES):
+        self._global = TokenBucket(global_rate, max(1.0, global_burst))
+        self._paused_until = 0.0
+        self._chats: Dict[int, _Chat] = {}
+        # Idle chats keep their bucket (and any pause) until it would be full again anyway
+        self._idle: TTLCache = TTLCache(maxsize=100_000, ttl=60)
+        # One entry per chat with a sendable head: (priority, seq, chat_id)
+        self._heap: List[Tuple[int, int, int]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._sending: set = set()
+        self._queued = 0
+
+    def submit(self, chat_id: int, send: Callable[[], Awaitable[Any]], priority: int = PRIORITY_REST) -> asyncio.Future:
+        """Queue a send (a zero-argument coroutine function); the future resolves to its result."""
+        chat = self._chats.get(chat_id) or self._idle.pop(chat_id, None) or _Chat(chat_id)
+        self._chats[chat_id] = chat
+        item = _Send(send, priority, next(self._seq), asyncio.get_running_loop().create_future())
+        chat.pending.append(item)
+        if len(chat.pending) == 1 and not chat.busy:
+            self._schedule(chat_id, chat)
+        self._queued += 1
+        metrics.set("telegram_outbox_queued", self._queued)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="telegram-outbox")
+        self._wakeup.set()
+        return item.future
+
+    def _schedule(self, chat_id: int, chat: _Chat) -> None:
+        head = chat.pending[0]
+        heapq.heappush(self._heap, (head.priority, head.seq, chat_id))
+
+    async def _run(self) -> None:
+        while True:
+            delay = self._dispatch()
+            # _dispatch never awaits, so nothing can be submitted between it and clear()
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self) -> Optional[float]:
+        """Start every send whose buckets allow it; return seconds until the next one may (None: idle)."""
+        now = time.monotonic()
+        deferred, delay = [], None
+        while self._heap:
+            wait = max(self._paused_until - now, self._global.time_until_available())
+            if wait > 0:
+                delay = wait if delay is None else min(delay, wait)
+                break
+            entry = heapq.heappop(self._heap)
+            chat = self._chats[entry[2]]
+            # Drop messages whose caller stopped waiting (e.g. a cancelled turn)
+            while chat.pending and chat.pending[0].future.done():
+                chat.pending.popleft()
+                self._queued -= 1
+            if not chat.pending:
+                self._retire(entry[2], chat)
+                continue
+            wait = max(chat.paused_until - now, chat.bucket.time_until_available())
+            if wait > 0:
+                deferred.append(entry)
+                delay = wait if delay is None else min(delay, wait)
+                continue
+            chat.bucket.try_acquire()
+            self._global.try_acquire()
+            item = chat.pending.popleft()
+            chat.busy = True
+            task = asyncio.create_task(self._deliver(entry[2], chat, item))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+        metrics.set("telegram_outbox_queued", self._queued)
+        return delay
+
+    def _retire(self, chat_id: int, chat: _Chat) -> None:
+        if not chat.pending and not chat.busy:
+            self._chats.pop(chat_id, None)
+            self._idle[chat_id] = chat
+
+    async def _deliver(self, chat_id: int, chat: _Chat, item: _Send) -> None:
+        item.attempts += 1
+        requeued = False
+        try:
+            result = await item.send()
+        except RetryAfter as e:
+            seconds = _seconds(e.retry_after)
+            chat.paused_until = time.monotonic() + seconds
+            self._paused_until = max(self._paused_until, chat.paused_until)
+            metrics.inc("telegram_retry_after_total")
+            logger.warning("Telegram flood limit hit; pausing sends", extra={"fields": {
+                "retry_after": seconds, "attempt": item.attempts,
+            }})
+            if item.attempts <= TELEGRAM_SEND_MAX_RETRIES and not item.future.done():
+                chat.pending.appendleft(item)
+                requeued = True
+            elif not item.future.done():
+                metrics.inc("telegram_sends_total", status="flood")
+                item.future.set_exception(e)
+        except Exception as e:
+            metrics.inc("telegram_sends_total", status="error")
+            if not item.future.done():
+                item.future.set_exception(e)
+        else:
+            metrics.inc("telegram_sends_total", status="ok")
+            metrics.observe("telegram_outbox_wait_seconds", time.monotonic() - item.enqueued,
+                            priority="first" if item.priority == PRIORITY_FIRST else "rest")
+            if not item.future.done():
+                item.future.set_result(result)
+        finally:
+            if not requeued:
+                self._queued -= 1
+            chat.busy = False
+            if chat.pending:
+                self._schedule(chat_id, chat)
+            else:
+                self._retire(chat_id, chat)
+            self._wakeup.set()
+
+    async def close(self) -> None:
+        """Stop the dispatcher; messages still queued fail with CancelledError."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for chat in self._chats.values():
+            for item in chat.pending:
+                item.future.cancel()
+            chat.pending.clear()
+        self._heap.clear()
+
+
+_outbox: Optional[TelegramOutbox] = None
+_outbox_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_outbox() -> TelegramOutbox:
+    """Return the outbox of the running event loop (one per loop, created lazily)."""
+    global _outbox, _outbox_loop
+    loop = asyncio.get_running_loop()
+    if _outbox is None or _outbox_loop is not loop:
+        _outbox, _outbox_loop = TelegramOutbox(), loop
+    return _outbox
+
+
+async def close_outbox() -> None:
+    """Stop the running loop's outbox, if it has one."""
+    global _outbox
+    if _outbox is not None and _outbox_loop is asyncio.get_running_loop():
+        await _outbox.close()
+        _outbox = None
+
+
+async def send_paragraphs(chat_id: int, send_text: Callable[[str], Awaitable[Any]], paragraphs: List[str]) -> None:
+    """Queue a reply's paragraphs for one chat and wait until all are delivered.
+
+    The first paragraph is queued at PRIORITY_FIRST so every user sees the
+    start of their answer quickly even while long replies are going out.
+    """
+    outbox = get_outbox()
+    futures = [
+        outbox.submit(chat_id, lambda text=text: send_text(text), PRIORITY_FIRST if i == 0 else PRIORITY_REST)
+        for i, text in enumerate(paragraphs)
+    ]
+    try:
+        await asyncio.gather(*futures)
+    except BaseException:
+        # Don't keep sending the rest of a reply that already failed or was cancelled
+        for future in futures:
+            future.cancel()
+        raise
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+from lifecycle import SHUTDOWN_DRAIN_SECONDS, release_resources
+from logging_setup import configure_logging
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# bot_data key: time.monotonic() by which a stopping Application's post_stop must be done
+DRAIN_DEADLINE = "drain_deadline"
+
+# Update fields that carry a chat, checked in order when picking a shard
+_CHAT_FIELDS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "business_message", "my_chat_member", "chat_member", "chat_join_request",
+)
+
+
+def update_shard_key(data: Dict[str, Any]) -> int:
+    """Return the chat ID an update belongs to (falling back to user, then update ID)."""
+    for field in _CHAT_FIELDS:
+        chat = (data.get(field) or {}).get("chat")
+        if chat and "id" in chat:
+            return int(chat["id"])
+    callback = data.get("callback_query") or {}
+    chat = (callback.get("message") or {}).get("chat")
+    if chat and "id" in chat:
+        return int(chat["id"])
+    for value in data.values():
+        if isinstance(value, dict) and "from" in value:
+            return int(value["from"]["id"])
+    return int(data.get("update_id", 0))
+
+
+class ChatSerializer:
+    """Run updates concurrently across chats but strictly in order within a chat."""
+
+    def __init__(self, application: Application):
+        self.application = application
+        self._locks: Dict[int, List] = {}  # chat_id -> [lock, pending count]
+        self._tasks: set = set()
+
+    def submit(self, chat_id: int, update: Update) -> None:
+        """Schedule an update; asyncio.Lock is FIFO, so arrival order is kept."""
+        entry = self._locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        task = asyncio.create_task(self._run(chat_id, entry, update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, chat_id: int, entry: List, update: Update) -> None:
+        try:
+            async with entry[0]:
+                await self.application.process_update(update)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(chat_id, None)
+
+    async def drain(self, timeout: Optional[float] = None) -> int:
+        """Wait for submitted updates to finish; returns how many were still running at the timeout."""
+        if not self._tasks:
+            return 0
+        _, unfinished = await asyncio.wait(list(self._tasks), timeout=timeout)
+        if unfinished:
+            logger.warning(f"{len(unfinished)} Telegram updates still running at the drain deadline")
+        return len(unfinished)
+
+
+async def start_application(application: Application) -> None:
+    """Initialize an Application that is fed updates directly (no updater)."""
+    await application.initialize()
+    await application.start()
+    if application.post_init:
+        await application.post_init(application)
+
+
+async def stop_application(application: Application, deadline: Optional[float] = None) -> None:
+    """Counterpart of start_application; post_stop may use `deadline` (see DRAIN_DEADLINE)."""
+    if deadline is not None:
+        application.bot_data[DRAIN_DEADLINE] = deadline
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+
+
+async def _serve_shard(shard: int, updates: multiprocessing.Queue, factory: Callable[[], Application]) -> None:
+    application = factory()
+    await start_application(application)
+    serializer = ChatSerializer(application)
+    loop = asyncio.get_running_loop()
+    logger.info(f"Telegram worker {shard} ready")
+    while True:
+        raw = await loop.run_in_executor(None, updates.get)
+        if raw is None:
+            break
+        data = json.loads(raw)
+        serializer.submit(update_shard_key(data), Update.de_json(data, application.bot))
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_SECONDS
+    await serializer.drain(SHUTDOWN_DRAIN_SECONDS)
+    await stop_application(application, deadline)
+    logger.info(f"Telegram worker {shard} stopped")
+
+
+def _worker_main(shard: int, updates: multiprocessing.Queue, factory: Callable[[], Application]) -> None:
+    configure_logging()
+    asyncio.run(_serve_shard(shard, updates, factory))
+    release_resources()
+
+
+class ShardedUpdateRouter:
+    """Fan Telegram webhook updates out to worker processes by chat ID.
+
+    Each worker builds its own Application (and so its own agent, DB pools and
+    caches) from `factory`. Hashing on chat ID sends every update of a chat to
+    the same worker, whose ChatSerializer preserves per-chat ordering. With
+    zero workers, updates are processed in the calling process instead.
+    """
+
+    def __init__(self, factory: Callable[[], Application], workers: int = 0):
+        self.factory = factory
+        self.workers = workers
+        self._queues: List[multiprocessing.Queue] = []
+        self._processes: List[multiprocessing.Process] = []
+        self._application: Optional[Application] = None
+        self._serializer: Optional[ChatSerializer] = None
+
+    @property
+    def bot(self):
+        """A Bot for API calls made by the router itself (e.g. set_webhook)."""
+        return self._application.bot
+
+    async def start(self) -> None:
+        """Start worker processes, or an in-process Application when workers == 0."""
+        # The in-process Application is also used for set_webhook in sharded mode
+        self._application = self.factory()
+        if self.workers <= 0:
+            await start_application(self._application)
+            self._serializer = ChatSerializer(self._application)
+            return
+        await self._application.initialize()
+        # Workers send for the same bot, so they split its global send budget
+        os.environ["TELEGRAM_OUTBOX_PROCESSES"] = str(self.workers)
+        # Spawn (not fork) so children never share the parent's sockets or DB pools
+        context = multiprocessing.get_context("spawn")
+        for shard in range(self.workers):
+            updates = context.Queue()
+            process = context.Process(
+                target=_worker_main, args=(shard, updates, self.factory),
+                name=f"telegram-worker-{shard}", daemon=True,
+            )
+            process.start()
+            self._queues.append(updates)
+            self._processes.append(process)
+        logger.info(f"Started {self.workers} Telegram worker processes")
+
+    def dispatch(self, raw: bytes) -> None:
+        """Route one raw update body to its shard."""
+        data = json.loads(raw)
+        chat_id = update_shard_key(data)
+        if self._serializer is not None:
+            self._serializer.submit(chat_id, Update.de_json(data, self._application.bot))
+            metrics.inc("telegram_updates_total", shard="local")
+            return
+        # crc32 is stable across processes, unlike hash() on str/bytes
+        shard = zlib.crc32(str(chat_id).encode()) % self.workers
+        self._queues[shard].put_nowait(raw)
+        metrics.inc("telegram_updates_total", shard=str(shard))
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Let workers finish queued updates, then shut everything down, all within `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+
+        def remaining() -> float:
+            return max(0.0, deadline - time.monotonic())
+
+        if self._serializer is not None:
+            await self._serializer.drain(remaining())
+            await stop_application(self._application, deadline)
+            return
+        for updates in self._queues:
+            updates.put(None)
+        # Workers drain in parallel, so they share one deadline
+        await asyncio.gather(*(asyncio.to_thread(process.join, remaining()) for process in self._processes))
+        for process in self._processes:
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop in time; terminating")
+                process.terminate()
+        if self._application is not None:
+            await self._application.shutdown()
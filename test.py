@@ -33,6 +33,9 @@ import requests
 from io import BytesIO
 import uvicorn
 
+from logging_setup import configure_logging, new_correlation_id
+from loop_watchdog import start_loop_watchdog
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -233,7 +236,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         chat_id = update.effective_chat.id
         user_id = update.effective_user.id
         
-        logging.info(f"Received message from user {user_id} in chat {chat_id}: {user_message}")
+        new_correlation_id(f"tg-{update.update_id}")
+        logging.info("Received message", extra={"fields": {"chars": len(user_message)}})
         
         # Send typing action to show the bot is working
         await context.bot.send_chat_action(chat_id=chat_id, action="typing")
@@ -297,6 +301,16 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         )
         await update.effective_message.reply_text(error_message)
 
+async def on_startup(application: Application) -> None:
+    """Start the event-loop watchdog once polling has started."""
+    application.bot_data["watchdog"] = start_loop_watchdog("telegram")
+
+async def on_shutdown(application: Application) -> None:
+    """Stop the event-loop watchdog."""
+    watchdog = application.bot_data.pop("watchdog", None)
+    if watchdog:
+        await watchdog.stop()
+
 def run_telegram_bot():
     """Start the Telegram bot."""
     # Set up logging
@@ -311,6 +325,8 @@ def run_telegram_bot():
         Application.builder()
         .token(TELEGRAM_BOT_TOKEN)
         .concurrent_updates(True)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
         .build()
     )
     
@@ -338,5 +354,6 @@ def run_telegram_bot():
         raise
 
 if __name__ == '__main__':
+    configure_logging()
     # Start the Telegram bot
     run_telegram_bot()
@@ -0,0 +1,38 @@
+import json
+import logging
+import queue
+
+from logging_setup import StructuredFormatter, StructuredQueueHandler, TextFormatter
+
+
+def _log_exception_through_queue() -> logging.LogRecord:
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    logger = logging.getLogger("tests.logging_queue")
+    logger.propagate = False
+    handler = StructuredQueueHandler(log_queue)
+    logger.addHandler(handler)
+    try:
+        try:
+            raise ValueError("lookup failed for +91 98765 43210")
+        except ValueError:
+            logger.exception("Reply to %s failed", "+91 98765 43210")
+    finally:
+        logger.removeHandler(handler)
+    return log_queue.get_nowait()
+
+
+def test_exception_keeps_its_own_field_through_the_queue():
+    entry = json.loads(StructuredFormatter().format(_log_exception_through_queue()))
+
+    assert entry["msg"] == "Reply to ***3210 failed"
+    assert "Traceback" in entry["exc"]
+    assert "ValueError: lookup failed for ***3210" in entry["exc"]
+    assert "98765" not in entry["exc"]
+
+
+def test_text_format_appends_masked_traceback():
+    line = TextFormatter().format(_log_exception_through_queue())
+
+    assert "Reply to ***3210 failed" in line
+    assert "ValueError: lookup failed for ***3210" in line
+    assert "98765" not in line
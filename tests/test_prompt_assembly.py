@@ -0,0 +1,54 @@
+from agno.memory.v2.memory import Memory, SessionSummary
+from agno.storage.session.agent import AgentSession
+
+import prompt_assembly
+from context_cache import ContextSnapshot
+from prompt_assembly import StablePrefixAgent
+
+
+def _snapshot(session_id: str, input_tokens: int, state: dict) -> ContextSnapshot:
+    session = AgentSession(
+        session_id=session_id,
+        user_id=session_id,
+        memory={"runs": []},
+        session_data={"session_metrics": {"input_tokens": input_tokens}, "session_state": state},
+        updated_at=1,
+    )
+    return ContextSnapshot(
+        user_id=session_id, session=session, version=(1, 0), runs=[], summary=None,
+        memories_text="", summary_text="",
+    )
+
+
+def test_cache_hits_restore_each_sessions_own_state(monkeypatch):
+    snapshots = {
+        "whatsapp_1": _snapshot("whatsapp_1", 100, {"goal": "house"}),
+        "whatsapp_2": _snapshot("whatsapp_2", 7, {"goal": "car"}),
+    }
+    monkeypatch.setattr(prompt_assembly.context_cache, "lookup", lambda agent, session_id: snapshots[session_id])
+    agent = StablePrefixAgent(memory=Memory())
+
+    for session_id, input_tokens, goal in [
+        ("whatsapp_1", 100, "house"), ("whatsapp_2", 7, "car"), ("whatsapp_1", 100, "house"),
+    ]:
+        # What agent.run/arun do before reading the session
+        agent.reset_session_state()
+        agent.read_from_storage(session_id)
+        assert agent.session_metrics.input_tokens == input_tokens
+        assert agent.session_state == {"goal": goal}
+        # The run updates state in place; the snapshot must not see it
+        agent.session_state["goal"] = "changed"
+
+    assert snapshots["whatsapp_1"].session.session_data["session_state"] == {"goal": "house"}
+
+
+def test_cache_hit_keeps_other_sessions_summaries(monkeypatch):
+    snapshot = _snapshot("whatsapp_1", 100, {})
+    monkeypatch.setattr(prompt_assembly.context_cache, "lookup", lambda agent, session_id: snapshot)
+    agent = StablePrefixAgent(memory=Memory())
+    other = SessionSummary(summary="Saving for a car")
+    agent.memory.summaries = {"whatsapp_2": {"whatsapp_2": other}}
+
+    agent.read_from_storage("whatsapp_1")
+
+    assert agent.memory.summaries["whatsapp_2"]["whatsapp_2"] is other
@@ -0,0 +1,33 @@
+import time
+
+import rate_limit
+from rate_limit import LocalRateLimiter
+
+
+def test_sustained_sender_gets_configured_rate(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_GLOBAL_PER_SECOND", 1000.0)
+    limiter = LocalRateLimiter()
+
+    accepted = 0
+    # One message every 3 seconds for 5 minutes: far above 10/minute
+    for _ in range(100):
+        if limiter.check("whatsapp_919876543210") is None:
+            accepted += 1
+        now[0] += 3.0
+
+    per_minute = rate_limit.RATE_LIMIT_USER_PER_MINUTE
+    assert accepted <= rate_limit.RATE_LIMIT_USER_BURST + per_minute * 5 + 1
+
+
+def test_idle_bucket_expires_full(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    limiter = LocalRateLimiter()
+
+    while limiter.check("u") is None:
+        pass
+    now[0] += 600.0
+
+    assert limiter.check("u") is None
@@ -0,0 +1,44 @@
+import pytest
+
+from routing import FINANCE, FINANCE_KEYWORDS, SMALL_TALK, classify_turn, route_turn
+from tool_profiles import CALC
+
+
+@pytest.mark.parametrize("text", [
+    "Calculate CAGR of Nifty over 5 years",
+    "What is the CAGR of Reliance Industries since 2019?",
+    "calculate cagr of nifty 50 since 2015",
+    "Compute the XIRR of my TCS buys",
+])
+def test_calculations_on_market_data_get_data_tools(text):
+    assert route_turn(text) != CALC
+
+
+@pytest.mark.parametrize("text", [
+    "Calculate CAGR if 1 lakh became 3 lakh in 7 years",
+    "How much will 5000 monthly SIP grow to in 10 years at 12%?",
+    "What corpus will I have if I step up my SIP by 10% every year?",
+])
+def test_pure_calculations_use_calc_profile(text):
+    assert route_turn(text) == CALC
+
+
+@pytest.mark.parametrize("text", ["hi", "Thanks so much!", "good morning tara", "hello, kaise ho?", "cheers", "😊🙏"])
+def test_greetings_and_thanks_are_small_talk(text):
+    assert classify_turn(text) == SMALL_TALK
+
+
+@pytest.mark.parametrize("text", ["yes", "haan", "ok", "theek hai", "sure", "nahi"])
+def test_bare_confirmations_go_to_the_finance_agent(text):
+    # They usually answer Tara's own follow-up question, which may need tools
+    assert classify_turn(text) == FINANCE
+
+
+@pytest.mark.parametrize("text", ["my savings", "investing kaise karu", "rs. 500", "₹500", "interest rates?"])
+def test_finance_keywords_route_to_finance(text):
+    assert classify_turn(text) == FINANCE
+
+
+@pytest.mark.parametrize("text", ["cheers", "Bharat", "emily"])
+def test_finance_keywords_match_whole_words(text):
+    assert FINANCE_KEYWORDS.search(text) is None
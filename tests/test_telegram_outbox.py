@@ -0,0 +1,31 @@
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+from telegram_outbox import TelegramOutbox
+
+
+def test_retry_after_pauses_every_chat():
+    async def run():
+        outbox = TelegramOutbox()
+        attempts = []
+
+        async def flooded():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(0.3)
+            return "a"
+
+        async def other():
+            return time.monotonic()
+
+        started = time.monotonic()
+        first = outbox.submit(1, flooded)
+        await asyncio.sleep(0.05)
+        sent_at = await outbox.submit(2, other)
+        assert await first == "a"
+        await outbox.close()
+        return sent_at - started
+
+    assert asyncio.run(run()) >= 0.3
@@ -0,0 +1,24 @@
+import asyncio
+import time
+
+from telegram_workers import ChatSerializer
+
+
+class _SlowApplication:
+    async def process_update(self, update):
+        await asyncio.sleep(update)
+
+
+def test_drain_stops_waiting_at_the_timeout():
+    async def run():
+        serializer = ChatSerializer(_SlowApplication())
+        serializer.submit(1, 0.01)
+        serializer.submit(2, 10)
+        started = time.monotonic()
+        unfinished = await serializer.drain(0.2)
+        return unfinished, time.monotonic() - started
+
+    unfinished, elapsed = asyncio.run(run())
+
+    assert unfinished == 1
+    assert elapsed < 1
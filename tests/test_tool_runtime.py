@@ -0,0 +1,55 @@
+import asyncio
+import threading
+import time
+
+from agno.tools.function import Function, FunctionCall
+
+import tool_runtime
+from metrics import metrics
+from resilience import guard_tool_call
+from tool_runtime import ParallelToolsOpenAIChat, time_tool_call
+
+
+def _failing_quote(symbol):
+    raise ConnectionError("yfinance down")
+
+
+def test_degraded_tool_result_is_not_counted_as_ok():
+    def guarded(**arguments):
+        return guard_tool_call("get_current_stock_price", _failing_quote, arguments)
+
+    result = time_tool_call("get_current_stock_price", guarded, {"symbol": "RELIANCE.NS"})
+
+    assert "unavailable" in result
+    counts = metrics.snapshot()["tool_call_seconds_count"]
+    assert counts.get('{status="degraded",tool="get_current_stock_price"}') == 1
+    assert '{status="ok",tool="get_current_stock_price"}' not in counts
+
+
+def test_async_tool_calls_of_a_step_are_bounded(monkeypatch):
+    monkeypatch.setattr(tool_runtime, "TOOL_MAX_PARALLEL", 2)
+    lock = threading.Lock()
+    running, peak = [0], [0]
+
+    def lookup(symbol: str) -> str:
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return symbol
+
+    function = Function.from_callable(lookup)
+    calls = [FunctionCall(function=function, arguments={"symbol": f"S{i}"}, call_id=str(i)) for i in range(6)]
+    results = []
+
+    async def run_step():
+        model = ParallelToolsOpenAIChat(id="gpt-4.1-mini", api_key="test")
+        async for _ in model.arun_function_calls(calls, results):
+            pass
+
+    asyncio.run(run_step())
+
+    assert peak[0] == 2
+    assert [message.content for message in results] == [f"S{i}" for i in range(6)]
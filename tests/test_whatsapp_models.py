@@ -0,0 +1,42 @@
+import json
+
+from whatsapp_models import has_messages, parse_webhook
+
+
+def _delivery(*messages) -> bytes:
+    return json.dumps({
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "1", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp", "messages": list(messages),
+        }}]}],
+    }).encode()
+
+
+def test_invalid_message_does_not_drop_the_rest_of_the_delivery():
+    payload = parse_webhook(_delivery(
+        {"from": "919876543210", "id": "wamid.1", "type": "text", "text": {"body": "hi"}},
+        {"from": "919876543210", "type": "text", "text": {"body": "no id"}},
+        {"from": "919876543211", "id": "wamid.3", "type": "text", "text": {"body": "SIP?"}},
+    ))
+
+    assert [message.id for message in payload.iter_messages()] == ["wamid.1", "wamid.3"]
+
+
+def test_status_only_delivery_has_no_messages():
+    raw = json.dumps({
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "1", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"display_phone_number": "15550001111", "phone_number_id": "123"},
+            "statuses": [{"id": "wamid.1", "status": "read", "timestamp": "1700000000",
+                          "recipient_id": "919876543210"}],
+        }}]}],
+    }).encode()
+
+    assert not has_messages(raw)
+
+
+def test_delivery_with_messages_is_detected():
+    assert has_messages(_delivery({"from": "919876543210", "id": "wamid.1", "type": "text",
+                                   "text": {"body": "hi"}}))
+    assert has_messages(b'{"entry":[{"changes":[{"value":{"messages" :\n [{}]}}]}]}')
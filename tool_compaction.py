@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Set TOOL_RESULT_COMPACTION=0 to pass tool results to the model verbatim
+TOOL_RESULT_COMPACTION = os.getenv("TOOL_RESULT_COMPACTION", "1") != "0"
+# Longest company description / web snippet kept, in characters
+COMPANY_SUMMARY_CHARS = int(os.getenv("COMPANY_SUMMARY_CHARS", "300"))
+WEB_SNIPPET_CHARS = int(os.getenv("WEB_SNIPPET_CHARS", "400"))
+
+
+def _truncate(text: Optional[str], limit: int) -> Optional[str]:
+    if not text or len(text) <= limit:
+        return text
+    cut = text[:limit].rsplit(" ", 1)[0]
+    return cut.rstrip(",.;: ") + "…"
+
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if number != number else number  # NaN
+
+
+def _indian_grouping(number: float) -> str:
+    """Whole number with Indian digit grouping (1,52,340)."""
+    digits = str(abs(round(number)))
+    head, tail = digits[:-3], digits[-3:]
+    groups = []
+    while len(head) > 2:
+        groups.insert(0, head[-2:])
+        head = head[:-2]
+    if head:
+        groups.insert(0, head)
+    return ("-" if number < 0 else "") + ",".join(groups + [tail])
+
+
+def _amount(value: Any, currency: str) -> Optional[str]:
+    """Large amounts in crore for INR (billions otherwise), e.g. 1523400000000 -> "1,52,340 Cr INR"."""
+    number = _number(value)
+    if number is None:
+        return None
+    if currency == "INR":
+        return f"{_indian_grouping(number / 1e7)} Cr INR" if abs(number) >= 1e7 else f"{number:,.2f} INR"
+    return f"{number / 1e9:,.2f}B {currency}" if abs(number) >= 1e9 else f"{number:,.2f} {currency}"
+
+
+def _percent(value: Any) -> Optional[str]:
+    number = _number(value)
+    return None if number is None else f"{number * 100:.1f}%"
+
+
+def _rounded(value: Any) -> Optional[float]:
+    number = _number(value)
+    return None if number is None else round(number, 2)
+
+
+def _drop_empty(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in data.items() if value not in (None, "", [], {})}
+
+
+def compact_company_info(raw: str) -> str:
+    """Keep identity, valuation and quality fields; drop address/website; normalize numbers."""
+    info = json.loads(raw)
+    # agno formats price and market cap as "<value> <currency>"
+    price, _, currency = str(info.get("Current Stock Price") or "").partition(" ")
+    currency = currency or "INR"
+    market_cap = str(info.get("Market Cap") or "").partition(" ")[0]
+    return json.dumps(_drop_empty({
+        "name": info.get("Name"),
+        "symbol": info.get("Symbol"),
+        "sector": info.get("Sector"),
+        "industry": info.get("Industry"),
+        "price": _rounded(price),
+        "currency": currency,
+        "market_cap": _amount(market_cap, currency),
+        "pe": _rounded(info.get("P/E Ratio")),
+        "eps": _rounded(info.get("EPS")),
+        "52w_low": _rounded(info.get("52 Week Low")),
+        "52w_high": _rounded(info.get("52 Week High")),
+        "50d_avg": _rounded(info.get("50 Day Average")),
+        "200d_avg": _rounded(info.get("200 Day Average")),
+        "revenue_growth": _percent(info.get("Revenue Growth")),
+        "gross_margin": _percent(info.get("Gross Margins")),
+        "ebitda_margin": _percent(info.get("Ebitda Margins")),
+        "ebitda": _amount(info.get("EBITDA"), currency),
+        "free_cash_flow": _amount(info.get("Free Cash flow"), currency),
+        "total_cash": _amount(info.get("Total Cash"), currency),
+        "analyst_rating": info.get("Analyst Recommendation"),
+        "analyst_count": info.get("Number Of Analyst Opinions"),
+        "summary": _truncate(info.get("Summary"), COMPANY_SUMMARY_CHARS),
+    }), ensure_ascii=False)
+
+
+_RATINGS = (("strongBuy", "strong_buy"), ("buy", "buy"), ("hold", "hold"), ("sell", "sell"), ("strongSell", "strong_sell"))
+
+
+def compact_analyst_recommendations(raw: str) -> str:
+    """One row of rating counts per period, latest first."""
+    table = json.loads(raw)
+    rows = table.values() if isinstance(table, dict) else table
+    periods = []
+    for row in rows:
+        entry = {"period": row.get("period")}
+        entry.update({short: int(row.get(key) or 0) for key, short in _RATINGS})
+        periods.append(entry)
+    return json.dumps(periods)
+
+
+def compact_company_news(raw: str) -> str:
+    """Headlines only: title, publisher and date (handles old and new yfinance news formats)."""
+    stories = json.loads(raw)
+    headlines: List[Dict[str, Any]] = []
+    for story in stories:
+        content = story.get("content") or story
+        provider = content.get("provider")
+        published = content.get("pubDate") or content.get("displayTime")
+        if published is None and story.get("providerPublishTime"):
+            published = datetime.fromtimestamp(story["providerPublishTime"], tz=timezone.utc).isoformat()
+        headlines.append(_drop_empty({
+            "title": content.get("title"),
+            "publisher": provider.get("displayName") if isinstance(provider, dict) else story.get("publisher"),
+            "date": str(published)[:10] if published else None,
+        }))
+    return json.dumps(headlines, ensure_ascii=False)
+
+
+def compact_web_search(raw: str) -> str:
+    """Tavily answer plus title, URL and a short snippet per result (scores dropped)."""
+    response = json.loads(raw)
+    return json.dumps(_drop_empty({
+        "answer": response.get("answer"),
+        "results": [
+            _drop_empty({
+                "title": result.get("title"),
+                "url": result.get("url"),
+                "snippet": _truncate(result.get("content"), WEB_SNIPPET_CHARS),
+            })
+            for result in response.get("results", [])
+        ],
+    }), ensure_ascii=False)
+
+
+# Tool function name -> compactor of its (JSON) result
+COMPACTORS: Dict[str, Callable[[str], str]] = {
+    "get_company_info": compact_company_info,
+    "get_analyst_recommendations": compact_analyst_recommendations,
+    "get_company_news": compact_company_news,
+    "web_search_using_tavily": compact_web_search,
+}
+
+
+def compact_tool_result(function_name: str, function_call: Callable, arguments: Dict[str, Any]) -> Any:
+    """Tool hook projecting large tool results down to what Tara uses.
+
+    The compacted result is what the model sees and what is stored in the
+    session. Results that are not the expected JSON (errors, degraded
+    results) pass through unchanged.
+    """
+    result = function_call(**arguments)
+    compactor = COMPACTORS.get(function_name)
+    if not TOOL_RESULT_COMPACTION or compactor is None or not isinstance(result, str):
+        return result
+    try:
+        compacted = compactor(result)
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.debug(f"Tool result of {function_name} left as is: {e}")
+        return result
+    bytes_in, bytes_out = len(result.encode()), len(compacted.encode())
+    metrics.inc("tool_result_bytes_in_total", bytes_in, tool=function_name)
+    metrics.inc("tool_result_bytes_out_total", bytes_out, tool=function_name)
+    logger.debug("Tool result compacted", extra={"fields": {
+        "tool": function_name, "bytes_in": bytes_in, "bytes_out": bytes_out,
+    }})
+    return compacted
@@ -0,0 +1,74 @@
+import json
+from typing import Dict, List
+
+from agno.tools import Toolkit
+from agno.tools.reasoning import ReasoningTools
+from agno.tools.tavily import TavilyTools
+from agno.tools.yfinance import YFinanceTools
+
+from documents import DocumentTools
+from finance_tools import PortfolioTools
+from price_store import PriceHistoryTools
+
+# Profile names; FULL keeps every tool and is the fallback for anything unclassified
+QUOTE = "quote"
+NEWS = "news"
+COMPANY = "company"
+CALC = "calc"
+FULL = "full"
+
+
+def build_tool_profiles() -> Dict[str, List[Toolkit]]:
+    """Build the toolkits exposed to the model for each turn intent.
+
+    Every tool schema (and ReasoningTools' instructions) is sent with every
+    request, so narrower profiles shrink the prompt for common questions.
+    """
+    return {
+        # Tavily returns JSON so tool_compaction can trim it before the model sees it
+        QUOTE: [
+            YFinanceTools(stock_price=True),
+            TavilyTools(format="json"),
+        ],
+        NEWS: [
+            YFinanceTools(stock_price=False, company_news=True),
+            TavilyTools(format="json"),
+        ],
+        COMPANY: [
+            YFinanceTools(stock_price=True, analyst_recommendations=True, company_info=True),
+            PriceHistoryTools(),
+        ],
+        CALC: [
+            PortfolioTools(),
+        ],
+        FULL: [
+            TavilyTools(format="json"),
+            ReasoningTools(add_instructions=True),
+            YFinanceTools(
+                stock_price=True,
+                analyst_recommendations=True,
+                company_info=True,
+                company_news=True,
+            ),
+            # Historical returns from the local price store (no download per question)
+            PriceHistoryTools(),
+            # Native SIP/XIRR/CAGR/goal/allocation maths instead of multi-step reasoning
+            PortfolioTools(),
+            DocumentTools(),
+        ],
+    }
+
+
+def estimate_prompt_chars(system_message: str, tools: List[Toolkit]) -> int:
+    """Size of the static prompt: system message and tool schemas.
+
+    Toolkit instructions are not counted; agno only adds them to its default
+    system message, never to a custom system_message.
+    """
+    size = len(system_message or "")
+    for toolkit in tools:
+        for function in toolkit.functions.values():
+            # agno does this on first use anyway; it fills in the JSON schema
+            function.process_entrypoint()
+            size += len(json.dumps({"type": "function", "function": function.to_dict()}))
+    return size
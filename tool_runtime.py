@@ -0,0 +1,197 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from inspect import isasyncgenfunction, iscoroutinefunction
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from agno.exceptions import AgentRunException
+from agno.models.message import Message
+from agno.tools.function import FunctionCall
+from agno.utils.timer import Timer
+
+from metrics import metrics
+from resilience import DegradedToolResult, ResilientOpenAIChat
+
+logger = logging.getLogger(__name__)
+
+# Most tool calls from one model step that run at the same time
+TOOL_MAX_PARALLEL = int(os.getenv("TOOL_MAX_PARALLEL", "4"))
+# Threads shared by all turns in the process for parallel tool calls
+TOOL_POOL_SIZE = int(os.getenv("TOOL_POOL_SIZE", "16"))
+
+_tool_pool = ThreadPoolExecutor(max_workers=TOOL_POOL_SIZE, thread_name_prefix="tool")
+
+# Slots for the tool calls of the model step being run on the async path
+_step_slots: contextvars.ContextVar[Optional[asyncio.Semaphore]] = contextvars.ContextVar(
+    "tool_step_slots", default=None
+)
+
+
+def time_tool_call(function_name: str, function_call: Callable, arguments: Dict[str, Any]) -> Any:
+    """Tool hook recording how long each tool call takes and whether it raised or was degraded."""
+    started = time.perf_counter()
+    status = "error"
+    try:
+        result = function_call(**arguments)
+        status = "degraded" if isinstance(result, DegradedToolResult) else "ok"
+        return result
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe("tool_call_seconds", elapsed, tool=function_name, status=status)
+        logger.debug("Tool call finished", extra={"fields": {
+            "tool": function_name, "status": status, "elapsed_ms": round(elapsed * 1000),
+        }})
+
+
+def _runs_inline(function_call: FunctionCall) -> bool:
+    """Calls that pause the run or need the user are left to agno's sequential path."""
+    function = function_call.function
+    return (
+        function.requires_confirmation
+        or function.requires_user_input
+        or function.external_execution
+        or function.name == "get_user_input"
+    )
+
+
+class ParallelToolsOpenAIChat(ResilientOpenAIChat):
+    """OpenAIChat that runs independent tool calls from one model step concurrently.
+
+    agno executes a step's tool calls one after another in the thread running
+    the agent, so a comparison turn pays the sum of its YFinance and Tavily
+    latencies. Here up to TOOL_MAX_PARALLEL calls of a step run at once on a
+    shared pool; their events and results are still emitted in the order the
+    model asked for them, so the conversation is identical to a sequential run.
+
+    On the async path (agent.arun) agno gathers all of a step's calls at once;
+    each waits for one of the step's TOOL_MAX_PARALLEL slots, and sync tools
+    run on the same shared pool instead of the loop's default executor.
+    """
+
+    def run_function_calls(
+        self,
+        function_calls: List[FunctionCall],
+        function_call_results: List[Message],
+        additional_messages: Optional[List[Message]] = None,
+        current_function_call_count: int = 0,
+        function_call_limit: Optional[int] = None,
+    ) -> Iterator[Any]:
+        if (
+            TOOL_MAX_PARALLEL <= 1
+            or len(function_calls) < 2
+            or function_call_limit is not None
+            or any(_runs_inline(fc) for fc in function_calls)
+        ):
+            yield from super().run_function_calls(
+                function_calls=function_calls,
+                function_call_results=function_call_results,
+                additional_messages=additional_messages,
+                current_function_call_count=current_function_call_count,
+                function_call_limit=function_call_limit,
+            )
+            return
+
+        if additional_messages is None:
+            additional_messages = []
+        started = time.perf_counter()
+        # Per call: (events, results, additional messages), filled by the worker thread
+        outputs: List[tuple] = [([], [], []) for _ in function_calls]
+
+        def run_one(index: int) -> None:
+            events, results, extra = outputs[index]
+            for event in self.run_function_call(
+                function_call=function_calls[index], function_call_results=results, additional_messages=extra
+            ):
+                events.append(event)
+
+        # Bounded fan-out: keep at most TOOL_MAX_PARALLEL calls of this turn in flight
+        pending = list(range(len(function_calls)))
+        futures: Dict[Future, int] = {}
+        errors: Dict[int, BaseException] = {}
+        while pending or futures:
+            while pending and len(futures) < TOOL_MAX_PARALLEL:
+                index = pending.pop(0)
+                # Copy contextvars so the correlation ID follows the call into the pool thread
+                context = contextvars.copy_context()
+                futures[_tool_pool.submit(context.run, run_one, index)] = index
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures.pop(future)
+                if future.exception() is not None:
+                    errors[index] = future.exception()
+
+        wall = time.perf_counter() - started
+        metrics.inc("tool_parallel_batches_total")
+        metrics.observe("tool_batch_seconds", wall, calls=str(len(function_calls)))
+        logger.info("Ran tool calls in parallel", extra={"fields": {
+            "tools": [fc.function.name for fc in function_calls],
+            "wall_ms": round(wall * 1000),
+        }})
+
+        for index, (events, results, extra) in enumerate(outputs):
+            yield from events
+            # A call that raised aborts the run at the same point the sequential path would
+            if index in errors:
+                raise errors[index]
+            function_call_results.extend(results)
+            additional_messages.extend(extra)
+        if additional_messages:
+            function_call_results.extend(additional_messages)
+
+    async def arun_function_calls(
+        self,
+        function_calls: List[FunctionCall],
+        function_call_results: List[Message],
+        additional_messages: Optional[List[Message]] = None,
+        current_function_call_count: int = 0,
+        function_call_limit: Optional[int] = None,
+        skip_pause_check: bool = False,
+    ) -> AsyncIterator[Any]:
+        # Child tasks of agno's gather copy this context, so the step's calls share its slots
+        previous = _step_slots.get()
+        _step_slots.set(asyncio.Semaphore(max(TOOL_MAX_PARALLEL, 1)))
+        try:
+            async for event in super().arun_function_calls(
+                function_calls=function_calls,
+                function_call_results=function_call_results,
+                additional_messages=additional_messages,
+                current_function_call_count=current_function_call_count,
+                function_call_limit=function_call_limit,
+                skip_pause_check=skip_pause_check,
+            ):
+                yield event
+        finally:
+            _step_slots.set(previous)
+
+    async def arun_function_call(
+        self, function_call: FunctionCall
+    ) -> Tuple[Union[bool, AgentRunException], Timer, FunctionCall]:
+        async with _step_slots.get() or contextlib.nullcontext():
+            return await self._arun_function_call(function_call)
+
+    async def _arun_function_call(
+        self, function_call: FunctionCall
+    ) -> Tuple[Union[bool, AgentRunException], Timer, FunctionCall]:
+        function = function_call.function
+        if (
+            iscoroutinefunction(function.entrypoint)
+            or isasyncgenfunction(function.entrypoint)
+            or any(iscoroutinefunction(hook) for hook in function.tool_hooks or [])
+        ):
+            return await super().arun_function_call(function_call)
+        timer = Timer()
+        timer.start()
+        success: Union[bool, AgentRunException] = False
+        # Copy contextvars so the correlation ID and current user follow the call into the pool thread
+        context = contextvars.copy_context()
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(_tool_pool, context.run, function_call.execute)
+            success = result.status == "success"
+        except AgentRunException as e:
+            success = e
+        timer.stop()
+        return success, timer, function_call
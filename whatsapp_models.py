@@ -0,0 +1,137 @@
+import logging
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Media message types we know how to download, in the order they are checked
+MEDIA_TYPES = ("image", "audio", "video", "document")
+
+# A "messages" list in a change value; every change also has "field": "messages", which must not match
+_MESSAGES_KEY = re.compile(rb'"messages"\s*:\s*\[')
+
+
+class WhatsAppMessage(BaseModel):
+    """Outbound message sent to the WhatsApp Cloud API."""
+    messaging_product: str
+    to: str
+    recipient_type: str = "individual"
+    type: str
+    text: Optional[Dict[str, str]] = None
+    image: Optional[Dict[str, str]] = None
+    audio: Optional[Dict[str, str]] = None
+    video: Optional[Dict[str, str]] = None
+    document: Optional[Dict[str, str]] = None
+
+
+class TextBody(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    body: str = ""
+
+
+class MediaRef(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    id: Optional[str] = None
+    caption: str = ""
+    mime_type: Optional[str] = None
+    filename: Optional[str] = None
+    sha256: Optional[str] = None
+
+
+class InboundMessage(BaseModel):
+    """A single user message from the webhook's value.messages list."""
+    model_config = ConfigDict(extra="ignore", populate_by_name=True)
+
+    from_: str = Field(alias="from")
+    id: str
+    type: Optional[str] = None
+    timestamp: Optional[str] = None
+    text: Optional[TextBody] = None
+    image: Optional[MediaRef] = None
+    audio: Optional[MediaRef] = None
+    video: Optional[MediaRef] = None
+    document: Optional[MediaRef] = None
+
+    def media(self) -> Tuple[Optional[str], Optional[MediaRef]]:
+        """Return (media_type, media) for the first media attachment, if any."""
+        for media_type in MEDIA_TYPES:
+            media = getattr(self, media_type)
+            if media is not None:
+                return media_type, media
+        return None, None
+
+
+class ChangeValue(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    messaging_product: Optional[str] = None
+    messages: List[InboundMessage] = []
+    # Delivery/read receipts; kept loosely typed since we only count them
+    statuses: List[Dict[str, Any]] = []
+
+    @field_validator("messages", mode="before")
+    @classmethod
+    def _skip_invalid_messages(cls, messages: Any) -> Any:
+        """Drop malformed messages one by one, so they don't cost the valid ones in the same delivery."""
+        if not isinstance(messages, list):
+            return messages
+        valid = []
+        for message in messages:
+            try:
+                valid.append(InboundMessage.model_validate(message))
+            except ValidationError as e:
+                metrics.inc("whatsapp_messages_skipped_total", reason="invalid")
+                logger.warning("Skipping invalid WhatsApp message", extra={"fields": {"errors": e.error_count()}})
+        return valid
+
+
+class Change(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    field: Optional[str] = None
+    value: ChangeValue = ChangeValue()
+
+
+class Entry(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    id: Optional[str] = None
+    changes: List[Change] = []
+
+
+class WhatsAppWebhookPayload(BaseModel):
+    """Inbound webhook delivery from the WhatsApp Cloud API."""
+    model_config = ConfigDict(extra="ignore")
+
+    object: str
+    entry: List[Entry]
+
+    def iter_messages(self) -> Iterator[InboundMessage]:
+        """Yield every user message in the delivery, skipping status updates."""
+        for entry in self.entry:
+            for change in entry.changes:
+                yield from change.value.messages
+
+
+def has_messages(raw: bytes) -> bool:
+    """Cheap pre-check for the common status-only delivery.
+
+    Delivered/read receipts carry a "statuses" list and no "messages" list, so a
+    byte search lets us acknowledge them without decoding or validating.
+    """
+    return _MESSAGES_KEY.search(raw) is not None
+
+
+def parse_webhook(raw: bytes) -> WhatsAppWebhookPayload:
+    """Decode and validate a raw webhook body in one pass.
+
+    Uses pydantic-core's native JSON parser directly on the bytes, so there is
+    no intermediate dict from json.loads. Raises pydantic.ValidationError.
+    """
+    return WhatsAppWebhookPayload.model_validate_json(raw)